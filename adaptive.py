@@ -0,0 +1,98 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+##
+## Copyright 2024 Henry Kroll <nospam@thenerdshow.com>
+##
+## This program is free software; you can redistribute it and/or modify
+## it under the terms of the GNU General Public License as published by
+## the Free Software Foundation; either version 2 of the License, or
+## (at your option) any later version.
+##
+## This program is distributed in the hope that it will be useful,
+## but WITHOUT ANY WARRANTY; without even the implied warranty of
+## MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+## GNU General Public License for more details.
+##
+## You should have received a copy of the GNU General Public License
+## along with this program; if not, write to the Free Software
+## Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston,
+## MA 02110-1301, USA.
+##
+## Pick the chunk length (and batch size) from how fast the backend
+## actually is, instead of a fixed chunk_time.
+##
+## A caption shows up roughly chunk_time + transcription time after the
+## words were spoken. Short chunks mean quick captions, but every call
+## has overhead, so on a slow machine short chunks fall behind and
+## the queue grows. After every transcription, ChunkController looks at
+## the real-time factor and the queue, and makes chunks
+## - longer (and batches bigger) when transcription is falling behind,
+## - shorter when captions take longer than target_latency,
+## - longer again, for accuracy, when there is plenty of room.
+import metrics
+
+class ChunkController:
+    def __init__(self, chunk_time=2, min_time=1, max_time=10, target_latency=3,
+            max_batch=1, step=1.25, every=3, smoothing=0.3, log=print):
+        self.min_time = min_time
+        self.max_time = max(min_time, max_time)
+        self.chunk_time = min(max(chunk_time, self.min_time), self.max_time)
+        self.target_latency = target_latency
+        self.max_batch = max(1, max_batch)
+        self.batch = 1
+        self.step = step           # grow or shrink by this factor
+        self.every = every         # decide after this many results
+        self.smoothing = smoothing # weight of the newest measurement
+        self.log = log
+        self.rtf = None            # smoothed seconds of work per second of audio
+        self.latency = None        # smoothed seconds per call
+        self.seen = 0
+        metrics.set_gauge("chunk_time", self.chunk_time)
+        metrics.set_gauge("batch_size", self.batch)
+
+    def smooth(self, old, new):
+        return new if old is None else old + self.smoothing * (new - old)
+
+    # One transcription call took elapsed seconds for audio_time seconds
+    # of audio, with queued chunks still waiting. Returns True if
+    # chunk_time or batch changed.
+    def observe(self, elapsed, audio_time, queued):
+        if audio_time <= 0: return False
+        self.rtf = self.smooth(self.rtf, elapsed / audio_time)
+        self.latency = self.smooth(self.latency, elapsed)
+        self.seen += 1
+        if self.seen < self.every: return False
+        self.seen = 0
+        return self.decide(queued)
+
+    def decide(self, queued):
+        chunk_time, batch = self.chunk_time, self.batch
+        # Expected caption delay: wait for the chunk, then transcribe it
+        expected = chunk_time * (1 + self.rtf)
+        if queued > 1 or self.rtf > 0.9:
+            # Falling behind. Fewer, longer calls amortize the overhead.
+            reason = "falling behind"
+            chunk_time *= self.step
+            if queued > 1: batch *= 2
+        elif expected > self.target_latency and self.rtf < 0.7:
+            # Shorter chunks cost more per second of audio, so only
+            # while there is headroom
+            reason = "captions too slow"
+            chunk_time /= self.step
+        elif expected * self.step < self.target_latency * 0.9 and self.rtf < 0.5:
+            reason = "room to spare"
+            chunk_time *= self.step
+        else:
+            reason = None
+        if not queued and batch > 1: batch //= 2
+        chunk_time = min(max(chunk_time, self.min_time), self.max_time)
+        batch = min(max(batch, 1), self.max_batch)
+        if chunk_time == self.chunk_time and batch == self.batch: return False
+        if self.log:
+            self.log(f"Chunks {self.chunk_time:.2f}s -> {chunk_time:.2f}s, batch {self.batch} -> {batch}"
+                f" ({reason or 'queue empty'}: rtf {self.rtf:.2f}, {self.latency:.2f}s per call,"
+                f" {queued} queued)")
+        self.chunk_time, self.batch = chunk_time, batch
+        metrics.set_gauge("chunk_time", chunk_time)
+        metrics.set_gauge("batch_size", batch)
+        return True
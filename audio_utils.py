@@ -0,0 +1,52 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+##
+## Copyright 2024 Henry Kroll <nospam@thenerdshow.com>
+##
+## This program is free software; you can redistribute it and/or modify
+## it under the terms of the GNU General Public License as published by
+## the Free Software Foundation; either version 2 of the License, or
+## (at your option) any later version.
+##
+## This program is distributed in the hope that it will be useful,
+## but WITHOUT ANY WARRANTY; without even the implied warranty of
+## MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+## GNU General Public License for more details.
+##
+## You should have received a copy of the GNU General Public License
+## along with this program; if not, write to the Free Software
+## Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston,
+## MA 02110-1301, USA.
+##
+## In-process audio conversion, so recorded chunks never have to take
+## a trip through the filesystem or an ffmpeg subprocess.
+import io
+import numpy as np
+import soundfile as sf
+
+model_rate = 16000 # Whisper wants 16kHz mono float32
+
+# Average the channels of a (frames, channels) recorder buffer
+def to_mono(audio):
+    if audio.ndim == 1: return audio
+    if audio.shape[1] == 1: return audio[:, 0]
+    return audio.mean(axis=1)
+
+# Linear interpolation. Plenty for speech, and free of extra dependencies.
+def resample(audio, from_rate, to_rate):
+    if from_rate == to_rate: return audio
+    frames = int(round(len(audio) * to_rate / from_rate))
+    src = np.arange(len(audio)) / from_rate
+    dst = np.arange(frames) / to_rate
+    return np.interp(dst, src, audio)
+
+# Turn a recorder buffer into what the whisper pipeline expects
+def to_model_input(audio, rate):
+    audio = resample(to_mono(audio), rate, model_rate)
+    return np.ascontiguousarray(audio, dtype=np.float32)
+
+# Encode a WAV in memory for the network backends
+def wav_bytes(audio, rate):
+    buf = io.BytesIO()
+    sf.write(buf, audio, samplerate=rate, format='WAV', subtype='PCM_16')
+    return buf.getvalue()
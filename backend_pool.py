@@ -0,0 +1,181 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+##
+## Copyright 2024 Henry Kroll <nospam@thenerdshow.com>
+##
+## This program is free software; you can redistribute it and/or modify
+## it under the terms of the GNU General Public License as published by
+## the Free Software Foundation; either version 2 of the License, or
+## (at your option) any later version.
+##
+## This program is distributed in the hope that it will be useful,
+## but WITHOUT ANY WARRANTY; without even the implied warranty of
+## MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+## GNU General Public License for more details.
+##
+## You should have received a copy of the GNU General Public License
+## along with this program; if not, write to the Free Software
+## Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston,
+## MA 02110-1301, USA.
+##
+## Spread chunks over several transcription servers.
+##
+## Each Endpoint wraps a send(payload) function for one server. The pool
+## sends each chunk to the endpoint with the fewest requests in flight
+## ("least_outstanding") or the lowest expected wait ("latency"). An
+## endpoint that keeps failing is ejected, and a background health check
+## puts it back once it answers again.
+##
+## Endpoints that can also submit(payload) without waiting get chunks
+## through EndpointPool.submit(), which returns a Future at once.
+import threading
+import time
+from concurrent.futures import Future
+
+LEAST_OUTSTANDING = "least_outstanding"
+LATENCY = "latency"
+STRATEGIES = (LEAST_OUTSTANDING, LATENCY)
+
+class Endpoint:
+    def __init__(self, name, send, check=None, submit=None):
+        self.name = name
+        self.send = send    # payload -> result, raises on failure
+        self.check = check  # () -> bool, is the server up?
+        self.submit = submit # payload -> Future of the result
+        self.outstanding = 0
+        self.latency = None # moving average, seconds
+        self.failures = 0   # in a row
+        self.ejected = False
+        self.requests = 0
+
+    # Expected wait if one more request is sent here
+    def cost(self):
+        return (self.latency or 0.001) * (self.outstanding + 1)
+
+class EndpointPool:
+    def __init__(self, endpoints, strategy=LEAST_OUTSTANDING, max_failures=3,
+            check_interval=10):
+        if strategy not in STRATEGIES:
+            raise ValueError(f"Unknown strategy: {strategy}")
+        if not endpoints:
+            raise ValueError("No endpoints")
+        self.endpoints = list(endpoints)
+        self.strategy = strategy
+        self.max_failures = max_failures
+        self.check_interval = check_interval
+        self.lock = threading.Lock()
+        self.stop_event = threading.Event()
+        self.checker = threading.Thread(target=self.health_thread, daemon=True)
+        self.checker.start()
+
+    def pick(self, tried):
+        candidates = [e for e in self.endpoints if not e.ejected and e not in tried]
+        if not candidates:
+            # Everything is down. Try the ejected ones rather than give up.
+            candidates = [e for e in self.endpoints if e not in tried]
+        if not candidates: return None
+        if self.strategy == LATENCY:
+            return min(candidates, key=Endpoint.cost)
+        return min(candidates, key=lambda e: (e.outstanding, e.latency or 0))
+
+    # Send payload to the best endpoint, failing over to the others
+    def send(self, payload):
+        tried = []
+        error = None
+        while True:
+            with self.lock:
+                endpoint = self.pick(tried)
+                if endpoint is None: break
+                endpoint.outstanding += 1
+                endpoint.requests += 1
+            tried.append(endpoint)
+            start = time.monotonic()
+            try:
+                result = endpoint.send(payload)
+            except Exception as e:
+                error = e
+                self.failed(endpoint)
+                continue
+            self.succeeded(endpoint, time.monotonic() - start)
+            return result
+        raise error or RuntimeError("No endpoints")
+
+    def failed(self, endpoint):
+        with self.lock:
+            endpoint.outstanding -= 1
+            endpoint.failures += 1
+            if endpoint.failures >= self.max_failures and not endpoint.ejected:
+                endpoint.ejected = True
+                print("Ejected", endpoint.name, "after", endpoint.failures, "failures")
+
+    def succeeded(self, endpoint, elapsed):
+        with self.lock:
+            endpoint.outstanding -= 1
+            endpoint.failures = 0
+            endpoint.latency = elapsed if endpoint.latency is None \
+                else endpoint.latency * 0.8 + elapsed * 0.2
+
+    # Like send(), without waiting for the result. Failing over to
+    # another endpoint sends the same payload again.
+    def submit(self, payload):
+        result = Future()
+        result.job = None # the endpoint's own Future, for cancel()
+        self.attempt(payload, result, [], None)
+        return result
+
+    def attempt(self, payload, result, tried, error):
+        with self.lock:
+            endpoint = self.pick(tried)
+            if endpoint is not None:
+                endpoint.outstanding += 1
+                endpoint.requests += 1
+        if endpoint is None:
+            result.set_exception(error or RuntimeError("No endpoints"))
+            return
+        tried.append(endpoint)
+        start = time.monotonic()
+        def finished(job):
+            if job.cancelled():
+                with self.lock: endpoint.outstanding -= 1
+                result.cancel()
+            elif job.exception() is not None:
+                self.failed(endpoint)
+                self.attempt(payload, result, tried, job.exception())
+            else:
+                self.succeeded(endpoint, time.monotonic() - start)
+                result.set_result(job.result())
+        try:
+            result.job = endpoint.submit(payload)
+        except Exception as e:
+            self.failed(endpoint)
+            return self.attempt(payload, result, tried, e)
+        result.job.add_done_callback(finished)
+
+    # Withdraw a submitted payload if the endpoint hasn't started on it
+    def cancel(self, result):
+        return result.job is not None and result.job.cancel()
+
+    def health_thread(self):
+        while not self.stop_event.wait(self.check_interval):
+            for endpoint in self.endpoints:
+                if not endpoint.check: continue
+                try:
+                    up = endpoint.check()
+                except Exception:
+                    up = False
+                with self.lock:
+                    if up and endpoint.ejected:
+                        print("Restored", endpoint.name)
+                        endpoint.ejected = False
+                        endpoint.failures = 0
+                    elif not up and not endpoint.ejected:
+                        print("Ejected", endpoint.name, "(health check failed)")
+                        endpoint.ejected = True
+
+    def stats(self):
+        with self.lock:
+            return [{"name": e.name, "outstanding": e.outstanding, "latency": e.latency,
+                "requests": e.requests, "ejected": e.ejected} for e in self.endpoints]
+
+    def close(self):
+        self.stop_event.set()
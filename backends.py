@@ -0,0 +1,532 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+##
+## Copyright 2024 Henry Kroll <nospam@thenerdshow.com>
+##
+## This program is free software; you can redistribute it and/or modify
+## it under the terms of the GNU General Public License as published by
+## the Free Software Foundation; either version 2 of the License, or
+## (at your option) any later version.
+##
+## This program is distributed in the hope that it will be useful,
+## but WITHOUT ANY WARRANTY; without even the implied warranty of
+## MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+## GNU General Public License for more details.
+##
+## You should have received a copy of the GNU General Public License
+## along with this program; if not, write to the Free Software
+## Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston,
+## MA 02110-1301, USA.
+##
+## Transcription backends.
+##
+## Every engine implements recognize(audio) -> text, where audio is the
+## recorder's (frames, channels) float32 buffer at self.rate. Everything
+## else (queueing, batching, ordering, captions) is built once on top.
+## Add an engine by subclassing TranscriptionBackend and decorating it
+## with @register("name").
+import collections
+import inspect
+import os
+import tempfile
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+import numpy as np
+import soundfile as sf
+from audio_utils import to_model_input, wav_bytes, model_rate
+from backend_pool import Endpoint, EndpointPool
+from profiles import PROFILES, Profile, default_profile
+import metrics
+
+BACKENDS = {}
+
+def register(name):
+    def decorator(cls):
+        cls.name = name
+        BACKENDS[name] = cls
+        return cls
+    return decorator
+
+def make_backend(name, **options):
+    if name not in BACKENDS:
+        raise ValueError(f"Unknown backend: {name}. Choose from {', '.join(BACKENDS)}")
+    return BACKENDS[name](**options)
+
+# Keyword options make_backend(name, ...) understands
+def options_of(name):
+    names = set()
+    for cls in BACKENDS[name].__mro__[:-1]: # not object
+        if "__init__" not in vars(cls): continue
+        for parameter in list(inspect.signature(cls.__init__).parameters.values())[1:]:
+            if parameter.kind != parameter.VAR_KEYWORD: names.add(parameter.name)
+    return names
+
+class TranscriptionBackend:
+    name = ""
+    batch_size = 1  # chunks recognize_batch handles in one go
+    concurrency = 1 # chunks that may be in flight at once
+    timestamps = False # segments() finds where speech starts and ends
+    tracks = ("transcribe",) # what transcribe_tracks() returns, in order
+    asynchronous = False # has submit(), so one thread keeps several chunks in flight
+    profiles = () # engine profiles switch_profile() takes
+    prefetches = False # prepare() is worth running ahead for queued chunks
+    local = False # the model runs in this process, on this machine's CPU or GPU
+
+    def __init__(self, rate=16000, **options):
+        self.rate = rate
+        self.lock = threading.Lock()
+        self.executor = None
+        self.prefetcher = None
+        self.prefetched = collections.deque(maxlen=4) # (audio, Future of prepare(audio))
+        self.calls = 0
+        self.audio_time = 0.0
+        self.busy_time = 0.0
+
+    # Load models, connect, compile. Returns a message for the user.
+    # progress(message), if given, hears about slow steps on the way.
+    def warm_up(self, progress=None):
+        return "Ready to transcribe."
+
+    def recognize(self, audio):
+        raise NotImplementedError
+
+    def recognize_batch(self, audios):
+        return [self.recognize(audio) for audio in audios]
+
+    # Work on audio that doesn't need the model, e.g. feature extraction.
+    # recognize() gets it through prepared(audio).
+    def prepare(self, audio):
+        return None
+
+    # Start prepare() for a chunk still waiting in the queue, on a
+    # thread of its own, while the model works on the one before it
+    def prefetch(self, audio):
+        if not self.prefetches: return
+        with self.lock:
+            if self.prefetcher is None:
+                self.prefetcher = ThreadPoolExecutor(1, thread_name_prefix=f"{self.name}-prefetch")
+            self.prefetched.append((audio, self.prefetcher.submit(self.prepare_ahead, audio)))
+
+    def prepare_ahead(self, audio):
+        with metrics.timer("prefetch"):
+            return self.prepare(audio)
+
+    # prepare(audio), done already if it was prefetched
+    def prepared(self, audio):
+        future = None
+        with self.lock:
+            for item in self.prefetched:
+                if item[0] is audio:
+                    self.prefetched.remove(item)
+                    future = item[1]
+                    break
+        if future is not None:
+            try:
+                result = future.result()
+                metrics.count("prefetched_chunks")
+                return result
+            except Exception as e:
+                print("Exception:", e)
+        with metrics.timer("preprocess"):
+            return self.prepare(audio)
+
+    # Timed wrappers. Callers use these rather than recognize directly.
+    def transcribe(self, audio):
+        return self.transcribe_batch([audio])[0]
+
+    def transcribe_batch(self, audios):
+        start = time.monotonic()
+        if len(audios) == 1:
+            texts = [self.recognize(audios[0])]
+        else:
+            texts = self.recognize_batch(audios)
+        elapsed = time.monotonic() - start
+        metrics.observe("transcribe", elapsed)
+        with self.lock:
+            self.calls += 1
+            self.audio_time += sum(len(audio) for audio in audios) / self.rate
+            self.busy_time += elapsed
+        return texts
+
+    # One text per track, e.g. a transcript and a translation
+    def recognize_tracks(self, audio):
+        return [self.recognize(audio)]
+
+    def transcribe_tracks(self, audio):
+        start = time.monotonic()
+        texts = self.recognize_tracks(audio)
+        elapsed = time.monotonic() - start
+        metrics.observe("transcribe", elapsed)
+        with self.lock:
+            self.calls += 1
+            self.audio_time += len(audio) / self.rate
+            self.busy_time += elapsed
+        return texts
+
+    # Load another engine profile and switch to it without stopping.
+    # Blocks until the switch is done.
+    def switch_profile(self, name, progress=None):
+        raise ValueError(f"{self.name or 'This backend'} has no profiles")
+
+    # Transcript split into (start, end, text) segments, in seconds from
+    # the start of audio. Without timestamps it is one segment.
+    def segments(self, audio):
+        text = self.transcribe(audio).strip()
+        return [(0.0, len(audio) / self.rate, text)] if text else []
+
+    # Asynchronous version of transcribe. Returns a Future. since is
+    # when the audio was ready (time.monotonic()), for backends that
+    # skip audio that has waited too long.
+    def submit(self, audio, since=None):
+        with self.lock:
+            if self.executor is None:
+                self.executor = ThreadPoolExecutor(self.concurrency, thread_name_prefix=self.name)
+        return self.executor.submit(self.transcribe, audio)
+
+    def stats(self):
+        with self.lock:
+            return {
+                "backend": self.name,
+                "calls": self.calls,
+                "audio_seconds": self.audio_time,
+                "busy_seconds": self.busy_time,
+                # Real-time factor: below 1 keeps up with live audio
+                "rtf": self.busy_time / self.audio_time if self.audio_time else None,
+            }
+
+    def close(self):
+        if self.executor: self.executor.shutdown(wait=False)
+        if self.prefetcher: self.prefetcher.shutdown(wait=False)
+
+## In-process whisper-jax (tqdm_loader)
+@register("jax")
+class JaxBackend(TranscriptionBackend):
+    timestamps = True
+    prefetches = True
+    local = True
+
+    def __init__(self, task="transcribe", dual=False, checkpoint=None, profile=None, **options):
+        super().__init__(**options)
+        self.task = task
+        self.engine = None
+        self.profile = PROFILES[profile or default_profile()]
+        self.profiles = tuple(PROFILES)
+        # Catch up on a backlog with one forward pass per batch, as big
+        # as the profile's largest bucket
+        self.batch_size = self.profile.buckets[-1]
+        # A checkpoint other than tqdm_loader's gets a pipeline of its own
+        self.checkpoint = checkpoint
+        self.model = None
+        if checkpoint:
+            self.profile = Profile(checkpoint, checkpoint, self.profile.dtype, (1,))
+            self.profiles = ()
+            self.batch_size = 1
+        if dual:
+            # Transcript and English translation from one encoder pass.
+            # An English-only model would just transcribe twice.
+            if not self.profile.multilingual():
+                raise ValueError(f"{self.profile.checkpoint} can't translate. "
+                    "Use a multilingual profile, e.g. --profile large-v2.")
+            if not checkpoint:
+                self.profiles = tuple(name for name, p in PROFILES.items() if p.multilingual())
+            self.tracks = ("transcribe", "translate")
+            self.batch_size = 1
+            self.prefetches = False
+
+    def warm_up(self, progress=None):
+        def report(message):
+            print(message)
+            if progress: progress(message)
+        import tqdm_loader
+        if self.checkpoint:
+            self.model = tqdm_loader.load_pipeline(self.profile, report)
+            self.engine = tqdm_loader
+            return f"{self.checkpoint} ready."
+        timing = tqdm_loader.init_pipeline(report, self.profile)
+        self.engine = tqdm_loader
+        if len(self.tracks) > 1:
+            report("Compiling the translation pass...")
+            self.recognize_tracks(np.zeros(model_rate, np.float32))
+            return "Language model ready. Translating, too."
+        print(f"Ready ({timing['start']} start: imported in {timing['import_time']:.1f}s,",
+            f"loaded in {timing['load_time']:.1f}s, compiled in {timing['compile_time']:.1f}s)")
+        # Bigger batches are only needed to catch up. Compile them while
+        # live captions are already running.
+        threading.Thread(target=self.warm_up_batches, daemon=True).start()
+        return "Language model ready."
+
+    def warm_up_batches(self):
+        timings = self.engine.warm_up(self.profile.buckets[1:])
+        print("Batch sizes ready:", ", ".join(f"{k} ({v:.1f}s)" for k, v in timings.items()))
+
+    # The new model is loaded and compiled for every batch size next to
+    # the old one, which keeps captioning until then
+    def switch_profile(self, name, progress=None):
+        if name not in self.profiles:
+            if len(self.tracks) > 1 and name in PROFILES:
+                raise ValueError(f"{name} can't translate")
+            raise ValueError(f"No profile {name}")
+        if name == self.profile.name: return
+        self.engine.switch_profile(PROFILES[name], progress)
+        self.profile = PROFILES[name]
+        # Features prefetched for the old model would keep it in memory
+        with self.lock: self.prefetched.clear()
+        if len(self.tracks) == 1: self.batch_size = self.profile.buckets[-1]
+
+    def inputs(self, audio):
+        # Downmix and resample in-process. No tempfile, no ffmpeg.
+        with metrics.timer("encode"):
+            return {"array": to_model_input(audio, self.rate), "sampling_rate": model_rate}
+
+    # Features for the model of the moment
+    def prepare(self, audio):
+        model = self.model or self.engine.pipeline
+        return model, self.engine.prepare(self.inputs(audio), model)
+
+    def recognize(self, audio):
+        model, batches = self.prepared(audio)
+        if model is not (self.model or self.engine.pipeline):
+            model, batches = self.prepare(audio) # the profile was switched meanwhile
+        text, runtime = self.engine.stream_generate(None, task=self.task,
+            return_timestamps=False, model=model, batches=batches)
+        return text
+
+    def recognize_tracks(self, audio):
+        if len(self.tracks) == 1: return [self.recognize(audio)]
+        texts, runtime = self.engine.dual_generate(self.inputs(audio), self.tracks)
+        return [texts[task] for task in self.tracks]
+
+    def segments(self, audio):
+        start = time.monotonic()
+        segments = self.engine.generate_segments(self.inputs(audio), task=self.task, model=self.model)
+        elapsed = time.monotonic() - start
+        metrics.observe("transcribe", elapsed)
+        with self.lock:
+            self.calls += 1
+            self.audio_time += len(audio) / self.rate
+            self.busy_time += elapsed
+        return [(s, e, text.strip()) for s, e, text in segments if text.strip()]
+
+    # A backlog. Features prefetched while it piled up are used here, too.
+    def recognize_batch(self, audios):
+        model = self.model or self.engine.pipeline
+        prepared = []
+        for audio in audios:
+            prepared_model, batches = self.prepared(audio)
+            prepared.append(batches if prepared_model is model else None)
+        texts, runtime = self.engine.tqdm_generate_batch(
+            [self.inputs(audio) if batches is None else None for audio, batches in zip(audios, prepared)],
+            task=self.task, return_timestamps=False, model=model, prepared=prepared)
+        return texts
+
+## whisper.cpp's whisper-server, over HTTP
+@register("cpp")
+class WhisperCppBackend(TranscriptionBackend):
+    def __init__(self, urls=("http://127.0.0.1:7777/inference",), strategy="least_outstanding",
+            in_flight=3, timeout=30, retries=2, **options):
+        super().__init__(**options)
+        from http_transport import Transport
+        self.transports = [] # their keep-alive connections are closed with the backend
+        def make_endpoint(url):
+            transport = Transport(url, {'temperature': '0.2', 'response-format': 'json'},
+                timeout=timeout, retries=retries, pool_size=in_flight)
+            self.transports.append(transport)
+            return Endpoint(url, lambda wav: transport.post(wav)['text'], transport.check)
+        self.pool = EndpointPool([make_endpoint(url) for url in urls], strategy)
+        # Overlap network latency with capture
+        self.concurrency = in_flight * len(urls)
+
+    def recognize(self, audio):
+        # Encode the WAV in memory. Nothing touches the disk.
+        with metrics.timer("encode"):
+            wav = wav_bytes(audio, self.rate)
+        return self.pool.send(wav)
+
+    def stats(self):
+        stats = super().stats()
+        stats["endpoints"] = self.pool.stats()
+        return stats
+
+    def close(self):
+        super().close()
+        self.pool.close()
+        for transport in self.transports: transport.close()
+
+## whisper-jax's gradio app, over HTTP
+## The text of a gradio Job, which is a Future of (text, runtime).
+## Cancelling this cancels the Job, if the server hasn't started on it.
+class GradioJob(Future):
+    def __init__(self, job):
+        super().__init__()
+        self.job = job
+        job.add_done_callback(self.finished)
+
+    def finished(self, job):
+        if job.cancelled(): super().cancel()
+        elif job.exception() is not None: self.set_exception(job.exception())
+        else: self.set_result(job.result()[0])
+
+    def cancel(self):
+        return self.job.cancel()
+
+@register("gradio")
+class GradioBackend(TranscriptionBackend):
+    asynchronous = True
+
+    def __init__(self, urls=("http://localhost:7860/",), strategy="least_outstanding",
+            in_flight=1, task="transcribe", latency_budget=10, client_factory=None, **options):
+        super().__init__(**options)
+        self.task = task
+        # url -> a gradio_client.Client, or a stand-in like stub_server.StubGradioClient
+        self.client_factory = client_factory
+        self.pool = EndpointPool([self.make_endpoint(url) for url in urls], strategy)
+        self.concurrency = in_flight * len(urls)
+        self.slots = threading.Semaphore(self.concurrency)
+        # Chunks older than this (seconds) aren't worth captioning any more. 0 keeps them all.
+        self.latency_budget = latency_budget
+        self.jobs = {} # pool Future -> when its audio was ready
+
+    def make_endpoint(self, url):
+        import requests
+        clients = []
+        lock = threading.Lock()
+        # Connect on first use, so one server being down doesn't stop the app
+        def client():
+            with lock:
+                if not clients:
+                    if self.client_factory:
+                        clients.append(self.client_factory(url))
+                    else:
+                        from gradio_client import Client
+                        clients.append(Client(url))
+                return clients[0]
+        def send(f):
+            return client().predict(f, self.task, False, api_name="/predict_1")[0]
+        def submit(f):
+            return GradioJob(client().submit(f, self.task, False, api_name="/predict_1"))
+        def check():
+            return requests.get(url, timeout=3).status_code < 500
+        return Endpoint(url, send, None if self.client_factory else check, submit)
+
+    # gradio_client only uploads from a path, so this backend still
+    # needs a short-lived file. The others stay in memory.
+    def payload(self, audio):
+        fd, f = tempfile.mkstemp(suffix=".wav")
+        with metrics.timer("encode"), os.fdopen(fd, "wb") as out:
+            sf.write(out, audio, samplerate=self.rate, format='wav')
+        return f
+
+    def recognize(self, audio):
+        f = self.payload(audio)
+        try:
+            with metrics.timer("network"):
+                return self.pool.send(f)
+        finally:
+            os.remove(f)
+
+    # Send audio off and return a Future of its text at once. Waits
+    # only while every slot is taken. Audio that is past the latency
+    # budget by the time it could go, or whose job is cancelled for
+    # being too late, comes back as "".
+    def submit(self, audio, since=None):
+        since = since or time.monotonic()
+        result = Future()
+        # Wait for a free slot, dropping whatever is too late meanwhile
+        while not self.slots.acquire(timeout=0.1):
+            self.cancel_stale()
+        if self.stale(since):
+            self.slots.release()
+            metrics.count("cancelled_chunks")
+            result.set_result("")
+            return result
+        try:
+            # Encoded once. Failing over to another server sends the same file.
+            f = self.payload(audio)
+        except Exception:
+            self.slots.release()
+            raise
+        start = time.monotonic()
+        try:
+            future = self.pool.submit(f)
+        except Exception:
+            self.slots.release()
+            os.remove(f)
+            raise
+        with self.lock: self.jobs[future] = since
+        def finished(future):
+            with self.lock: self.jobs.pop(future, None)
+            self.slots.release()
+            os.remove(f)
+            elapsed = time.monotonic() - start
+            metrics.observe("network", elapsed)
+            if future.cancelled():
+                metrics.count("cancelled_chunks")
+                result.set_result("")
+            elif future.exception() is not None:
+                result.set_exception(future.exception())
+            else:
+                metrics.observe("transcribe", elapsed)
+                with self.lock:
+                    self.calls += 1
+                    self.audio_time += len(audio) / self.rate
+                    self.busy_time += elapsed
+                result.set_result(future.result())
+            # The server is free for the next job. Is it still worth doing?
+            self.cancel_stale()
+        future.add_done_callback(finished)
+        return result
+
+    def stale(self, since):
+        return self.latency_budget and time.monotonic() - since > self.latency_budget
+
+    # Withdraw queued jobs whose audio is already too old
+    def cancel_stale(self):
+        with self.lock:
+            stale = [future for future, since in self.jobs.items() if self.stale(since)]
+        for future in stale:
+            self.pool.cancel(future)
+
+    def stats(self):
+        stats = super().stats()
+        stats["endpoints"] = self.pool.stats()
+        with self.lock: stats["in_flight"] = len(self.jobs)
+        return stats
+
+    def close(self):
+        super().close()
+        self.pool.close()
+
+## Deterministic stand-in for tests and benchmarks. Takes delay seconds
+## per call (plus per_second for each second of audio) and says how much
+## audio it got, numbered in the order calls started. prepare_time is
+## model-free work per chunk, which prefetch() can get done ahead.
+@register("fake")
+class FakeBackend(TranscriptionBackend):
+    def __init__(self, delay=0.0, per_second=0.0, batch_size=1, concurrency=1, prepare_time=0.0,
+            **options):
+        super().__init__(**options)
+        self.delay = delay
+        # Seconds of model-free work per call, like feature extraction
+        self.prepare_time = prepare_time
+        self.prefetches = prepare_time > 0
+        self.per_second = per_second
+        self.batch_size = batch_size
+        self.concurrency = concurrency
+        self.count = 0
+
+    def recognize(self, audio):
+        return self.recognize_batch([audio])[0]
+
+    def recognize_batch(self, audios):
+        seconds = [len(audio) / self.rate for audio in audios]
+        if self.prepare_time:
+            for audio in audios: self.prepared(audio)
+        with self.lock:
+            first = self.count
+            self.count += len(audios)
+        time.sleep(self.delay + self.per_second * sum(seconds))
+        return [f"chunk {first + i} ({s:.2f} seconds)" for i, s in enumerate(seconds)]
+
+    def prepare(self, audio):
+        time.sleep(self.prepare_time)
@@ -0,0 +1,212 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+##
+## Copyright 2024 Henry Kroll <nospam@thenerdshow.com>
+##
+## This program is free software; you can redistribute it and/or modify
+## it under the terms of the GNU General Public License as published by
+## the Free Software Foundation; either version 2 of the License, or
+## (at your option) any later version.
+##
+## This program is distributed in the hope that it will be useful,
+## but WITHOUT ANY WARRANTY; without even the implied warranty of
+## MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+## GNU General Public License for more details.
+##
+## You should have received a copy of the GNU General Public License
+## along with this program; if not, write to the Free Software
+## Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston,
+## MA 02110-1301, USA.
+##
+## Caption saved recordings without the GUI.
+##
+## ./batch_transcribe.py recordings/ old/*.flac talk.wav
+## ./batch_transcribe.py --backend cpp --server http://host:7777/inference --workers 6 archive/
+##
+## Files are read a chunk at a time, never whole. Chunks are spread over
+## a pool of threads (or processes, each with its own model) and the
+## captions are written in the same formats the GUI saves.
+import argparse
+import collections
+import glob
+import json
+import os
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+import soundfile as sf
+from audio_utils import to_model_input, model_rate
+from backends import BACKENDS, make_backend
+from caption_sinks import CaptionSinks, SINKS, DEFAULT_FORMATS
+import metrics
+
+AUDIO_EXTS = (".wav", ".flac", ".ogg", ".aiff", ".aif", ".mp3")
+
+# Expand directories and globs into a list of audio files
+def find_inputs(patterns):
+    found = []
+    for pattern in patterns:
+        if os.path.isdir(pattern):
+            for root, dirs, files in os.walk(pattern):
+                dirs.sort()
+                found += [os.path.join(root, f) for f in sorted(files)
+                    if os.path.splitext(f)[1].lower() in AUDIO_EXTS]
+        elif glob.has_magic(pattern):
+            found += sorted(glob.glob(pattern, recursive=True))
+        else:
+            found.append(pattern)
+    return found
+
+# Chunk length and overlap, in seconds. Backends with timestamps use the
+# same chunk_length_s/stride plan as the whisper-jax pipeline, and the
+# overlap is trimmed off again by timestamp. Without timestamps there is
+# no way to trim, so chunks don't overlap.
+def chunk_plan(backend, chunk_time):
+    if backend.timestamps:
+        import tqdm_loader
+        chunk_len, stride_left, stride_right = tqdm_loader.chunk_plan(model_rate)
+        return chunk_len / model_rate, stride_left / model_rate
+    return chunk_time, 0.0
+
+# Yield (start_time, audio, stride_left, stride_right) for each chunk,
+# reading no more than one chunk of the file at a time
+def read_chunks(path, chunk_time, stride_time):
+    info = sf.info(path)
+    rate = info.samplerate
+    size = int(chunk_time * rate)
+    overlap = int(2 * stride_time * rate)
+    offset = 0
+    for block in sf.blocks(path, blocksize=size, overlap=overlap, dtype='float32', always_2d=True):
+        is_last = offset + len(block) >= info.frames
+        yield (offset / rate, to_model_input(block, rate),
+            stride_time if offset else 0.0, 0.0 if is_last else stride_time)
+        if is_last: break
+        offset += size - overlap
+
+# Transcribe one chunk. Keep only segments centered outside the overlap,
+# so each bit of speech is captioned once.
+def run_chunk(backend, audio, stride_left, stride_right):
+    duration = len(audio) / model_rate
+    keep = []
+    for start, end, text in backend.segments(audio):
+        middle = (start + end) / 2
+        if stride_left <= middle and (middle < duration - stride_right or not stride_right):
+            keep.append((start, end, text))
+    return keep
+
+## Each worker process loads its own backend
+worker_backend = None
+
+def init_worker(name, options):
+    global worker_backend
+    worker_backend = make_backend(name, rate=model_rate, **options)
+    worker_backend.warm_up()
+
+def run_chunk_in_worker(audio, stride_left, stride_right):
+    return run_chunk(worker_backend, audio, stride_left, stride_right)
+
+def output_base(path, output_dir):
+    base = os.path.splitext(path)[0]
+    if output_dir: base = os.path.join(output_dir, os.path.basename(base))
+    return base
+
+def transcribe_file(path, submit, window, chunk_time, stride_time, base, formats):
+    start = time.perf_counter()
+    sinks = CaptionSinks(base, formats)
+    pending = collections.deque()
+    cues = 0
+    audio_time = 0.0
+    # Keep a bounded number of chunks in flight, and write them in order
+    def write_next():
+        nonlocal cues
+        offset, future = pending.popleft()
+        for s, e, text in future.result():
+            if text and text != "you":
+                sinks.write(offset + s, offset + e, text)
+                cues += 1
+    try:
+        for offset, audio, left, right in read_chunks(path, chunk_time, stride_time):
+            audio_time = offset + len(audio) / model_rate
+            pending.append((offset, submit(audio, left, right)))
+            if len(pending) >= window: write_next()
+        while pending: write_next()
+    except BaseException:
+        sinks.discard()
+        raise
+    names = sinks.save(base)
+    elapsed = time.perf_counter() - start
+    return {"file": path, "outputs": names, "cues": cues, "audio_seconds": audio_time,
+        "seconds": elapsed, "rtf": elapsed / audio_time if audio_time else None}
+
+def parse_args(argv):
+    parser = argparse.ArgumentParser(description="Caption saved recordings without the GUI")
+    parser.add_argument("inputs", nargs="+", help="audio files, directories or globs")
+    parser.add_argument("--backend", choices=list(BACKENDS), default="jax")
+    parser.add_argument("--server", action="append", dest="urls", metavar="URL",
+        help="server for network backends. Repeat to balance load over several.")
+    parser.add_argument("--task", choices=("transcribe", "translate"))
+    parser.add_argument("--workers", type=int, default=0,
+        help="threads sharing one backend (default: what the backend can take)")
+    parser.add_argument("--processes", type=int, default=0,
+        help="use this many processes instead, each loading its own backend")
+    parser.add_argument("--chunk-time", type=float, default=30,
+        help="seconds per chunk for backends without timestamps")
+    parser.add_argument("--formats", nargs="+", default=list(DEFAULT_FORMATS), choices=list(SINKS))
+    parser.add_argument("--output-dir", help="where captions go (default: next to each file)")
+    parser.add_argument("--json", action="store_true", help="print a JSON report at the end")
+    return parser.parse_args(argv)
+
+def main(argv=None):
+    args = parse_args(sys.argv[1:] if argv is None else argv)
+    options = {k: v for k, v in (("urls", args.urls), ("task", args.task)) if v is not None}
+    files = find_inputs(args.inputs)
+    if not files:
+        print("No audio files found.", file=sys.stderr)
+        return 1
+    if args.output_dir: os.makedirs(args.output_dir, exist_ok=True)
+
+    backend = make_backend(args.backend, rate=model_rate, **options)
+    chunk_time, stride_time = chunk_plan(backend, args.chunk_time)
+    if args.processes:
+        workers = args.processes
+        executor = ProcessPoolExecutor(workers, initializer=init_worker,
+            initargs=(args.backend, options))
+        submit = lambda *chunk: executor.submit(run_chunk_in_worker, *chunk)
+    else:
+        print(backend.warm_up())
+        workers = args.workers or backend.concurrency
+        executor = ThreadPoolExecutor(workers)
+        submit = lambda *chunk: executor.submit(run_chunk, backend, *chunk)
+
+    report = []
+    total_start = time.perf_counter()
+    try:
+        for path in files:
+            try:
+                result = transcribe_file(path, submit, workers * 2, chunk_time, stride_time,
+                    output_base(path, args.output_dir), args.formats)
+            except Exception as e:
+                print(f"{path}: {e}", file=sys.stderr)
+                report.append({"file": path, "error": str(e)})
+                continue
+            report.append(result)
+            print(f"{path}: {result['cues']} captions, {result['audio_seconds']:.1f}s of audio "
+                f"in {result['seconds']:.1f}s (RTF {result['rtf'] or 0:.3f})")
+    finally:
+        executor.shutdown(cancel_futures=True)
+        backend.close()
+    elapsed = time.perf_counter() - total_start
+    audio_time = sum(r.get("audio_seconds", 0) for r in report)
+    summary = {"files": report, "seconds": elapsed, "audio_seconds": audio_time,
+        "rtf": elapsed / audio_time if audio_time else None}
+    if args.json:
+        # Per-stage timings, from this process only
+        summary["metrics"] = metrics.registry.as_dict()
+        print(json.dumps(summary, indent=2))
+    else:
+        print(f"{len(files)} files, {audio_time:.1f}s of audio in {elapsed:.1f}s "
+            f"(RTF {summary['rtf'] or 0:.3f})")
+    return 1 if any("error" in r for r in report) else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,478 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+##
+## Copyright 2024 Henry Kroll <nospam@thenerdshow.com>
+##
+## This program is free software; you can redistribute it and/or modify
+## it under the terms of the GNU General Public License as published by
+## the Free Software Foundation; either version 2 of the License, or
+## (at your option) any later version.
+##
+## This program is distributed in the hope that it will be useful,
+## but WITHOUT ANY WARRANTY; without even the implied warranty of
+## MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+## GNU General Public License for more details.
+##
+## You should have received a copy of the GNU General Public License
+## along with this program; if not, write to the Free Software
+## Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston,
+## MA 02110-1301, USA.
+##
+## Benchmarks. Run ./benchmark.py -h for the list.
+import argparse
+import bisect
+import contextlib
+import json
+import os
+import resource
+import shutil
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import numpy as np
+import soundfile as sf
+from audio_utils import to_model_input, wav_bytes, model_rate
+from backends import BACKENDS, make_backend
+from profiles import PROFILES
+from segmenter import make_segmenter
+from session import Session, SessionGroup
+from capture import CaptureThread, FileRecorder
+from recording_writer import RecordingWriter, MultiTrackWriter
+import metrics
+
+# Per-call cost of fn(), in milliseconds
+def time_ms(fn, repeat):
+    fn() # warm up
+    start = time.perf_counter()
+    for _ in range(repeat): fn()
+    return (time.perf_counter() - start) * 1000 / repeat
+
+# Same arguments transformers' ffmpeg_read uses
+def ffmpeg_decode(data, rate):
+    out = subprocess.run(["ffmpeg", "-i", "pipe:0", "-ac", "1", "-ar", str(rate),
+        "-f", "f32le", "-hide_banner", "-loglevel", "quiet", "pipe:1"],
+        input=data, stdout=subprocess.PIPE, check=True).stdout
+    return np.frombuffer(out, np.float32)
+
+## How long it takes to get one recorded chunk ready for the model
+def bench_handoff(args):
+    rate = args.rate
+    audio = np.random.uniform(-0.5, 0.5, (rate * args.chunk_time, 1)).astype(np.float32)
+    have_ffmpeg = shutil.which("ffmpeg") is not None
+
+    # The old way: tempfile, sf.write, read it back, decode with ffmpeg
+    def tempfile_path():
+        f = tempfile.mktemp()
+        sf.write(f, audio, samplerate=rate, format='wav')
+        with open(f, "rb") as fp:
+            data = fp.read()
+        os.remove(f)
+        if have_ffmpeg: ffmpeg_decode(data, model_rate)
+
+    def in_memory():
+        to_model_input(audio, rate)
+
+    def wav_in_memory():
+        wav_bytes(audio, rate)
+
+    results = {
+        "chunk_time": args.chunk_time,
+        "sample_rate": rate,
+        "ffmpeg": have_ffmpeg,
+        "tempfile_ms": time_ms(tempfile_path, args.repeat),
+        "in_memory_ms": time_ms(in_memory, args.repeat),
+        "wav_bytes_ms": time_ms(wav_in_memory, args.repeat),
+    }
+    return results
+
+## Our own per-chunk overhead around the model: wall time minus the
+## forward pass, for tqdm_generate and stream_generate. Needs whisper-jax.
+def bench_generate(args):
+    import tqdm_loader
+    tqdm_loader.init_pipeline()
+    audio = np.random.uniform(-0.5, 0.5, int(model_rate * args.seconds)).astype(np.float32)
+    results = {"seconds": args.seconds}
+    for name in ("tqdm_generate", "stream_generate"):
+        generate = getattr(tqdm_loader, name)
+        generate({"array": audio, "sampling_rate": model_rate}, task="transcribe", return_timestamps=False)
+        wall = forward = 0
+        for _ in range(args.repeat):
+            start = time.perf_counter()
+            text, runtime = generate({"array": audio, "sampling_rate": model_rate},
+                task="transcribe", return_timestamps=False)
+            wall += time.perf_counter() - start
+            forward += runtime
+        results[name] = {
+            "wall_ms": wall * 1000 / args.repeat,
+            "forward_ms": forward * 1000 / args.repeat,
+            "overhead_ms": (wall - forward) * 1000 / args.repeat,
+        }
+    return results
+
+## Transcript and translation of the same chunk: two full passes, or one
+## encoder pass shared by two decoders. Needs whisper-jax and a
+## multilingual checkpoint.
+def bench_dual(args):
+    import tqdm_loader
+    tqdm_loader.init_pipeline(profile=PROFILES[args.profile])
+    audio = np.random.uniform(-0.5, 0.5, int(model_rate * args.seconds)).astype(np.float32)
+    inputs = lambda: {"array": audio, "sampling_rate": model_rate}
+    def two_passes():
+        for task in ("transcribe", "translate"):
+            tqdm_loader.stream_generate(inputs(), task=task, return_timestamps=False)
+    def one_encoder():
+        tqdm_loader.dual_generate(inputs())
+    results = {
+        "seconds": args.seconds,
+        "two_passes_ms": time_ms(two_passes, args.repeat),
+        "dual_ms": time_ms(one_encoder, args.repeat),
+    }
+    results["dual_vs_two_passes"] = results["dual_ms"] / results["two_passes_ms"]
+    return results
+
+# The audio file to test with, or a few seconds of noise
+def load_audio(path, seconds=10, rate=16000):
+    if path:
+        audio, rate = sf.read(path, dtype='float32', always_2d=True)
+        return audio, rate
+    return np.random.uniform(-0.5, 0.5, (int(rate * seconds), 1)).astype(np.float32), rate
+
+## Run several backends over the same chunks, one after another
+def bench_engines(args):
+    audio, rate = load_audio(args.file)
+    segments = make_segmenter(args.segmenter, rate)
+    chunks = segments.feed(audio) + segments.flush()
+    results = {"audio_seconds": len(audio) / rate, "chunks": len(chunks), "backends": []}
+    for name in args.backends:
+        options = {"urls": args.urls} if args.urls else {}
+        backend = make_backend(name, rate=rate, **options)
+        start = time.perf_counter()
+        backend.warm_up()
+        warm_up = time.perf_counter() - start
+        latencies = []
+        for chunk in chunks:
+            start = time.perf_counter()
+            backend.transcribe(chunk.audio)
+            latencies.append(time.perf_counter() - start)
+        stats = backend.stats()
+        stats.update({
+            "warm_up_seconds": warm_up,
+            "latency_ms_mean": float(np.mean(latencies) * 1000) if latencies else None,
+            "latency_ms_max": float(np.max(latencies) * 1000) if latencies else None,
+        })
+        results["backends"].append(stats)
+        backend.close()
+    return results
+
+# Speech-like test signal: bursts of a wobbling, syllable-rate modulated
+# tone with noise, separated by pauses, so the VAD has something to cut.
+# The same seed always gives the same audio.
+def synthetic_speech(seconds, rate=16000, seed=0):
+    rng = np.random.default_rng(seed)
+    audio = np.zeros(int(rate * seconds), np.float32)
+    position = int(rate * 0.5)
+    while position < len(audio):
+        length = min(int(rate * rng.uniform(1.0, 4.0)), len(audio) - position)
+        t = np.arange(length) / rate
+        pitch = rng.uniform(100, 220) * (1 + 0.1 * np.sin(2 * np.pi * 3 * t))
+        syllables = 0.5 + 0.5 * np.sin(2 * np.pi * rng.uniform(3, 5) * t) ** 2
+        voice = np.sin(2 * np.pi * np.cumsum(pitch) / rate) + 0.1 * rng.standard_normal(length)
+        audio[position:position + length] = 0.3 * syllables * voice
+        position += length + int(rate * rng.uniform(0.4, 1.2))
+    audio += 0.001 * rng.standard_normal(len(audio)).astype(np.float32)
+    return audio.reshape(-1, 1)
+
+def percentiles(values):
+    if not values: return None
+    return {"p50": float(np.percentile(values, 50)), "p95": float(np.percentile(values, 95)),
+        "max": float(np.max(values))}
+
+## The whole capture -> transcribe -> caption path, with a file (or
+## synthetic speech) standing in for the sound card. Audio is fed in
+## block_time blocks at --speed times real time (0 = as fast as possible).
+def bench_pipeline(args):
+    if args.file:
+        audio, rate = load_audio(args.file)
+    else:
+        rate = model_rate
+        audio = synthetic_speech(args.seconds, rate, args.seed)
+    stub = None
+    options = {}
+    if args.stub is not None:
+        import stub_server
+        stub = stub_server.serve(0, delay=args.stub)
+        args.backend = "cpp"
+        options["urls"] = [f"http://127.0.0.1:{stub.server_port}/inference"]
+    elif args.urls:
+        options["urls"] = args.urls
+    if args.backend == "fake":
+        options.update(delay=args.delay, per_second=args.per_second,
+            batch_size=args.batch_size, concurrency=args.concurrency, prepare_time=args.prepare_time)
+    backend = make_backend(args.backend, rate=rate, **options)
+    if args.no_prefetch: backend.prefetches = False
+    start = time.perf_counter()
+    backend.warm_up()
+    warm_up = time.perf_counter() - start
+
+    # Caption latency: from when the last sample of a chunk would have
+    # come out of the sound card
+    # (or, at speed 0, when it was fed) to when its caption is emitted
+    latencies = []
+    captions = []
+    started = None
+    fed_ends, fed_at = [], [] # end of each block fed, in audio seconds, and when
+    def emit(start_time, end_time, text, tentative=""):
+        i = min(bisect.bisect_left(fed_ends, end_time - 1e-9), len(fed_at) - 1)
+        heard = started + end_time / args.speed if args.speed else fed_at[i]
+        latencies.append(time.perf_counter() - heard)
+        if text: captions.append({"start": start_time, "end": end_time, "text": text})
+
+    session = Session(backend, emit, rate, args.segmenter, streaming=args.streaming,
+        queue_size=args.queue_size, backpressure=args.backpressure, max_batch_wait=args.max_batch_wait,
+        adaptive=args.adaptive, target_latency=args.target_latency)
+    block = int(rate * args.block_time)
+    cpu = time.process_time()
+    started = time.perf_counter()
+    session.start()
+    for offset in range(0, len(audio), block):
+        if args.speed:
+            # Wait until the sound card would have delivered this block
+            delay = started + (offset + block) / rate / args.speed - time.perf_counter()
+            if delay > 0: time.sleep(delay)
+        now = time.perf_counter()
+        session.feed(audio[offset:offset + block])
+        fed_ends.append(min(offset + block, len(audio)) / rate)
+        fed_at.append(now)
+    session.close()
+    elapsed = time.perf_counter() - started
+    cpu = time.process_time() - cpu
+
+    stats = backend.stats()
+    backend.close()
+    if stub: stub.shutdown()
+    return {
+        "backend": args.backend,
+        "audio_seconds": len(audio) / rate,
+        "speed": args.speed,
+        "segmenter": "streaming" if args.streaming else args.segmenter,
+        "warm_up_seconds": warm_up,
+        "wall_seconds": elapsed,
+        "cpu_seconds": cpu,
+        "cpu_percent": 100 * cpu / elapsed if elapsed else None,
+        # Kilobytes on Linux
+        "max_rss_kb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+        "captions": len(captions),
+        "caption_latency": percentiles(latencies),
+        "rtf": stats["rtf"],
+        "calls": stats["calls"],
+        "dropped_chunks": session.queue.dropped,
+        "merged_chunks": session.queue.merged,
+        "chunk_time": session.controller.chunk_time if session.controller else None,
+        "prefetched_chunks": metrics.registry.as_dict()["counters"].get("prefetched_chunks", 0),
+        "stages": metrics.registry.as_dict()["stages"],
+    }
+
+## Feature extraction for a queued chunk while the model works on the
+## one before it. The same run without and with prefetching: with it,
+## preprocess time on the worker should mostly move to the prefetch
+## thread, and the model should get through the backlog sooner.
+def bench_prefetch(args):
+    results = {}
+    # Metrics add up over both runs
+    def busy(stages, stage):
+        return stages[stage]["sum"] if stage in stages else 0.0
+    for name, off in (("without", True), ("with", False)):
+        before = metrics.registry.as_dict()
+        run = bench_pipeline(argparse.Namespace(**{**vars(args), "no_prefetch": off}))
+        stages = run["stages"]
+        results[name] = {
+            "wall_seconds": run["wall_seconds"],
+            "caption_latency": run["caption_latency"],
+            "calls": run["calls"],
+            "prefetched_chunks": run["prefetched_chunks"]
+                - before["counters"].get("prefetched_chunks", 0),
+            # Model-free work on the worker thread, holding up the model
+            "preprocess_seconds": busy(stages, "preprocess") - busy(before["stages"], "preprocess"),
+            # The same work, done ahead on the prefetch thread
+            "prefetch_seconds": busy(stages, "prefetch") - busy(before["stages"], "prefetch"),
+        }
+    results["hidden_seconds"] = results["with"]["prefetch_seconds"]
+    return results
+
+## Several file-backed sources at once, each with its own capture
+## thread, ring and segmenter, sharing one backend. Checks that every
+## source gets captioned and how long each waits for its captions.
+def bench_sources(args):
+    files = args.files
+    tmp = tempfile.mkdtemp()
+    if not files:
+        # Synthetic speech with different seeds, one file per source
+        files = []
+        for i in range(args.count):
+            files.append(os.path.join(tmp, f"source-{i + 1}.wav"))
+            sf.write(files[-1], synthetic_speech(args.seconds, model_rate, i), model_rate)
+    rate = model_rate
+    backend = make_backend("fake", rate=rate, delay=args.delay, per_second=args.per_second,
+        batch_size=args.batch_size, concurrency=args.concurrency)
+    group = SessionGroup(backend)
+    writer = MultiTrackWriter(RecordingWriter(os.path.join(tmp, "all.wav"), rate, len(files)),
+        [1] * len(files))
+    captions = [[] for _ in files]
+    sources = []
+    started = time.perf_counter()
+    for index, path in enumerate(files):
+        def emit(start_time, end_time, text, tentative="", index=index):
+            captions[index].append(time.perf_counter() - (started + end_time / args.speed))
+        session = Session(backend, emit, rate, "vad", group=group)
+        capture = CaptureThread(lambda path=path: FileRecorder(path, rate, 1, args.speed), rate)
+        sources.append((session, capture, capture.reader(), writer.track(index)))
+    group.start()
+    threads = []
+    for session, capture, reader, track in sources:
+        capture.start()
+        threads.append(threading.Thread(target=session.follow,
+            args=(reader, int(rate * 0.1), lambda audio, track=track: track.write(audio.copy()))))
+        threads[-1].start()
+    for thread in threads: thread.join()
+    for session, capture, reader, track in sources: session.close()
+    group.close()
+    writer.close()
+    info = sf.info(writer.path)
+    shutil.rmtree(tmp)
+    return {
+        "sources": len(files),
+        "speed": args.speed,
+        "wall_seconds": time.perf_counter() - started,
+        "recording": {"channels": info.channels, "seconds": info.duration},
+        "per_source": [{"file": os.path.basename(path), "captions": len(latencies),
+            "caption_latency": percentiles(latencies), "overruns": reader.overruns}
+            for path, latencies, (session, capture, reader, track) in zip(files, captions, sources)],
+    }
+
+## The gradio backend against in-process stub servers that work on 1, 2,
+## 4... requests at a time. With several jobs in flight, throughput
+## should grow with the server's concurrency. "blocking" is one
+## predict() at a time, the way the client used to work.
+def bench_gradio(args):
+    from backends import GradioBackend
+    from stub_server import StubGradioClient
+    audio = synthetic_speech(args.seconds, model_rate)
+    def run(concurrency, in_flight, asynchronous=True):
+        url = f"stub://{concurrency}/{in_flight}/{asynchronous}"
+        backend = GradioBackend(urls=[url], in_flight=in_flight, latency_budget=args.budget,
+            client_factory=lambda url: StubGradioClient(url, args.delay, concurrency), rate=model_rate)
+        backend.asynchronous = asynchronous
+        captions = []
+        session = Session(backend, lambda start, end, text, tentative="": captions.append(text),
+            model_rate, "fixed", chunk_time=args.chunk_time, queue_size=10 ** 6, backpressure="block")
+        cancelled = metrics.registry.counters.get("cancelled_chunks", 0)
+        started = time.perf_counter()
+        session.start()
+        session.feed(audio)
+        session.close()
+        elapsed = time.perf_counter() - started
+        backend.close()
+        return {"server_concurrency": concurrency, "in_flight": in_flight, "chunks": len(captions),
+            "cancelled": metrics.registry.counters.get("cancelled_chunks", 0) - cancelled,
+            "wall_seconds": elapsed, "times_real_time": len(audio) / model_rate / elapsed}
+    results = {"audio_seconds": args.seconds, "chunk_time": args.chunk_time, "delay": args.delay,
+        "blocking": run(1, 1, asynchronous=False)}
+    results["pipelined"] = [run(n, args.in_flight) for n in args.concurrency]
+    return results
+
+# Caption latency is counted from when audio would have been heard, so
+# these runs need a real speed
+def positive_float(text):
+    value = float(text)
+    if value <= 0: raise argparse.ArgumentTypeError(f"must be above 0: {text}")
+    return value
+
+# Options of the pipeline benchmark, shared with prefetch
+def pipeline_arguments(p):
+    p.add_argument("--backend", choices=list(BACKENDS), default="fake")
+    p.add_argument("--file", help="audio file to replay (default: synthetic speech)")
+    p.add_argument("--seconds", type=float, default=30, help="length of the synthetic speech")
+    p.add_argument("--seed", type=int, default=0, help="synthetic speech seed")
+    p.add_argument("--speed", type=float, default=1, help="times real time. 0 feeds as fast as possible.")
+    p.add_argument("--block-time", type=float, default=0.1, help="seconds per recorded block")
+    p.add_argument("--segmenter", default="vad", choices=("vad", "fixed"))
+    p.add_argument("--streaming", action="store_true", help="use the streaming decoder")
+    p.add_argument("--adaptive", action="store_true", help="resize chunks to keep up")
+    p.add_argument("--target-latency", type=float, default=3, help="adaptive: seconds")
+    p.add_argument("--queue-size", type=int, default=4)
+    p.add_argument("--backpressure", default="merge", choices=("drop_oldest", "merge", "block"))
+    p.add_argument("--max-batch-wait", type=float, default=0)
+    p.add_argument("--delay", type=float, default=0.2, help="fake backend: seconds per call")
+    p.add_argument("--per-second", type=float, default=0.05, help="fake backend: seconds per second of audio")
+    p.add_argument("--batch-size", type=int, default=1, help="fake backend: batch size")
+    p.add_argument("--concurrency", type=int, default=1, help="fake backend: parallel calls")
+    p.add_argument("--prepare-time", type=float, default=0,
+        help="fake backend: seconds of feature extraction per call")
+    p.add_argument("--no-prefetch", action="store_true",
+        help="don't prepare queued chunks while the model is busy")
+    p.add_argument("--stub", type=float, metavar="DELAY",
+        help="start a stub whisper-server answering after DELAY seconds and use the cpp backend")
+    p.add_argument("--server", action="append", dest="urls", metavar="URL",
+        help="server for network backends")
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Caption Anything benchmarks")
+    sub = parser.add_subparsers(dest="bench", required=True)
+    p = sub.add_parser("handoff", help="per-chunk cost of getting audio to the model")
+    p.add_argument("--rate", type=int, default=16000, help="recording sample rate")
+    p.add_argument("--chunk-time", type=int, default=2, help="seconds per chunk")
+    p.add_argument("--repeat", type=int, default=50)
+    p.set_defaults(func=bench_handoff)
+    p = sub.add_parser("generate", help="per-chunk overhead of tqdm_generate vs stream_generate")
+    p.add_argument("--seconds", type=float, default=2, help="audio length per call")
+    p.add_argument("--repeat", type=int, default=10)
+    p.set_defaults(func=bench_generate)
+    p = sub.add_parser("dual", help="transcript + translation: two passes vs one shared encoder pass")
+    p.add_argument("--seconds", type=float, default=2, help="audio length per call")
+    p.add_argument("--repeat", type=int, default=10)
+    p.add_argument("--profile", default="large-v2",
+        choices=[name for name, profile in PROFILES.items() if profile.multilingual()])
+    p.set_defaults(func=bench_dual)
+    p = sub.add_parser("engines", help="compare backends on the same audio")
+    p.add_argument("backends", nargs="+", choices=list(BACKENDS))
+    p.add_argument("--file", help="WAV file to transcribe (default: 10 s of noise)")
+    p.add_argument("--segmenter", default="fixed", help="how to cut the file into chunks")
+    p.add_argument("--server", action="append", dest="urls", metavar="URL",
+        help="server for network backends")
+    p.set_defaults(func=bench_engines)
+    p = sub.add_parser("pipeline", help="caption latency through the whole app, without a sound card")
+    pipeline_arguments(p)
+    p.set_defaults(func=bench_pipeline)
+    p = sub.add_parser("prefetch", help="pipeline with and without preparing queued chunks ahead")
+    pipeline_arguments(p)
+    p.set_defaults(func=bench_prefetch, speed=8, prepare_time=0.1)
+    p = sub.add_parser("sources", help="several file-backed sources sharing one fake backend")
+    p.add_argument("files", nargs="*", help="one audio file per source (default: synthetic speech)")
+    p.add_argument("--count", type=int, default=2, help="synthetic sources")
+    p.add_argument("--seconds", type=float, default=20, help="length of each synthetic source")
+    p.add_argument("--speed", type=positive_float, default=4, help="times real time")
+    p.add_argument("--delay", type=float, default=0.2, help="fake backend: seconds per call")
+    p.add_argument("--per-second", type=float, default=0.05, help="fake backend: seconds per second of audio")
+    p.add_argument("--batch-size", type=int, default=1, help="fake backend: batch size")
+    p.add_argument("--concurrency", type=int, default=1, help="fake backend: parallel calls")
+    p.set_defaults(func=bench_sources)
+    p = sub.add_parser("gradio", help="gradio backend job pipelining against stub servers")
+    p.add_argument("--concurrency", type=int, nargs="+", default=[1, 2, 4, 8],
+        help="requests each stub server works on at once")
+    p.add_argument("--in-flight", type=int, default=8, help="jobs submitted at once")
+    p.add_argument("--seconds", type=float, default=60, help="length of the synthetic speech")
+    p.add_argument("--chunk-time", type=float, default=2, help="seconds per chunk")
+    p.add_argument("--delay", type=float, default=0.2, help="stub server: seconds per request")
+    p.add_argument("--budget", type=float, default=0,
+        help="cancel jobs for audio older than this many seconds (0 keeps all)")
+    p.set_defaults(func=bench_gradio)
+    args = parser.parse_args(argv)
+    # Keep stdout for the JSON
+    with contextlib.redirect_stdout(sys.stderr):
+        results = args.func(args)
+    print(json.dumps(results, indent=2))
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,144 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+##
+## Copyright 2024 Henry Kroll <nospam@thenerdshow.com>
+##
+## This program is free software; you can redistribute it and/or modify
+## it under the terms of the GNU General Public License as published by
+## the Free Software Foundation; either version 2 of the License, or
+## (at your option) any later version.
+##
+## This program is distributed in the hope that it will be useful,
+## but WITHOUT ANY WARRANTY; without even the implied warranty of
+## MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+## GNU General Public License for more details.
+##
+## You should have received a copy of the GNU General Public License
+## along with this program; if not, write to the Free Software
+## Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston,
+## MA 02110-1301, USA.
+##
+## Caption Anything, with the transcription engine chosen on the command line.
+##
+## ./caption.py --backend jax
+## ./caption.py --backend cpp --server http://host1:7777/inference --server http://host2:7777/inference
+## ./caption.py --backend fake --delay 0.5
+## ./caption.py --backend cpp --metrics-port 9100 --metrics-log 30
+## ./caption.py --backend jax --refine-checkpoint openai/whisper-large-v2
+## ./caption.py --backend jax --profile small.en-f32
+import sys
+# Start the clock before anything slow is imported
+profile = None
+if "--profile-startup" in sys.argv:
+    from startup_profile import StartupProfile
+    profile = StartupProfile()
+import argparse
+from backends import BACKENDS, make_backend, options_of
+from profiles import PROFILES
+
+def parse_args(argv):
+    parser = argparse.ArgumentParser(description="Real-time captions for anything you can hear")
+    parser.add_argument("--backend", choices=list(BACKENDS), default="jax",
+        help="transcription engine (default: jax)")
+    parser.add_argument("--server", action="append", dest="urls", metavar="URL",
+        help="server for network backends. Repeat to balance load over several.")
+    parser.add_argument("--strategy", choices=("least_outstanding", "latency"),
+        help="how to pick a server for each chunk")
+    parser.add_argument("--in-flight", type=int, help="chunks sent to each server at once")
+    parser.add_argument("--latency-budget", type=float, metavar="SECONDS",
+        help="gradio: skip chunks still waiting this long after they were recorded")
+    parser.add_argument("--task", choices=("transcribe", "translate"), help="transcribe or translate to English")
+    parser.add_argument("--dual", action="store_true",
+        help="jax: transcribe and translate to English from one encoder pass")
+    parser.add_argument("--profile", choices=list(PROFILES),
+        help="jax: model and precision to start with (see ./profiles.py list)")
+    parser.add_argument("--delay", type=float, help="fake backend: seconds per chunk")
+    parser.add_argument("--refine", choices=list(BACKENDS), metavar="BACKEND",
+        help="re-caption saved recordings with this (slower, better) backend when idle")
+    parser.add_argument("--refine-checkpoint", metavar="NAME",
+        help="jax model to refine with, e.g. openai/whisper-large-v2")
+    parser.add_argument("--refine-server", action="append", dest="refine_urls", metavar="URL",
+        help="server for a network refining backend")
+    parser.add_argument("--source", action="append", dest="sources", metavar="ID",
+        help="also caption this device, or file:NAME.wav. Repeat for more.")
+    parser.add_argument("--record-tracks", choices=("channels", "files"),
+        help="several sources: save one multichannel file or one file each")
+    parser.add_argument("--adaptive", action="store_true",
+        help="resize chunks to keep up with the backend")
+    parser.add_argument("--target-latency", type=float, metavar="SECONDS",
+        help="adaptive: aim for captions this soon after speech")
+    parser.add_argument("--profile-startup", action="store_true",
+        help="print how long start-up steps and imports took")
+    parser.add_argument("--metrics-port", type=int,
+        help="serve per-stage timings at http://localhost:PORT/metrics (and /metrics.json)")
+    parser.add_argument("--metrics-log", type=float, metavar="SECONDS",
+        help="print a metrics summary every SECONDS")
+    # Whatever we don't know about goes to Gtk
+    return parser.parse_known_args(argv)
+
+# The flag for each backend option
+FLAGS = {"urls": "--server", "strategy": "--strategy", "in_flight": "--in-flight",
+    "latency_budget": "--latency-budget", "task": "--task", "delay": "--delay",
+    "dual": "--dual", "profile": "--profile"}
+
+# Options that were actually given, as backend keyword arguments.
+# ValueError if the backend doesn't take one of them.
+def backend_options(args):
+    options = {"urls": args.urls, "strategy": args.strategy, "in_flight": args.in_flight,
+        "latency_budget": args.latency_budget, "task": args.task, "delay": args.delay,
+        "dual": args.dual or None, "profile": args.profile}
+    options = {k: v for k, v in options.items() if v is not None}
+    unsupported = [FLAGS[k] for k in options if k not in options_of(args.backend)]
+    if unsupported:
+        raise ValueError(f"the {args.backend} backend doesn't take {', '.join(unsupported)}")
+    return options
+
+# The refining backend, or None
+def refine_backend(args):
+    name = args.refine or ("jax" if args.refine_checkpoint else None)
+    if not name: return None
+    from audio_utils import model_rate
+    options = {"urls": args.refine_urls, "checkpoint": args.refine_checkpoint, "task": args.task}
+    return make_backend(name, rate=model_rate, **{k: v for k, v in options.items() if v is not None})
+
+def main(argv=None):
+    argv = sys.argv if argv is None else argv
+    args, rest = parse_args(argv[1:])
+    # Gtk is imported only now, so --help works without a display
+    import gi
+    gi.require_version('Gtk', '4.0')
+    gi.require_version('Adw', '1')
+    from gi.repository import Adw, GLib
+    if profile: profile.mark("Gtk imported")
+    import interface
+    interface.profile = profile
+    if profile: profile.mark("interface imported")
+    if args.dual: interface.dual_task = True
+    if args.sources: interface.extra_sources = args.sources
+    if args.record_tracks: interface.record_tracks = args.record_tracks
+    if args.adaptive: interface.adaptive = True
+    if args.target_latency is not None: interface.target_latency = args.target_latency
+    if args.metrics_port is not None: interface.metrics_port = args.metrics_port
+    if args.metrics_log is not None: interface.metrics_log_time = args.metrics_log
+    try:
+        backend = make_backend(args.backend, rate=interface.sample_rate, **backend_options(args))
+    except ValueError as e:
+        sys.exit(f"caption.py: {e}")
+
+    class MyApp(Adw.Application):
+        def __init__(self, **kwargs):
+            super().__init__(**kwargs)
+            self.connect('activate', self.on_activate)
+
+        def on_activate(self, app):
+            self.win = interface.MainWindow(application=app, backend=backend,
+                refine_backend=refine_backend(args))
+            self.win.present()
+            self.win.captions_box.set_text("Loading...")
+            if profile: GLib.idle_add(lambda: profile.mark("window shown"))
+
+    app = MyApp(application_id="com.comptune.rec")
+    return app.run(argv[:1] + rest)
+
+if __name__ == "__main__":
+    sys.exit(main())
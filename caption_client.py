@@ -18,41 +18,9 @@
 ## Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston,
 ## MA 02110-1301, USA.
 ##
-## Gtk includes
-import gi
-gi.require_version('Gtk', '4.0')
-gi.require_version('Adw', '1')
-from gi.repository import Adw
-import sys, os
-from interface import MainWindow
+## Caption with a whisper-jax gradio server on the network.
+## Same as ./caption.py --backend gradio. Try ./caption.py --help for options.
+import sys
+from caption import main
 
-from gradio_client import Client
-client = Client("http://localhost:7860/")
-task = "transcribe"
-
-class cpWindow(MainWindow):
-    def transcribe(self, f, start_time, end_time):
-        try:
-            result = client.predict(f, task, False, api_name="/predict_1")
-            text_chunk = result[0].strip()
-            os.remove(f)
-            # Show the captions
-            if text_chunk != "you":
-                print(text_chunk)
-                self.show_caption(text_chunk)
-                self.text.append([start_time, end_time, text_chunk])
-        except Exception as e:
-            print("Exception:", e)
-
-class MyApp(Adw.Application):
-    def __init__(self, **kwargs):
-        super().__init__(**kwargs)
-        self.connect('activate', self.on_activate)
-
-    def on_activate(self, app):
-        self.win = cpWindow(application=app)
-        self.win.present()
-        self.win.captions_box.set_text("Ready to transcribe.")
-
-app = MyApp(application_id="com.comptune.rec")
-app.run(sys.argv)
+sys.exit(main(sys.argv[:1] + ["--backend", "gradio"] + sys.argv[1:]))
@@ -0,0 +1,173 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+##
+## Copyright 2024 Henry Kroll <nospam@thenerdshow.com>
+##
+## This program is free software; you can redistribute it and/or modify
+## it under the terms of the GNU General Public License as published by
+## the Free Software Foundation; either version 2 of the License, or
+## (at your option) any later version.
+##
+## This program is distributed in the hope that it will be useful,
+## but WITHOUT ANY WARRANTY; without even the implied warranty of
+## MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+## GNU General Public License for more details.
+##
+## You should have received a copy of the GNU General Public License
+## along with this program; if not, write to the Free Software
+## Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston,
+## MA 02110-1301, USA.
+##
+## Caption files, written one cue at a time as captions are committed.
+##
+## Each format is a CaptionSink registered under its file extension.
+## CaptionSinks writes a cue to every format and flushes them to disk
+## at most flush_time seconds later, even if no other cue follows, so a
+## crash loses almost nothing.
+import json
+import math
+import os
+import threading
+import time
+
+SINKS = {}
+DEFAULT_FORMATS = (".txt", ".srt", ".tsv", ".vtt")
+
+def register(ext):
+    def decorator(cls):
+        cls.ext = ext
+        SINKS[ext] = cls
+        return cls
+    return decorator
+
+def srt_time(time):
+    hours = int(time / 3600)
+    minutes = int((time % 3600) / 60)
+    seconds = int(time % 60)
+    milliseconds = int((time % 1) * 1000)
+    return "{:02d}:{:02d}:{:02d},{:03d}".format(hours, minutes, seconds, milliseconds)
+
+def vtt_time(time):
+    return srt_time(time).replace(',', '.')
+
+def tsv_time(time):
+    return math.floor(time*1000)
+
+class CaptionSink:
+    ext = ""
+
+    def __init__(self, path):
+        self.path = path
+        self.file = open(path, 'w', encoding='utf-8')
+        self.count = 0
+        self.file.write(self.header())
+
+    def header(self):
+        return ""
+
+    # words: optional list of (start, end, word), for formats that keep them
+    def write(self, start, end, text, words=None):
+        self.count += 1
+        self.file.write(self.cue(start, end, text, words))
+
+    def cue(self, start, end, text, words):
+        raise NotImplementedError
+
+    def flush(self):
+        self.file.flush()
+        os.fsync(self.file.fileno())
+
+    def close(self):
+        if not self.file.closed: self.file.close()
+
+@register(".txt")
+class TxtSink(CaptionSink):
+    def cue(self, start, end, text, words):
+        return text + '\n'
+
+@register(".srt")
+class SrtSink(CaptionSink):
+    def cue(self, start, end, text, words):
+        return f"{self.count}\n{srt_time(start)} --> {srt_time(end)}\n{text}\n\n"
+
+@register(".tsv")
+class TsvSink(CaptionSink):
+    def header(self):
+        return "start\tend\ttext\n"
+
+    def cue(self, start, end, text, words):
+        return f"{tsv_time(start)}\t{tsv_time(end)}\t{text}\n"
+
+@register(".vtt")
+class VttSink(CaptionSink):
+    def header(self):
+        return "WEBVTT\n\n"
+
+    def cue(self, start, end, text, words):
+        return f"{vtt_time(start)} --> {vtt_time(end)}\n{text}\n\n"
+
+# One JSON object per line, with word timings when the backend has them
+@register(".jsonl")
+class JsonlSink(CaptionSink):
+    def cue(self, start, end, text, words):
+        cue = {"start": round(start, 3), "end": round(end, 3), "text": text}
+        if words:
+            cue["words"] = [{"start": round(s, 3), "end": round(e, 3), "word": w} for s, e, w in words]
+        return json.dumps(cue, ensure_ascii=False) + '\n'
+
+# All the caption files for one session. They are written as
+# base + ext + ".part" and renamed by save().
+class CaptionSinks:
+    def __init__(self, base, formats=DEFAULT_FORMATS, flush_time=2):
+        for ext in formats:
+            if ext not in SINKS: raise ValueError(f"Unknown caption format: {ext}")
+        self.sinks = [SINKS[ext](base + ext + ".part") for ext in formats]
+        self.flush_time = flush_time
+        self.flushed = time.monotonic()
+        self.timer = None # flushes cues that nothing came after
+        self.closed = False
+        self.lock = threading.Lock()
+
+    def write(self, start, end, text, words=None):
+        with self.lock:
+            for sink in self.sinks:
+                sink.write(start, end, text, words)
+            if time.monotonic() - self.flushed > self.flush_time:
+                self.flush()
+            elif self.timer is None:
+                self.timer = threading.Timer(self.flush_time, self.flush_later)
+                self.timer.daemon = True
+                self.timer.start()
+
+    def flush(self):
+        for sink in self.sinks: sink.flush()
+        self.flushed = time.monotonic()
+
+    def flush_later(self):
+        with self.lock:
+            self.timer = None
+            if not self.closed: self.flush()
+
+    def close(self):
+        with self.lock:
+            if self.timer: self.timer.cancel()
+            self.timer = None
+            if self.closed: return
+            self.closed = True
+            for sink in self.sinks: sink.close()
+
+    # Close and rename to base + ext. Returns the new names.
+    def save(self, base):
+        self.close()
+        names = []
+        for sink in self.sinks:
+            name = base + sink.ext
+            os.replace(sink.path, name)
+            sink.path = name
+            names.append(name)
+        return names
+
+    def discard(self):
+        self.close()
+        for sink in self.sinks:
+            if os.path.exists(sink.path): os.remove(sink.path)
@@ -0,0 +1,201 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+##
+## Copyright 2024 Henry Kroll <nospam@thenerdshow.com>
+##
+## This program is free software; you can redistribute it and/or modify
+## it under the terms of the GNU General Public License as published by
+## the Free Software Foundation; either version 2 of the License, or
+## (at your option) any later version.
+##
+## This program is distributed in the hope that it will be useful,
+## but WITHOUT ANY WARRANTY; without even the implied warranty of
+## MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+## GNU General Public License for more details.
+##
+## You should have received a copy of the GNU General Public License
+## along with this program; if not, write to the Free Software
+## Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston,
+## MA 02110-1301, USA.
+##
+## Sound card capture on its own thread, into a ring buffer.
+##
+## The capture thread does nothing but recorder.record() small blocks
+## and copy them into a preallocated RingBuffer, so whatever consumers
+## do (segmenting, writing files, waking the GUI) can never make it
+## miss audio. Consumers each get a Reader and take zero-copy views out
+## of the ring. Positions are counted in frames, so timestamps are
+## frame / rate and never drift.
+##
+## The ring is written twice, once at i and once at i + capacity, so a
+## view of up to capacity frames starting anywhere is one contiguous
+## slice. A view stays valid until the capture thread comes round
+## again, capacity frames later. Copy anything kept longer than that.
+import threading
+import time
+import numpy as np
+import soundfile as sf
+from audio_utils import resample, to_mono
+import metrics
+
+class RingBuffer:
+    def __init__(self, capacity, channels=1, dtype=np.float32):
+        self.capacity = capacity
+        self.buffer = np.zeros((2 * capacity, channels), dtype)
+        self.written = 0 # frames written since the start
+        self.cond = threading.Condition()
+        self.closed = False
+
+    def write(self, block):
+        n = len(block)
+        skip = max(0, n - self.capacity) # only the newest capacity frames fit
+        block = block[skip:]
+        with self.cond:
+            # Frame f always lives at f % capacity
+            start = (self.written + skip) % self.capacity
+            first = min(len(block), self.capacity - start)
+            rest = len(block) - first
+            for offset in (0, self.capacity):
+                self.buffer[offset + start:offset + start + first] = block[:first]
+                self.buffer[offset:offset + rest] = block[first:]
+            self.written += n
+            self.cond.notify_all()
+
+    # No more audio is coming. Readers get what is left, then None.
+    def close(self):
+        with self.cond:
+            self.closed = True
+            self.cond.notify_all()
+
+    def reader(self):
+        return Reader(self)
+
+class Reader:
+    def __init__(self, ring):
+        self.ring = ring
+        self.position = ring.written # next frame to read
+        self.overruns = 0  # times the capture thread lapped this reader
+        self.lost = 0      # frames lost to overruns
+        self.underruns = 0 # times no audio arrived within the timeout
+
+    # Returns (first frame, view) with up to max_frames new frames, or
+    # (position, None) once the ring is closed and drained. Waits at most
+    # timeout seconds for audio, returning an empty view if none came.
+    def read(self, max_frames, timeout=None):
+        ring = self.ring
+        with ring.cond:
+            if ring.written == self.position and not ring.closed:
+                if not ring.cond.wait_for(lambda: ring.written > self.position or ring.closed, timeout):
+                    self.underruns += 1
+                    metrics.count("capture_underruns")
+            behind = ring.written - self.position
+            if behind > ring.capacity:
+                # Too slow. The oldest audio was overwritten. Skip it.
+                lost = behind - ring.capacity
+                self.overruns += 1
+                self.lost += lost
+                metrics.count("capture_overruns")
+                metrics.count("capture_lost_frames", lost)
+                self.position += lost
+                behind = ring.capacity
+            if not behind and ring.closed: return self.position, None
+            n = min(behind, max_frames)
+            start = self.position % ring.capacity
+            view = ring.buffer[start:start + n]
+            first = self.position
+            self.position += n
+            return first, view
+
+    def available(self):
+        with self.ring.cond:
+            return self.ring.written - self.position
+
+## Reads blocks from a soundcard recorder until stop() or stop_event.
+## open_recorder() returns a context manager like
+## sc.get_microphone(id).recorder(samplerate=rate, channels=channels).
+class CaptureThread:
+    def __init__(self, open_recorder, rate, channels=1, block_time=0.02,
+            capacity_time=30, stop_event=None):
+        self.open_recorder = open_recorder
+        self.rate = rate
+        self.block = max(1, int(rate * block_time))
+        self.ring = RingBuffer(int(rate * capacity_time), channels)
+        self.stop_event = stop_event or threading.Event()
+        self.short_reads = 0 # recorder gave back fewer frames than asked
+        self.thread = threading.Thread(target=self.run, daemon=True, name="capture")
+
+    def reader(self):
+        return self.ring.reader()
+
+    def start(self):
+        self.thread.start()
+
+    def run(self):
+        try:
+            with self.open_recorder() as recorder:
+                while not self.stop_event.is_set():
+                    with metrics.timer("capture_wait"):
+                        data = recorder.record(numframes=self.block)
+                    if len(data) < self.block:
+                        self.short_reads += 1
+                        metrics.count("capture_short_reads")
+                    self.ring.write(data)
+        except EOFError:
+            pass # a file source ran out
+        except Exception as e:
+            print("Exception:", e)
+        finally:
+            self.ring.close()
+
+    # Frames captured so far, and the time of a frame, from the sample count
+    def frames(self):
+        return self.ring.written
+
+    def time_of(self, frame):
+        return frame / self.rate
+
+    def stop(self):
+        self.stop_event.set()
+
+    def join(self):
+        self.thread.join()
+
+## Plays an audio file as if it were a sound card, at speed times real
+## time. For testing without one. record() raises EOFError at the end.
+class FileRecorder:
+    def __init__(self, path, samplerate, channels=1, speed=1.0):
+        self.path = path
+        self.rate = samplerate
+        self.channels = channels
+        self.speed = speed
+
+    def __enter__(self):
+        self.file = sf.SoundFile(self.path)
+        self.position = 0
+        self.started = time.monotonic()
+        return self
+
+    def __exit__(self, *exc):
+        self.file.close()
+
+    def record(self, numframes):
+        # Frames of the file that make numframes at our rate
+        want = max(1, round(numframes * self.file.samplerate / self.rate))
+        data = self.file.read(want, dtype='float32', always_2d=True)
+        if not len(data): raise EOFError(self.path)
+        if self.file.samplerate != self.rate or data.shape[1] != self.channels:
+            mono = resample(to_mono(data), self.file.samplerate, self.rate)
+            data = np.repeat(mono.reshape(-1, 1), self.channels, axis=1).astype(np.float32)
+        self.position += len(data)
+        if self.speed:
+            delay = self.started + self.position / self.rate / self.speed - time.monotonic()
+            if delay > 0: time.sleep(delay)
+        return data
+
+# "file:name.wav" plays a file. Anything else is a soundcard device id,
+# loopback (monitor) devices included.
+def open_source(source, rate, channels=1):
+    if source.startswith("file:"):
+        return FileRecorder(source[5:], rate, channels)
+    import soundcard as sc
+    return sc.get_microphone(source, include_loopback=True).recorder(samplerate=rate, channels=channels)
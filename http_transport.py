@@ -0,0 +1,84 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+##
+## Copyright 2024 Henry Kroll <nospam@thenerdshow.com>
+##
+## This program is free software; you can redistribute it and/or modify
+## it under the terms of the GNU General Public License as published by
+## the Free Software Foundation; either version 2 of the License, or
+## (at your option) any later version.
+##
+## This program is distributed in the hope that it will be useful,
+## but WITHOUT ANY WARRANTY; without even the implied warranty of
+## MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+## GNU General Public License for more details.
+##
+## You should have received a copy of the GNU General Public License
+## along with this program; if not, write to the Free Software
+## Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston,
+## MA 02110-1301, USA.
+##
+## Keep-alive HTTP transport for whisper.cpp's /inference endpoint.
+##
+## One requests.Session with a connection pool is shared by all worker
+## threads, so chunks reuse open connections instead of doing a TCP
+## handshake each time. The multipart form is built in memory, with
+## the constant form fields encoded only once. form_file() reads such a
+## form back, for the servers.
+import uuid
+from email.parser import BytesParser
+from email import policy
+from urllib.parse import urljoin
+import requests
+import metrics
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+# Pull the uploaded file out of a multipart/form-data body
+def form_file(content_type, body, name="file"):
+    message = BytesParser(policy=policy.HTTP).parsebytes(
+        f"Content-Type: {content_type}\r\n\r\n".encode() + body)
+    for part in message.iter_parts():
+        if part.get_param("name", header="content-disposition") == name:
+            return part.get_payload(decode=True)
+    return None
+
+class Transport:
+    def __init__(self, url, fields=None, timeout=30, connect_timeout=3,
+            retries=2, backoff=0.3, pool_size=4):
+        self.url = url
+        self.timeout = (connect_timeout, timeout)
+        self.session = requests.Session()
+        # Retry failed connections and server errors, POST included
+        retry = Retry(total=retries, backoff_factor=backoff,
+            status_forcelist=(500, 502, 503, 504), allowed_methods=None)
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size, max_retries=retry)
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+        # Pre-encode everything in the form except the audio itself
+        self.boundary = uuid.uuid4().hex
+        head = b""
+        for name, value in (fields or {}).items():
+            head += (f'--{self.boundary}\r\nContent-Disposition: form-data; name="{name}"\r\n\r\n'
+                f'{value}\r\n').encode()
+        head += (f'--{self.boundary}\r\nContent-Disposition: form-data; name="file"; '
+            f'filename="audio.wav"\r\nContent-Type: audio/wav\r\n\r\n').encode()
+        self.head = head
+        self.tail = f"\r\n--{self.boundary}--\r\n".encode()
+        self.headers = {"Content-Type": f"multipart/form-data; boundary={self.boundary}"}
+
+    # POST a WAV (bytes) and return the decoded JSON reply
+    def post(self, wav):
+        with metrics.timer("network"):
+            response = self.session.post(self.url, data=b"".join((self.head, wav, self.tail)),
+                headers=self.headers, timeout=self.timeout)
+        response.raise_for_status()
+        return response.json()
+
+    # Is the server answering at all?
+    def check(self):
+        response = self.session.get(urljoin(self.url, "/"), timeout=self.timeout[0])
+        return response.status_code < 500
+
+    def close(self):
+        self.session.close()
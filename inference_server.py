@@ -0,0 +1,198 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+##
+## Copyright 2024 Henry Kroll <nospam@thenerdshow.com>
+##
+## This program is free software; you can redistribute it and/or modify
+## it under the terms of the GNU General Public License as published by
+## the Free Software Foundation; either version 2 of the License, or
+## (at your option) any later version.
+##
+## This program is distributed in the hope that it will be useful,
+## but WITHOUT ANY WARRANTY; without even the implied warranty of
+## MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+## GNU General Public License for more details.
+##
+## You should have received a copy of the GNU General Public License
+## along with this program; if not, write to the Free Software
+## Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston,
+## MA 02110-1301, USA.
+##
+## One warm model for every program on the machine.
+##
+## ./inference_server.py --port 7777
+## ./caption.py --backend cpp --server http://127.0.0.1:7777/inference
+## ./batch_transcribe.py --backend cpp --server http://127.0.0.1:7777/inference talks/
+##
+## Loads a backend once (whisper-jax by default) and answers POST
+## /inference the way whisper.cpp's whisper-server does, so the cpp
+## backend works with it unchanged. Requests from all clients go into
+## one queue and are batched together. With --ws-port (and the
+## websockets package installed), clients can also stream raw 16 kHz
+## mono float32 audio over a WebSocket and get captions back as JSON.
+import argparse
+import io
+import json
+import sys
+import threading
+from concurrent.futures import Future
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import numpy as np
+import soundfile as sf
+from audio_utils import to_model_input, model_rate
+from backends import BACKENDS, TranscriptionBackend, make_backend
+from http_transport import form_file
+from workers import Chunk, ChunkQueue, Workers, BLOCK
+from session import Session
+import metrics
+
+## A backend in front of a backend. Every transcribe() call, from any
+## thread, waits in a shared queue, and the workers send whatever has
+## piled up to the real backend as one batch.
+class SharedModel(TranscriptionBackend):
+    name = "shared"
+
+    def __init__(self, backend, max_batch_wait=0.02, queue_size=256, concurrency=8):
+        super().__init__(backend.rate)
+        self.backend = backend
+        self.concurrency = concurrency # callers that may wait at once
+        self.queue = ChunkQueue(queue_size, BLOCK)
+        batch = backend.batch_size
+        handler = self.run_batch if batch > 1 else lambda chunk: self.run_batch([chunk])
+        self.workers = Workers(self.queue, handler, backend.concurrency, batch, max_batch_wait)
+        self.workers.start()
+
+    def recognize(self, audio):
+        return self.transcribe(audio)
+
+    # The real backend gets the same audio later, so it can start early
+    def prefetch(self, audio):
+        self.backend.prefetch(audio)
+
+    def transcribe(self, audio):
+        chunk = Chunk(audio, 0.0, len(audio) / self.rate)
+        chunk.future = Future()
+        if not self.queue.put(chunk): raise RuntimeError("Server is shutting down")
+        return chunk.future.result()
+
+    def run_batch(self, chunks):
+        metrics.count("batches")
+        metrics.count("batched_requests", len(chunks))
+        try:
+            texts = self.backend.transcribe_batch([chunk.audio for chunk in chunks])
+        except Exception as e:
+            for chunk in chunks: chunk.future.set_exception(e)
+            return
+        for chunk, text in zip(chunks, texts):
+            chunk.future.set_result(text)
+
+    def stats(self):
+        return self.backend.stats()
+
+    def close(self):
+        super().close()
+        self.queue.close()
+        self.workers.join()
+        self.backend.close()
+
+class Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1" # keep-alive
+    model = None
+
+    def do_GET(self):
+        if self.path == "/metrics":
+            return self.reply(200, metrics.registry.prometheus(), "text/plain; version=0.0.4")
+        if self.path == "/metrics.json":
+            return self.reply(200, json.dumps(metrics.registry.as_dict()))
+        self.reply(200, json.dumps({"status": "ok", **self.model.stats()}))
+
+    def do_POST(self):
+        if self.path != "/inference":
+            return self.reply(404, json.dumps({"error": "not found"}))
+        body = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+        content_type = self.headers.get("Content-Type", "")
+        wav = form_file(content_type, body)
+        if wav is None:
+            return self.reply(400, json.dumps({"error": "no file"}))
+        try:
+            audio, rate = sf.read(io.BytesIO(wav), dtype='float32', always_2d=True)
+            text = self.model.transcribe(to_model_input(audio, rate))
+        except Exception as e:
+            return self.reply(500, json.dumps({"error": str(e)}))
+        if form_file(content_type, body, "response-format") == b"text":
+            return self.reply(200, text, "text/plain; charset=utf-8")
+        self.reply(200, json.dumps({"text": text}))
+
+    def reply(self, code, data, kind="application/json"):
+        data = data.encode()
+        self.send_response(code)
+        self.send_header("Content-Type", kind)
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, *args):
+        pass
+
+# Start answering /inference in the background. Returns the server.
+def serve(model, port=7777, host="127.0.0.1"):
+    handler = type("ModelHandler", (Handler,), {"model": model})
+    server = ThreadingHTTPServer((host, port), handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+## WebSocket streaming. Binary messages are 16 kHz mono float32 samples.
+## Captions come back as {"start", "end", "text"} once the voice
+## activity detector cuts a segment. Send the text "end" to flush.
+def serve_websocket(model, port, host="127.0.0.1"):
+    try:
+        from websockets.sync.server import serve as ws_serve
+    except ImportError:
+        print("WebSocket streaming needs the websockets package: pip install websockets")
+        return None
+    def stream(ws):
+        def emit(start, end, text, tentative=""):
+            if text: ws.send(json.dumps({"start": start, "end": end, "text": text}))
+        session = Session(model, emit, model_rate, "vad")
+        session.start()
+        try:
+            for message in ws:
+                if isinstance(message, str):
+                    if message == "end": break
+                    continue
+                session.feed(np.frombuffer(message, np.float32).reshape(-1, 1))
+        finally:
+            session.close()
+    server = ws_serve(stream, host, port)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Share one loaded model between clients")
+    parser.add_argument("--backend", choices=list(BACKENDS), default="jax")
+    parser.add_argument("--host", default="127.0.0.1", help="0.0.0.0 to serve the network")
+    parser.add_argument("--port", type=int, default=7777)
+    parser.add_argument("--ws-port", type=int, help="also stream over a WebSocket on this port")
+    parser.add_argument("--task", choices=("transcribe", "translate"))
+    parser.add_argument("--server", action="append", dest="urls", metavar="URL",
+        help="for network backends: where to forward requests")
+    parser.add_argument("--batch-wait", type=float, default=0.02,
+        help="seconds to wait for other clients' requests to batch with")
+    args = parser.parse_args(argv)
+    options = {k: v for k, v in (("urls", args.urls), ("task", args.task)) if v is not None}
+    backend = make_backend(args.backend, rate=model_rate, **options)
+    print(backend.warm_up())
+    model = SharedModel(backend, args.batch_wait)
+    server = serve(model, args.port, args.host)
+    print(f"Serving http://{args.host}:{server.server_port}/inference")
+    if args.ws_port and serve_websocket(model, args.ws_port, args.host):
+        print(f"Streaming on ws://{args.host}:{args.ws_port}/")
+    try:
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        server.shutdown()
+        model.close()
+
+if __name__ == "__main__":
+    sys.exit(main())
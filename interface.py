@@ -26,29 +26,77 @@ from gi.repository import Gtk, Adw, Gdk, Gio, GLib, GObject
 import os
 
 ## Audio includes
-import soundcard as sc
-import soundfile as sf
-import numpy as np
 import threading
-import math
 import time
-import tempfile
+from session import Session, SessionGroup
+from refine import Refiner
+from capture import CaptureThread, open_source
+from recording_writer import RecordingWriter, MultiTrackWriter, TrackFiles
+from caption_sinks import CaptionSinks, DEFAULT_FORMATS, srt_time
+from timeline import Timeline, RecordingView
+import metrics
 
 sample_rate = 16000
 channels = 1
-chunk_time = 2 # Process 2-second chunks. Larger is more-accurate, slower.
+segmenter = "vad" # "vad" cuts at pauses and skips silence. "fixed" cuts every chunk_time.
+chunk_time = 2 # Fixed segmenter: 2-second chunks. Larger is more-accurate, slower.
+min_chunk_time = 1 # VAD segmenter: don't cut at pauses shorter than this
+max_chunk_time = 10 # VAD segmenter: cut here even if nobody pauses
+capture_time = 0.02 # Read from the sound card this often, on its own thread
+block_time = 0.1 # Most captured audio handed to the segmenter at once
+ring_time = 30 # Seconds of captured audio buffered. Must exceed max_chunk_time.
+extra_sources = [] # Also caption these, e.g. "file:test.wav" or a device id
+record_tracks = "channels" # Several sources: one multichannel "channels" file, or "files"
+streaming = False # Re-decode a rolling window. Show only words two passes agree on.
+window_time = 8 # Streaming: seconds of audio to re-decode
+hop_time = 1 # Streaming: re-decode this often
 max_duration = 120 * 60 # Max recording duration: quits after 120 minutes
-task = "transcribe"
+record_format = "wav" # or "flac" for smaller recordings
+caption_formats = list(DEFAULT_FORMATS) # also ".jsonl"
+caption_flush_time = 2 # Seconds between saving captions to disk
+dual_task = False # Also show and save an English translation (jax backend, ./caption.py --dual)
+queue_size = 4 # Max chunks waiting to be transcribed
+backpressure = "merge" # When transcription falls behind: "drop_oldest", "merge" or "block"
+max_batch_wait = 0 # Seconds to wait for more chunks to batch. 0 never delays a lone chunk.
+adaptive = False # Resize chunks between min_chunk_time and max_chunk_time to keep up
+target_latency = 3 # Adaptive: aim for captions this many seconds after speech
+metrics_port = 0 # Serve per-stage timings at http://localhost:port/metrics. 0 is off.
+metrics_log_time = 0 # Print a metrics summary this often, in seconds. 0 is off.
+profile = None # a startup_profile.StartupProfile, from ./caption.py --profile-startup
 
 ## Gtk boilerplate code
 class MainWindow(Gtk.ApplicationWindow):
-    def __init__(self, *args, **kwargs):
+    def __init__(self, *args, backend=None, refine_backend=None, **kwargs):
         super().__init__(*args, **kwargs)
+        self.backend = backend # a backends.TranscriptionBackend
+        # Optional bigger model that re-captions saved recordings when
+        # the live one has nothing to do. See refine.py.
+        self.refine_backend = refine_backend
+        # Nothing can interrupt a decode once it has started. Sharing this
+        # machine with the live model, it waits until nobody is recording.
+        self.refine_between = bool(refine_backend and refine_backend.local and backend.local)
+        self.refine_ready = threading.Event()
+        self.refiner = None
         self.connect("destroy", self.on_delete)
-        self.allow_transcribing = False
+        # Recording may start right away. Chunks wait in the queue until
+        # get_pipeline() says the backend is ready.
+        self.allow_transcribing = True
+        self.ready = threading.Event()
         # Create an event object to signal mixer to stop
         self.stop_event = threading.Event()
+        self.stop_event.set() # Not recording yet
+        self.writer = None
+        self.sinks = None
+        self.translation_sinks = None
+        self.timeline = Timeline() # every caption, for search and replay
+        self.query = ""
+        self.matches = [] # caption indexes found by the search box
+        self.match = -1
+        self.replay_index = None
         self.set_default_size(500, 50)
+        if metrics_port: metrics.serve(metrics_port)
+        if metrics_log_time: metrics.start_logging(metrics_log_time)
+        metrics.registry.add_callback(self.metrics_gauges)
 
         # Make a DropDown list of audio device names & IDs
         # from https://github.com/ksaadDE/GTK4PythonExamples/blob/main/DropDown.md
@@ -64,21 +112,32 @@ class MainWindow(Gtk.ApplicationWindow):
             def get_id(self):
                 return self.id
 
-        mics = sc.all_microphones(include_loopback=True)
-        device_list = Gio.ListStore.new(device)
-        last = -1
-        for m in mics:
-            device_list.append(device(m.id, m.name))
-            last += 1
+        # Devices are listed on another thread, so the window shows up now
+        self.device_class = device
+        self.device_names = {}
+        self.input_id = None
+        self.device_list = Gio.ListStore.new(device)
+        self.device_list.append(device(None, "Looking for devices..."))
 
         # Populate DropDown menu with device names
         device_factory = Gtk.SignalListItemFactory()
-        device_menu = Gtk.DropDown(model=device_list, factory=device_factory)
+        device_menu = Gtk.DropDown(model=self.device_list, factory=device_factory)
         device_factory.connect("setup", self.on_device_factory_setup)
         device_factory.connect("bind", self.on_device_factory_bind)
         device_menu.connect("notify::selected-item", self.on_device_notify)
-        # We usually want to record from the last device we plugged in
-        device_menu.set_selected(last)
+        self.device_menu = device_menu
+
+        # A second source, e.g. the speakers' monitor, captioned separately
+        self.second_id = ""
+        self.second_list = Gio.ListStore.new(device)
+        self.second_list.append(device("", "nothing else"))
+        second_factory = Gtk.SignalListItemFactory()
+        second_menu = Gtk.DropDown(model=self.second_list, factory=second_factory)
+        second_factory.connect("setup", self.on_device_factory_setup)
+        second_factory.connect("bind", self.on_device_factory_bind)
+        second_menu.connect("notify::selected-item", self.on_second_notify)
+        second_menu.set_selected(0)
+        threading.Thread(target=self.list_devices, daemon=True).start()
 
         label = Gtk.Label()
         label.set_text("  From ")
@@ -88,12 +147,46 @@ class MainWindow(Gtk.ApplicationWindow):
         self.set_child(vbox)
         hbox.append(label)
         hbox.append(device_menu)
+        and_label = Gtk.Label()
+        and_label.set_text(" and ")
+        hbox.append(and_label)
+        hbox.append(second_menu)
 
         # Create a GtkEntry box
         entry = Gtk.Entry()
         vbox.append(entry)
         self.captions_box = entry
 
+        # Words that might still change in streaming mode
+        self.tentative_box = Gtk.Label()
+        self.tentative_box.set_css_classes(['tentative'])
+        self.tentative_box.set_xalign(0)
+        self.tentative_box.set_visible(streaming)
+        vbox.append(self.tentative_box)
+
+        # English translation of the caption above, decoded from the same audio
+        self.translation_box = Gtk.Label()
+        self.translation_box.set_xalign(0)
+        self.translation_box.set_visible(dual_task)
+        vbox.append(self.translation_box)
+
+        # Run that by me again? Search what was said, and hear it again.
+        search_box = Gtk.Box(orientation=Gtk.Orientation.HORIZONTAL, spacing=6)
+        self.search_entry = Gtk.SearchEntry()
+        self.search_entry.set_placeholder_text("Search captions")
+        self.search_entry.set_hexpand(True)
+        self.search_entry.connect("activate", self.on_search)
+        search_box.append(self.search_entry)
+        again_button = Gtk.Button.new_with_label("Again")
+        again_button.set_tooltip_text("Play the caption found, or the last one, from the recording")
+        again_button.connect("clicked", self.on_again)
+        search_box.append(again_button)
+        vbox.append(search_box)
+        self.found_label = Gtk.Label()
+        self.found_label.set_xalign(0)
+        self.found_label.set_wrap(True)
+        vbox.append(self.found_label)
+
         # Adding your custom CSS stylesheet
         css_provider = Gtk.CssProvider()
         css_provider.load_from_path('style.css')
@@ -147,9 +240,41 @@ class MainWindow(Gtk.ApplicationWindow):
 
         menu.append("About", "win.open-about")
 
+        # Engine profiles, switched without stopping. Enabled once the
+        # first model is ready.
+        if self.backend.profiles:
+            self.profile_action = Gio.SimpleAction.new_stateful("profile",
+                GLib.VariantType.new("s"), GLib.Variant.new_string(self.backend.profile.name))
+            self.profile_action.connect("change-state", self.on_profile)
+            self.profile_action.set_enabled(False)
+            self.add_action(self.profile_action)
+            profiles = Gio.Menu()
+            for name in self.backend.profiles:
+                profiles.append(name, f"win.profile::{name}")
+            menu.prepend_submenu("Engine", profiles)
+
         self.init_pipe = threading.Thread(target=self.get_pipeline)
         self.init_pipe.start()
 
+    def list_devices(self):
+        import soundcard as sc
+        try:
+            mics = sc.all_microphones(include_loopback=True)
+        except Exception as e:
+            print("Exception:", e)
+            mics = []
+        GLib.idle_add(self.show_devices, mics)
+
+    def show_devices(self, mics):
+        self.device_names = {m.id: m.name for m in mics}
+        devices = [self.device_class(m.id, m.name) for m in mics]
+        self.device_list.splice(0, self.device_list.get_n_items(), devices)
+        self.second_list.splice(1, 0, [self.device_class(m.id, m.name) for m in mics])
+        # We usually want to record from the last device we plugged in
+        if mics: self.device_menu.set_selected(len(mics) - 1)
+        if profile: profile.mark("devices listed")
+        return False
+
     def on_device_notify(self, dropdown, _pspec):
         # Selected Gtk.StringObject
         selected = dropdown.props.selected_item
@@ -157,6 +282,11 @@ class MainWindow(Gtk.ApplicationWindow):
             self.input_id = selected.get_id()
             print('Selected', self.input_id)
 
+    def on_second_notify(self, dropdown, _pspec):
+        selected = dropdown.props.selected_item
+        if selected is not None:
+            self.second_id = selected.get_id()
+
     def on_device_factory_setup(self, factory, list_item):
         label = Gtk.Label()
         list_item.set_child(label)
@@ -190,62 +320,208 @@ class MainWindow(Gtk.ApplicationWindow):
     ## Audio code
     def record_audio(self, widget, **kwargs):
         if not self.allow_transcribing: return False
+        if not self.input_id:
+            self.show_status("No audio device yet.", 'warning')
+            return False
         self.allow_transcribing = False # Don't allow double transcribing
         self.stop_event.clear() # Permit stopping
-        self.rec_thread = threading.Thread(target=self.recording_thread)
-        self.rec_thread.daemon = True
-        self.rec_thread.start() # Start transcribing
-        print("Transcribing")
-
-    def recording_thread(self):
-        # Start recording from the selected subdevice
-        subdevice = sc.get_microphone(self.input_id, True)
-        # Initialize text and audio buffers
-        self.recording = []
-        self.text = []
-        duration = channels * sample_rate * chunk_time
-        ttime = 0
-        begin = time.time()
-        with subdevice.recorder(samplerate=sample_rate, channels=channels) as recorder:
-            while not self.stop_event.is_set():
-                start_time = time.time() - begin
-                if start_time < 0.1: start_time = 0 # correct for load time
-                # Record the stream
-                audio_data = recorder.record(numframes=duration)
-                self.recording.append(audio_data)
-                end_time = time.time() - begin
-
-                # Save to "tempfile"
-                f = tempfile.mktemp()
-                # Doesn't really save anything. The OS treats tempfile as memory.
-                sf.write(f, audio_data, samplerate=sample_rate, format='wav')
-
-                # Transcribe audio with idle_add queue
-                GLib.idle_add(self.transcribe, f, start_time, end_time)
-
-                ttime += end_time - start_time
-
-                # Quit if max duration reached
-                if ttime > max_duration:
-                    print("Max recording duration reached. Stopping.")
-                    self.stop_audio()
+        # Forget the last session's captions
+        self.timeline = Timeline()
+        self.query, self.matches, self.replay_index = "", [], None
+        self.found_label.set_text("")
+        sources = [self.input_id] + ([self.second_id] if self.second_id else []) + extra_sources
+        # Each source gets its own capture thread, ring, segmenter and
+        # queue. The group's workers take turns between them.
+        self.group = SessionGroup(self.backend, max_batch_wait, self.ready, streaming)
+        part = f".caption_anything-{os.getpid()}-{int(time.time())}"
+        self.writer = self.make_writer(part, len(sources))
+        self.sinks = CaptionSinks(part, caption_formats, caption_flush_time)
+        self.translation_sinks = None
+        if dual_task:
+            self.translation_sinks = CaptionSinks(part + ".translation", caption_formats,
+                caption_flush_time)
+        self.sources = []
+        for index, source in enumerate(sources):
+            # Label captions by source, when there is more than one
+            label = self.source_label(source) if len(sources) > 1 else None
+            session = Session(self.backend,
+                lambda *caption, label=label, index=index: self.add_caption(*caption,
+                    source=label, track=index),
+                sample_rate, segmenter, chunk_time, min_chunk_time, max_chunk_time,
+                streaming, window_time, hop_time, queue_size, backpressure, max_batch_wait,
+                show_tentative=lambda tentative: GLib.idle_add(self.show_tentative, tentative),
+                adaptive=adaptive, target_latency=target_latency, group=self.group)
+            # The sound card is read on its own thread, into a ring buffer
+            capture = CaptureThread(lambda source=source: open_source(source, sample_rate, channels),
+                sample_rate, channels, capture_time, ring_time, self.stop_event)
+            reader = capture.reader()
+            writer = self.writer.track(index) if len(sources) > 1 else self.writer
+            thread = threading.Thread(target=self.recording_thread, args=(session, reader, writer),
+                daemon=True)
+            self.sources.append((label, session, capture, reader, thread))
+        # Refining needs each caption's audio on its own, so one source only
+        self.refiner = None
+        if self.refine_backend and len(sources) == 1:
+            self.refiner = Refiner(self.refine_backend, self.live_idle, self.refine_ready,
+                after_save=self.refine_between)
+            self.refiner.follow(self.writer.path)
+            self.refiner.start()
+        self.group.start()
+        for label, session, capture, reader, thread in self.sources:
+            capture.start()
+            thread.start() # Start transcribing
+        print("Transcribing", ", ".join(self.source_label(source) for source in sources))
+
+    # Stream the recording to disk. Stop/Save just renames it. Several
+    # sources go into one multichannel file, or one file each.
+    def make_writer(self, part, count):
+        if count == 1:
+            return RecordingWriter(f"{part}.{record_format}.part", sample_rate, channels, record_format)
+        if record_tracks == "files":
+            return TrackFiles([RecordingWriter(f"{part}-{i + 1}.{record_format}.part", sample_rate,
+                channels, record_format) for i in range(count)])
+        return MultiTrackWriter(RecordingWriter(f"{part}.{record_format}.part", sample_rate,
+            channels * count, record_format), [channels] * count)
+
+    # The refiner only works while this is True
+    def live_idle(self):
+        if self.refine_between and not self.stop_event.is_set(): return False
+        return self.group.idle()
+
+    def source_label(self, source):
+        if source.startswith("file:"): return os.path.basename(source[5:])
+        return self.device_names.get(source, source)
+
+    # Takes captured audio out of the ring, until capture stops
+    def recording_thread(self, session, reader, writer):
+        # The file writer may lag behind on a slow disk, so it gets a
+        # copy. The segmenter is done with its view long before the
+        # ring comes round again.
+        try:
+            if session.follow(reader, int(sample_rate * block_time),
+                    lambda audio: writer.write(audio.copy()), max_duration):
+                print("Max recording duration reached. Stopping.")
+                GLib.idle_add(self.stop_audio, None)
+        finally:
+            # Other sources' tracks don't wait for this one any more
+            writer.end()
+
+    def add_caption(self, start_time, end_time, text_chunk, tentative="", translation=None,
+            source=None, track=0):
+        # Show the captions
+        if text_chunk and text_chunk != "you":
+            if source: text_chunk = f"{source}: {text_chunk}"
+            print(text_chunk)
+            if translation and source: translation = f"{source}: {translation}"
+            GLib.idle_add(self.show_caption, text_chunk, tentative, time.monotonic(), translation)
+            self.timeline.add(start_time, end_time, text_chunk, track)
+            self.sinks.write(start_time, end_time, text_chunk)
+            if self.refiner: self.refiner.add(start_time, end_time, text_chunk)
+            if translation and self.translation_sinks:
+                self.translation_sinks.write(start_time, end_time, translation)
 
     # Show audio captions on interface
-    def show_caption(self, text_chunk):
+    def show_caption(self, text_chunk, tentative="", posted=None, translation=None):
         self.captions_box.set_css_classes(['trans'])
         self.captions_box.set_text(text_chunk)
+        self.show_tentative(tentative)
+        if translation is not None: self.translation_box.set_text(translation)
+        # Time spent waiting for the main loop
+        if posted is not None: metrics.observe("display", time.monotonic() - posted)
         return False
 
+    def show_tentative(self, tentative):
+        self.tentative_box.set_text(tentative)
+        return False
+
+    # Enter finds captions with those words. Enter again for the next one.
+    def on_search(self, entry):
+        query = entry.get_text().strip()
+        if query != self.query:
+            self.query, self.match = query, -1
+            self.matches = self.timeline.search(query) if query else []
+        if not self.matches:
+            self.replay_index = None
+            self.found_label.set_text("Not found." if query else "")
+            return
+        self.match = (self.match + 1) % len(self.matches)
+        self.show_found(self.matches[self.match], f"{self.match + 1}/{len(self.matches)}")
+
+    def show_found(self, index, where):
+        start, end, text, track = self.timeline.cue(index)
+        self.found_label.set_text(f"{where}  {srt_time(start)[:8]}  {text}")
+        self.replay_index = index
+
+    def on_again(self, button):
+        index = self.replay_index
+        if index is None:
+            if not len(self.timeline): return
+            index = len(self.timeline) - 1
+            self.show_found(index, "Last")
+        threading.Thread(target=self.replay, args=(index,), daemon=True).start()
+
+    # Play a caption's audio, read straight out of the recording
+    def replay(self, index):
+        start, end, text, track = self.timeline.cue(index)
+        try:
+            with metrics.timer("replay_read"):
+                audio, rate = self.cue_audio(start, end, track)
+            if not len(audio):
+                GLib.idle_add(self.show_status, "Not saved to disk yet.", 'warning')
+                return
+            import soundcard as sc
+            sc.default_speaker().play(audio, samplerate=rate)
+        except Exception as e:
+            print("Exception:", e)
+
+    def cue_audio(self, start, end, track):
+        writer = self.writer
+        if isinstance(writer, TrackFiles):
+            return RecordingView(writer.writers[track].path).read(start, end)
+        audio, rate = RecordingView(writer.path).read(start, end)
+        if isinstance(writer, MultiTrackWriter):
+            first = sum(writer.channels[:track])
+            audio = audio[:, first:first + writer.channels[track]]
+        return audio, rate
+
     def stop_audio(self, widget, **kwargs):
+        if self.stop_event.is_set(): return False
+        self.stop_event.set()
+        # Let the workers finish the backlog without freezing the window
+        threading.Thread(target=self.drain_thread, daemon=True).start()
+        return False
+
+    def drain_thread(self):
+        try:
+            for label, session, capture, reader, thread in self.sources:
+                capture.join()
+                thread.join()
+                if reader.overruns:
+                    print(f"{label or 'Transcription'} fell behind capture {reader.overruns} times.",
+                        f"{reader.lost / sample_rate:.1f}s of audio replaced with silence.")
+            self.writer.close()
+            for label, session, capture, reader, thread in self.sources:
+                session.close()
+            self.group.close()
+            self.sinks.close()
+            if self.translation_sinks: self.translation_sinks.close()
+        except Exception as e:
+            print("Exception:", e)
+        GLib.idle_add(self.save_recording)
+
+    # Where the recording goes, with the right extension
+    def recording_name(self):
         filename = self.file_entry.get_text()
-        if not self.stop_event.is_set():
-            self.stop_event.set()
-            try:
-                self.rec_thread.join()
-            except Exception as e:
-                print("Exception:", e)
-        if len(self.recording):
-            if filename and os.path.isfile(filename):
+        if not filename:
+            filename = time.ctime().replace(" ", "_")
+        if os.path.splitext(filename)[1] != '.' + record_format:
+            filename += '.' + record_format
+        return filename
+
+    def save_recording(self):
+        filename = self.recording_name()
+        if self.writer and self.writer.frames:
+            if os.path.isfile(filename):
                 # File exists. Overwrite? Python gi Gtk(4.0) dialog.
                 message = Gtk.MessageDialog(
                 message_type=Gtk.MessageType.WARNING, buttons=Gtk.ButtonsType.YES_NO,
@@ -255,83 +531,100 @@ class MainWindow(Gtk.ApplicationWindow):
                 message.connect("response", self.write_file)
                 message.present()
             else: self.write_file(None, Gtk.ResponseType.YES)
+        else:
+            # Nothing was recorded. Don't leave the hidden parts behind.
+            if self.writer: self.writer.discard()
+            for sinks in (self.sinks, self.translation_sinks):
+                if sinks: sinks.discard()
+            if self.refiner: self.refiner.stop()
+            self.allow_transcribing = True
+        return False
 
     def write_file(self, widget, button):
         # If called as the result of a dialog, take down the dialog
         if widget: widget.destroy()
         # If it is okay to save the file
         if button == Gtk.ResponseType.YES:
-            filename = self.file_entry.get_text()
-            if not filename:
-                filename = time.ctime().replace(" ", "_")
-            if filename[-4:] != '.wav':
-                filename += ".wav"
-            # Save the recording to a file
-            rec = np.concatenate(self.recording)
+            filename = self.recording_name()
             try:
-                sf.write(filename, rec, samplerate=sample_rate, format='wav')
-                self.recording = []
-                print("File saved as", filename)
+                # The recording is already on disk. Just give it its name.
+                self.writer.save(filename)
+                print("File saved as", self.writer.path)
                 # Also save captions
-                exts = {".txt": '', ".srt": '', ".tsv": '', ".vtt": ''}
-                for ext in exts:
-                    if filename[-4] == '.':
-                        exts[ext] = filename[:-4] + ext
-                    else:
-                        exts[ext] = filename + ext
-
-                # write text tile
-                f = open(exts[".txt"], 'w')
-                f.write('\n'.join([x[2] for x in self.text]))
-                f.close()
-
-                # write srt
-                def srt_time(time):
-                    hours = int(time / 3600)
-                    minutes = int((time % 3600) / 60)
-                    seconds = int(time % 60)
-                    milliseconds = int((time % 1) * 1000)
-                    return "{:02d}:{:02d}:{:02d},{:03d}".format(hours, minutes, seconds, milliseconds)
-                f = open(exts[".srt"], 'w')
-                count = 0
-                for x in self.text:
-                    count += 1
-                    f.write(f"{count}\n")
-                    f.write(srt_time(x[0]) + " --> " + srt_time(x[1]) + '\n')
-                    f.write(x[2] + '\n')
-                    f.write('\n')
-                f.close()
-
-                # write tsv
-                def tsv_time(time):
-                    return math.floor(time*1000)
-                f = open(exts[".tsv"], 'w')
-                f.write("start\tend\ttext\n")
-                for x in self.text:
-                    f.write(f"{tsv_time(x[0])}\t{tsv_time(x[1])}\t{x[2]}\n")
-                f.close()
-
-                # write vtt
-                def vtt_time(time):
-                    minutes = int((time % 3600) / 60)
-                    seconds = int(time % 60)
-                    milliseconds = int((time % 1) * 1000)
-                    return "{:02d}:{:02d}.{:03d}".format(minutes, seconds, milliseconds)
-                f = open(exts[".vtt"], 'w')
-                f.write("WEBVTT\n\n")
-                for x in self.text:
-                    f.write(vtt_time(x[0]) + " --> " + vtt_time(x[1]) + '\n')
-                    f.write(x[2] + '\n')
-                    f.write('\n')
-                f.close()
-                self.text = []
+                for name in self.sinks.save(os.path.splitext(filename)[0]):
+                    print("Captions saved as", name)
+                if self.translation_sinks:
+                    base = os.path.splitext(filename)[0] + ".translation"
+                    for name in self.translation_sinks.save(base):
+                        print("Translation saved as", name)
+                # The refiner rewrites them as it goes
+                if self.refiner:
+                    self.refiner.save_to(self.writer.path, os.path.splitext(filename)[0],
+                        caption_formats)
             except Exception as e:
                 print(e)
+                if self.refiner: self.refiner.stop()
+        elif self.writer:
+            print("Not overwritten. Recording kept as", self.writer.path)
+            for sinks in (self.sinks, self.translation_sinks):
+                if sinks:
+                    for sink in sinks.sinks: print("Captions kept as", sink.path)
+            if self.refiner: self.refiner.stop()
         # Allow transcribing to begin again, even if no file was saved.
         self.allow_transcribing = True
 
+    # Runs on its own thread, so the window shows up while models load.
+    # Progress goes to the captions box.
     def get_pipeline(self):
-        self.captions_box.set_css_classes(['info'])
-        self.allow_transcribing = True # Allow transcribing
-
+        try:
+            message = self.backend.warm_up(
+                lambda progress: GLib.idle_add(self.show_status, progress, 'info'))
+            GLib.idle_add(self.show_status, message, 'info')
+        except Exception as e:
+            print("Exception:", e)
+            GLib.idle_add(self.show_status, "Could not load language model.", 'warning')
+        self.ready.set() # Transcribe whatever was recorded so far
+        if self.backend.profiles:
+            GLib.idle_add(self.profile_action.set_enabled, True)
+        if profile:
+            profile.mark("model ready")
+            print(profile.report())
+        if self.refine_backend:
+            # After the live model, so captions start as soon as possible
+            try:
+                print(self.refine_backend.warm_up())
+                self.refine_ready.set()
+            except Exception as e:
+                print("Exception:", e)
+                print("Could not load the refining model. Captions won't be refined.")
+                self.refine_backend = None
+
+    # The new profile loads in the background. Captions carry on with
+    # the old one meanwhile.
+    def on_profile(self, action, value):
+        name = value.get_string()
+        if name == action.get_state().get_string(): return
+        action.set_enabled(False)
+        threading.Thread(target=self.switch_profile, args=(name,), daemon=True).start()
+
+    def switch_profile(self, name):
+        report = lambda message: GLib.idle_add(self.show_status, message, 'info')
+        try:
+            self.backend.switch_profile(name, report)
+            GLib.idle_add(self.profile_action.set_state, GLib.Variant.new_string(name))
+        except Exception as e:
+            print("Exception:", e)
+            GLib.idle_add(self.show_status, f"Could not switch to {name}.", 'warning')
+        GLib.idle_add(self.profile_action.set_enabled, True)
+
+    # Sampled whenever metrics are read
+    def metrics_gauges(self):
+        stats = self.backend.stats()
+        return {"rtf": stats["rtf"], "audio_seconds": stats["audio_seconds"],
+            "recorded_seconds": self.writer.duration() if self.writer else 0.0}
+
+    def show_status(self, message, css_class):
+        self.captions_box.set_css_classes([css_class])
+        self.captions_box.set_text(message)
+        return False
 
@@ -0,0 +1,189 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+##
+## Copyright 2024 Henry Kroll <nospam@thenerdshow.com>
+##
+## This program is free software; you can redistribute it and/or modify
+## it under the terms of the GNU General Public License as published by
+## the Free Software Foundation; either version 2 of the License, or
+## (at your option) any later version.
+##
+## This program is distributed in the hope that it will be useful,
+## but WITHOUT ANY WARRANTY; without even the implied warranty of
+## MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+## GNU General Public License for more details.
+##
+## You should have received a copy of the GNU General Public License
+## along with this program; if not, write to the Free Software
+## Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston,
+## MA 02110-1301, USA.
+##
+## Latency and throughput numbers for every stage of the caption chain.
+##
+## Stages call observe("forward", seconds) or wrap work in
+## "with timer('forward'):". Counters and gauges cover dropped chunks,
+## queue depth and the like. serve(port) exposes everything at
+## http://localhost:port/metrics (Prometheus text) and /metrics.json.
+## start_logging(interval) prints a summary line every so often.
+import collections
+import json
+import math
+import threading
+import time
+from contextlib import contextmanager
+
+# Histogram bucket bounds, in seconds
+BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+# Recent samples kept for percentiles
+RESERVOIR = 1024
+
+class Histogram:
+    def __init__(self, buckets=BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1) # last one is +Inf
+        self.count = 0
+        self.sum = 0.0
+        self.recent = collections.deque(maxlen=RESERVOIR)
+
+    def observe(self, value):
+        i = 0
+        while i < len(self.buckets) and value > self.buckets[i]: i += 1
+        self.counts[i] += 1
+        self.count += 1
+        self.sum += value
+        self.recent.append(value)
+
+    def percentile(self, p):
+        if not self.recent: return None
+        values = sorted(self.recent)
+        return values[min(len(values) - 1, math.ceil(p / 100 * len(values)) - 1)]
+
+    def summary(self):
+        return {"count": self.count, "sum": self.sum,
+            "mean": self.sum / self.count if self.count else None,
+            "p50": self.percentile(50), "p95": self.percentile(95), "p99": self.percentile(99)}
+
+class Registry:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.histograms = {}
+        self.counters = collections.Counter()
+        self.gauges = {}
+        self.callbacks = [] # functions returning {name: value}, read at export
+
+    def observe(self, name, value):
+        with self.lock:
+            if name not in self.histograms: self.histograms[name] = Histogram()
+            self.histograms[name].observe(value)
+
+    def count(self, name, n=1):
+        with self.lock:
+            self.counters[name] += n
+
+    def set_gauge(self, name, value):
+        with self.lock:
+            self.gauges[name] = value
+
+    # Sample gauges from fn() whenever metrics are exported
+    def add_callback(self, fn):
+        with self.lock:
+            self.callbacks.append(fn)
+
+    def remove_callback(self, fn):
+        with self.lock:
+            if fn in self.callbacks: self.callbacks.remove(fn)
+
+    def snapshot_gauges(self):
+        gauges = dict(self.gauges)
+        for fn in list(self.callbacks):
+            try:
+                gauges.update(fn())
+            except Exception as e:
+                print("Exception:", e)
+        return gauges
+
+    def as_dict(self):
+        with self.lock:
+            return {
+                "stages": {name: h.summary() for name, h in sorted(self.histograms.items())},
+                "counters": dict(self.counters),
+                "gauges": self.snapshot_gauges(),
+            }
+
+    def prometheus(self):
+        metric = "caption_stage_seconds"
+        lines = [f"# TYPE {metric} histogram"]
+        with self.lock:
+            for name, h in sorted(self.histograms.items()):
+                cumulative = 0
+                for bound, n in zip(h.buckets + (math.inf,), h.counts):
+                    cumulative += n
+                    le = "+Inf" if bound == math.inf else repr(bound)
+                    lines.append(f'{metric}_bucket{{stage="{name}",le="{le}"}} {cumulative}')
+                lines.append(f'{metric}_sum{{stage="{name}"}} {h.sum}')
+                lines.append(f'{metric}_count{{stage="{name}"}} {h.count}')
+            for name, value in sorted(self.counters.items()):
+                lines.append(f"caption_{name}_total {value}")
+            for name, value in sorted(self.snapshot_gauges().items()):
+                if value is not None: lines.append(f"caption_{name} {value}")
+        return "\n".join(lines) + "\n"
+
+    # One line, for the log
+    def summary_line(self):
+        parts = []
+        data = self.as_dict()
+        for name, s in data["stages"].items():
+            if s["count"]:
+                parts.append(f"{name} p50={s['p50']*1000:.0f}ms p95={s['p95']*1000:.0f}ms")
+        parts += [f"{k}={v}" for k, v in data["counters"].items()]
+        parts += [f"{k}={v:.3g}" if isinstance(v, float) else f"{k}={v}"
+            for k, v in data["gauges"].items() if v is not None]
+        return " | ".join(parts)
+
+registry = Registry()
+observe = registry.observe
+count = registry.count
+set_gauge = registry.set_gauge
+
+@contextmanager
+def timer(name):
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        registry.observe(name, time.perf_counter() - start)
+
+# Serve /metrics and /metrics.json on localhost. Returns the server.
+def serve(port):
+    # Imported here, so importing metrics stays cheap
+    from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+    class Handler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            if self.path == "/metrics":
+                data, kind = registry.prometheus().encode(), "text/plain; version=0.0.4"
+            elif self.path == "/metrics.json":
+                data, kind = json.dumps(registry.as_dict()).encode(), "application/json"
+            else:
+                self.send_error(404)
+                return
+            self.send_response(200)
+            self.send_header("Content-Type", kind)
+            self.send_header("Content-Length", str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+
+        def log_message(self, *args):
+            pass
+
+    server = ThreadingHTTPServer(("127.0.0.1", port), Handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+def start_logging(interval):
+    def run():
+        while True:
+            time.sleep(interval)
+            line = registry.summary_line()
+            if line: print("Metrics:", line)
+    threading.Thread(target=run, daemon=True).start()
@@ -0,0 +1,141 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+##
+## Copyright 2024 Henry Kroll <nospam@thenerdshow.com>
+##
+## This program is free software; you can redistribute it and/or modify
+## it under the terms of the GNU General Public License as published by
+## the Free Software Foundation; either version 2 of the License, or
+## (at your option) any later version.
+##
+## This program is distributed in the hope that it will be useful,
+## but WITHOUT ANY WARRANTY; without even the implied warranty of
+## MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+## GNU General Public License for more details.
+##
+## You should have received a copy of the GNU General Public License
+## along with this program; if not, write to the Free Software
+## Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston,
+## MA 02110-1301, USA.
+##
+## Named whisper-jax engine profiles: which checkpoint, in what
+## precision, with which batch sizes and chunk length.
+##
+## ./caption.py --profile small.en-f32
+## ./profiles.py list
+## JAX_PLATFORMS=cpu ./profiles.py calibrate --target-rtf 0.5
+##
+## bfloat16 halves memory and is fast on GPUs and TPUs, but many CPUs
+## have no bfloat16 arithmetic and run float32 faster. calibrate times
+## profiles on this machine (by default, each precision of the model in
+## use) and saves the fastest one that keeps up, so ./caption.py uses it
+## from then on. Add your own profiles here.
+import argparse
+import gc
+import json
+import os
+import sys
+import time
+
+class Profile:
+    def __init__(self, name, checkpoint, dtype="bfloat16", buckets=(1, 2, 4, 8), chunk_length=30):
+        self.name = name
+        self.checkpoint = checkpoint
+        self.dtype = dtype        # a jax.numpy type name
+        self.buckets = buckets    # batch sizes compiled, for catching up on a backlog
+        self.chunk_length = chunk_length # seconds the model sees at once, at most 30
+
+    # English-only (*.en) checkpoints can't translate
+    def multilingual(self):
+        return not self.checkpoint.endswith(".en")
+
+    def __repr__(self):
+        return f"{self.name}: {self.checkpoint} {self.dtype}, batches {self.buckets}, {self.chunk_length}s"
+
+PROFILES = {profile.name: profile for profile in (
+    Profile("small.en", "openai/whisper-small.en"),
+    Profile("small.en-f32", "openai/whisper-small.en", "float32"),
+    Profile("base.en-f32", "openai/whisper-base.en", "float32"),
+    Profile("tiny.en-f32", "openai/whisper-tiny.en", "float32"),
+    Profile("medium.en", "openai/whisper-medium.en", buckets=(1, 2, 4)),
+    Profile("large-v2", "openai/whisper-large-v2", buckets=(1, 2)),
+)}
+DEFAULT = "small.en"
+# calibrate's choice
+SAVED = os.path.expanduser("~/.config/caption_anything/profile")
+
+# The profile calibrate picked, or DEFAULT
+def default_profile():
+    try:
+        with open(SAVED, encoding='utf-8') as f:
+            name = f.read().strip()
+    except OSError:
+        return DEFAULT
+    return name if name in PROFILES else DEFAULT
+
+def save_profile(name):
+    os.makedirs(os.path.dirname(SAVED), exist_ok=True)
+    with open(SAVED, "w", encoding='utf-8') as f:
+        f.write(name + "\n")
+
+# Load each profile in turn and time live-sized chunks through it.
+# Returns a result per profile, fastest first.
+def calibrate(names, seconds=2, repeat=5, log=print):
+    import numpy as np
+    import tqdm_loader
+    from audio_utils import model_rate
+    audio = np.random.default_rng(0).uniform(-0.5, 0.5, int(model_rate * seconds)).astype(np.float32)
+    results = []
+    for name in names:
+        profile = PROFILES[name]
+        start = time.time()
+        try:
+            model = tqdm_loader.load_pipeline(profile, log, buckets=(1,))
+        except Exception as e:
+            log(f"{name}: {e}")
+            continue
+        load_time = time.time() - start
+        inputs = lambda: {"array": audio, "sampling_rate": model_rate}
+        tqdm_loader.stream_generate(inputs(), "transcribe", False, model)
+        start = time.time()
+        for _ in range(repeat):
+            tqdm_loader.stream_generate(inputs(), "transcribe", False, model)
+        rtf = (time.time() - start) / repeat / seconds
+        log(f"{name}: real-time factor {rtf:.3f} (loaded and compiled in {load_time:.1f}s)")
+        results.append({"profile": name, "rtf": rtf, "load_seconds": load_time})
+        del model
+        gc.collect()
+    return sorted(results, key=lambda result: result["rtf"])
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="whisper-jax engine profiles")
+    sub = parser.add_subparsers(dest="command", required=True)
+    sub.add_parser("list", help="show the profiles")
+    p = sub.add_parser("calibrate", help="time profiles here and save the fastest that keeps up")
+    p.add_argument("profiles", nargs="*",
+        help="profiles to try (default: every precision of the current profile's model)")
+    p.add_argument("--target-rtf", type=float, default=0.5,
+        help="seconds of work per second of audio to stay under")
+    p.add_argument("--seconds", type=float, default=2, help="audio per call, like a live chunk")
+    p.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args(argv)
+    if args.command == "list":
+        chosen = default_profile()
+        for name, profile in PROFILES.items():
+            print("*" if name == chosen else " ", profile)
+        return 0
+    unknown = [name for name in args.profiles if name not in PROFILES]
+    if unknown: parser.error(f"unknown profiles: {', '.join(unknown)}")
+    checkpoint = PROFILES[default_profile()].checkpoint
+    names = args.profiles or [name for name, profile in PROFILES.items()
+        if profile.checkpoint == checkpoint]
+    results = calibrate(names, args.seconds, args.repeat,
+        lambda message: print(message, file=sys.stderr))
+    fit = [result for result in results if result["rtf"] <= args.target_rtf]
+    chosen = fit[0]["profile"] if fit else None
+    if chosen: save_profile(chosen)
+    print(json.dumps({"target_rtf": args.target_rtf, "chosen": chosen, "results": results}, indent=2))
+    return 0 if chosen else 1
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,212 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+##
+## Copyright 2024 Henry Kroll <nospam@thenerdshow.com>
+##
+## This program is free software; you can redistribute it and/or modify
+## it under the terms of the GNU General Public License as published by
+## the Free Software Foundation; either version 2 of the License, or
+## (at your option) any later version.
+##
+## This program is distributed in the hope that it will be useful,
+## but WITHOUT ANY WARRANTY; without even the implied warranty of
+## MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+## GNU General Public License for more details.
+##
+## You should have received a copy of the GNU General Public License
+## along with this program; if not, write to the Free Software
+## Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston,
+## MA 02110-1301, USA.
+##
+## Write the session recording to disk while it is being recorded.
+##
+## Blocks go through a queue to a writer thread, so a slow disk never
+## holds up the sound card. The file header is brought up to date every
+## flush_time seconds, so a crash loses at most that much audio and
+## leaves a playable file behind. Memory use stays the same no matter
+## how long the session runs.
+import os
+import queue
+import shutil
+import threading
+import time
+import numpy as np
+import soundfile as sf
+
+class RecordingWriter:
+    def __init__(self, path, rate, channels, format="wav", flush_time=5):
+        self.path = path
+        self.rate = rate
+        self.file = sf.SoundFile(path, 'w', samplerate=rate, channels=channels,
+            format=format.upper())
+        self.flush_time = flush_time
+        self.frames = 0
+        self.queue = queue.Queue()
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+
+    def write(self, block):
+        self.queue.put(block)
+
+    def run(self):
+        flushed = time.monotonic()
+        while True:
+            block = self.queue.get()
+            if block is None: break
+            try:
+                self.file.write(block)
+                self.frames += len(block)
+                if time.monotonic() - flushed > self.flush_time:
+                    self.file.flush() # also rewrites the header
+                    flushed = time.monotonic()
+            except Exception as e:
+                print("Exception:", e)
+
+    def duration(self):
+        return self.frames / self.rate
+
+    # The source is done. Nothing to do until close().
+    def end(self):
+        pass
+
+    # Write what is left and finalize the header
+    def close(self):
+        if self.file.closed: return
+        self.queue.put(None)
+        self.thread.join()
+        self.file.close()
+
+    # Close and move the finished recording to its final name
+    def save(self, filename):
+        self.close()
+        try:
+            os.replace(self.path, filename)
+        except OSError:
+            shutil.move(self.path, filename) # different filesystem
+        self.path = filename
+
+    def discard(self):
+        self.close()
+        if os.path.exists(self.path): os.remove(self.path)
+
+## Several sources in one multichannel recording, side by side. Tracks
+## arrive at their own pace, so frames are held back until every track
+## has them. A track that has ended, or fallen more than max_lag seconds
+## behind (its device was unplugged, say), is padded with silence, so
+## the others are never held back without limit.
+class MultiTrackWriter:
+    def __init__(self, writer, channels, max_lag=5):
+        self.writer = writer
+        self.channels = channels # per track
+        self.pending = [[] for _ in channels]
+        self.buffered = [0] * len(channels)
+        self.ended = [False] * len(channels)
+        self.max_lag = int(writer.rate * max_lag) # frames
+        self.lock = threading.Lock()
+
+    # A RecordingWriter-like object for one track
+    def track(self, index):
+        return Track(self, index)
+
+    def write(self, index, block):
+        with self.lock:
+            if self.ended[index]: return
+            self.pending[index].append(block)
+            self.buffered[index] += len(block)
+            self.pad(self.max_lag)
+            self.write_ready(min(self.buffered))
+
+    # No more audio for this track. The others go on without it.
+    def end(self, index):
+        with self.lock:
+            self.ended[index] = True
+            self.pad(self.max_lag)
+            self.write_ready(min(self.buffered))
+
+    # Fill tracks more than lag frames behind the longest with silence,
+    # up to lag frames behind it. Ended tracks are filled all the way.
+    def pad(self, lag):
+        longest = max(self.buffered)
+        for index, channels in enumerate(self.channels):
+            short = longest - self.buffered[index] - (0 if self.ended[index] else lag)
+            if short > 0:
+                self.pending[index].append(np.zeros((short, channels), np.float32))
+                self.buffered[index] += short
+
+    # Write the first n frames of every track
+    def write_ready(self, n):
+        if not n: return
+        columns = []
+        for index, blocks in enumerate(self.pending):
+            audio = np.concatenate(blocks)
+            columns.append(audio[:n])
+            self.pending[index] = [audio[n:]] if len(audio) > n else []
+            self.buffered[index] -= n
+        self.writer.write(np.hstack(columns))
+
+    # Pad the shorter tracks with silence and write the rest
+    def close(self):
+        with self.lock:
+            self.pad(0)
+            self.write_ready(max(self.buffered))
+        self.writer.close()
+
+    @property
+    def frames(self):
+        return self.writer.frames
+
+    def duration(self):
+        return self.writer.duration()
+
+    @property
+    def path(self):
+        return self.writer.path
+
+    def save(self, filename):
+        self.close()
+        self.writer.save(filename)
+
+    def discard(self):
+        self.close()
+        self.writer.discard()
+
+class Track:
+    def __init__(self, multitrack, index):
+        self.multitrack = multitrack
+        self.index = index
+
+    def write(self, block):
+        self.multitrack.write(self.index, block)
+
+    def end(self):
+        self.multitrack.end(self.index)
+
+## Several sources, one file each: name-1.wav, name-2.wav, ...
+class TrackFiles:
+    def __init__(self, writers):
+        self.writers = writers
+
+    def track(self, index):
+        return self.writers[index]
+
+    @property
+    def frames(self):
+        return max(writer.frames for writer in self.writers)
+
+    @property
+    def path(self):
+        return ", ".join(writer.path for writer in self.writers)
+
+    def duration(self):
+        return max(writer.duration() for writer in self.writers)
+
+    def close(self):
+        for writer in self.writers: writer.close()
+
+    def save(self, filename):
+        base, ext = os.path.splitext(filename)
+        for index, writer in enumerate(self.writers):
+            writer.save(f"{base}-{index + 1}{ext}")
+
+    def discard(self):
+        for writer in self.writers: writer.discard()
@@ -0,0 +1,249 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+##
+## Copyright 2024 Henry Kroll <nospam@thenerdshow.com>
+##
+## This program is free software; you can redistribute it and/or modify
+## it under the terms of the GNU General Public License as published by
+## the Free Software Foundation; either version 2 of the License, or
+## (at your option) any later version.
+##
+## This program is distributed in the hope that it will be useful,
+## but WITHOUT ANY WARRANTY; without even the implied warranty of
+## MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+## GNU General Public License for more details.
+##
+## You should have received a copy of the GNU General Public License
+## along with this program; if not, write to the Free Software
+## Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston,
+## MA 02110-1301, USA.
+##
+## Second pass over saved captions, with a bigger model.
+##
+## ./refine.py talk.wav --checkpoint openai/whisper-large-v2
+## ./refine.py talk.wav --backend cpp --server http://bigbox:7777/inference
+##
+## Live captions need a model small enough to keep up. Refiner reads
+## each caption's audio back from the recording, transcribes it again
+## with a slower, better backend and rewrites the saved caption files
+## with the new text. In the GUI it works one caption at a time, only
+## while the live workers have had nothing to do (and nothing out at a
+## server) for a moment. A decode that has started can't be interrupted,
+## so when both models share this machine (--refine-checkpoint), it
+## waits for Stop/Save and pauses while recording. With a refining
+## server elsewhere (--refine cpp), it works during the recording and
+## carries on after Stop/Save. Progress is kept in NAME.refine.json
+## until the pass is done, so an interrupted pass picks up where it
+## stopped.
+import argparse
+import json
+import os
+import sys
+import threading
+import time
+from audio_utils import to_model_input, model_rate
+from backends import BACKENDS, make_backend
+from caption_sinks import CaptionSinks, SINKS, DEFAULT_FORMATS
+from timeline import RecordingView
+import metrics
+
+PROGRESS = ".refine.json"
+
+# Seconds start to end of a recording, ready for the model, or None if
+# that much hasn't been written yet
+def read_audio(path, start, end):
+    try:
+        audio, rate = RecordingView(path).read(start, end)
+    except (OSError, RuntimeError):
+        return None # still being written, or gone
+    if len(audio) < int(end * rate) - int(start * rate): return None
+    return to_model_input(audio, rate)
+
+# [start, end, text] for each caption saved as base.tsv or base.jsonl
+def read_cues(base):
+    if os.path.exists(base + ".tsv"):
+        with open(base + ".tsv", encoding='utf-8') as f:
+            next(f) # header
+            rows = (line.rstrip("\n").split("\t", 2) for line in f if line.strip())
+            return [[int(start) / 1000, int(end) / 1000, text] for start, end, text in rows]
+    if os.path.exists(base + ".jsonl"):
+        with open(base + ".jsonl", encoding='utf-8') as f:
+            cues = (json.loads(line) for line in f if line.strip())
+            return [[cue["start"], cue["end"], cue["text"]] for cue in cues]
+    raise FileNotFoundError(f"Need {base}.tsv or {base}.jsonl to refine")
+
+class Refiner:
+    def __init__(self, backend, idle=None, ready=None, idle_time=0.5, flush_time=10, log=print,
+            after_save=False):
+        self.backend = backend # expects model_rate audio
+        self.idle = idle # True while live captions have nothing to do
+        self.after_save = after_save # start only once save_to() was called
+        self.ready = ready # wait for this Event before starting
+        self.idle_time = idle_time
+        self.flush_time = flush_time # seconds between rewriting the files
+        self.log = log
+        self.cues = []    # [start, end, text]
+        self.refined = {} # cue index -> new text
+        self.recording = None
+        self.base = None  # where the captions were saved. Then no more cues come.
+        self.formats = DEFAULT_FORMATS
+        self.cond = threading.Condition()
+        self.stopped = False
+        self.thread = threading.Thread(target=self.run, daemon=True, name="refine")
+
+    def start(self):
+        self.thread.start()
+
+    # Live: cue audio is read back from this file while it is recorded
+    def follow(self, recording):
+        with self.cond:
+            self.recording = recording
+            self.cond.notify_all()
+
+    def add(self, start, end, text):
+        with self.cond:
+            self.cues.append([start, end, text])
+            self.cond.notify_all()
+
+    # The recording and captions were saved. Refined text goes into
+    # base + ext for each format from now on.
+    def save_to(self, recording, base, formats=DEFAULT_FORMATS):
+        with self.cond:
+            self.recording, self.base, self.formats = recording, base, tuple(formats)
+            self.cond.notify_all()
+
+    # Carry on from base.refine.json, or start on base.tsv (or .jsonl)
+    def load(self, recording, base, formats=DEFAULT_FORMATS):
+        path = base + PROGRESS
+        if os.path.exists(path):
+            with open(path, encoding='utf-8') as f:
+                progress = json.load(f)
+            self.cues = progress["cues"]
+            self.refined = {int(index): text for index, text in progress["refined"].items()}
+            formats = progress["formats"]
+        else:
+            self.cues = read_cues(base)
+        self.save_to(recording, base, formats)
+
+    # Give up. Files already rewritten stay that way.
+    def stop(self):
+        with self.cond:
+            self.stopped = True
+            self.cond.notify_all()
+
+    def join(self):
+        self.thread.join()
+
+    # Wait until live captions have had nothing to do for idle_time.
+    # False if stopped meanwhile.
+    def wait_idle(self):
+        quiet = None
+        while not self.stopped:
+            if not self.idle: return True
+            if not self.idle():
+                quiet = None
+            elif quiet is None:
+                quiet = time.monotonic()
+            elif time.monotonic() - quiet >= self.idle_time:
+                return True
+            time.sleep(0.05)
+        return False
+
+    def run(self):
+        if self.ready: self.ready.wait()
+        index = 0
+        flushed = time.monotonic()
+        while True:
+            with self.cond:
+                while index in self.refined: index += 1
+                if self.stopped: return
+                if index >= len(self.cues) or (self.after_save and self.base is None):
+                    if self.base is not None: break
+                    self.cond.wait(1) # more captions are coming
+                    continue
+                start, end, text = self.cues[index]
+                recording, saved = self.recording, self.base is not None
+            # Live captions always go first
+            if not self.wait_idle(): return
+            audio = read_audio(recording, start, end) if recording else None
+            if audio is None:
+                with self.cond:
+                    if saved:
+                        self.refined[index] = text # not in the recording. Keep it.
+                    else:
+                        self.cond.wait(1) # not on disk yet
+                continue
+            better = self.transcribe(audio)
+            with self.cond:
+                self.refined[index] = better if better and better != "you" else text
+            if saved and time.monotonic() - flushed > self.flush_time:
+                self.flush()
+                flushed = time.monotonic()
+        self.flush()
+        os.remove(self.base + PROGRESS)
+        changed = sum(1 for index, (start, end, text) in enumerate(self.cues)
+            if self.refined.get(index, text) != text)
+        if self.log: self.log(f"Refined {self.base}: {changed} of {len(self.cues)} captions changed.")
+
+    def transcribe(self, audio):
+        # recognize(), not transcribe(), so the live backend's numbers
+        # don't get mixed up with ours
+        try:
+            with metrics.timer("refine"):
+                text = self.backend.recognize(audio).strip()
+            metrics.count("refined_captions")
+            return text
+        except Exception as e:
+            print("Exception:", e)
+            return ""
+
+    # Rewrite the caption files, and note what is done so far
+    def flush(self):
+        with self.cond:
+            cues = [[start, end, self.refined.get(index, text)]
+                for index, (start, end, text) in enumerate(self.cues)]
+            progress = {"recording": self.recording, "formats": list(self.formats),
+                "cues": self.cues, "refined": {str(k): v for k, v in self.refined.items()}}
+        sinks = CaptionSinks(self.base, self.formats)
+        for start, end, text in cues:
+            sinks.write(start, end, text)
+        sinks.save(self.base)
+        path = self.base + PROGRESS
+        with open(path + ".part", 'w', encoding='utf-8') as f:
+            json.dump(progress, f, ensure_ascii=False)
+        os.replace(path + ".part", path)
+
+def parse_args(argv):
+    parser = argparse.ArgumentParser(description="Re-caption saved recordings with a bigger model")
+    parser.add_argument("recordings", nargs="+", help="recordings saved with their captions")
+    parser.add_argument("--backend", choices=list(BACKENDS), default="jax")
+    parser.add_argument("--checkpoint", help="jax: model to load, e.g. openai/whisper-large-v2")
+    parser.add_argument("--server", action="append", dest="urls", metavar="URL",
+        help="server for network backends")
+    parser.add_argument("--task", choices=("transcribe", "translate"))
+    parser.add_argument("--formats", nargs="+", default=list(DEFAULT_FORMATS), choices=list(SINKS))
+    return parser.parse_args(argv)
+
+def main(argv=None):
+    args = parse_args(sys.argv[1:] if argv is None else argv)
+    options = {k: v for k, v in (("urls", args.urls), ("task", args.task),
+        ("checkpoint", args.checkpoint)) if v is not None}
+    backend = make_backend(args.backend, rate=model_rate, **options)
+    print(backend.warm_up())
+    failed = 0
+    try:
+        for path in args.recordings:
+            refiner = Refiner(backend)
+            try:
+                refiner.load(path, os.path.splitext(path)[0], args.formats)
+            except (OSError, ValueError) as e:
+                print(f"{path}: {e}", file=sys.stderr)
+                failed += 1
+                continue
+            refiner.run()
+    finally:
+        backend.close()
+    return 1 if failed else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,193 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+##
+## Copyright 2024 Henry Kroll <nospam@thenerdshow.com>
+##
+## This program is free software; you can redistribute it and/or modify
+## it under the terms of the GNU General Public License as published by
+## the Free Software Foundation; either version 2 of the License, or
+## (at your option) any later version.
+##
+## This program is distributed in the hope that it will be useful,
+## but WITHOUT ANY WARRANTY; without even the implied warranty of
+## MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+## GNU General Public License for more details.
+##
+## You should have received a copy of the GNU General Public License
+## along with this program; if not, write to the Free Software
+## Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston,
+## MA 02110-1301, USA.
+##
+## Segmenters sit between the recorder and the transcription queue.
+## feed() takes blocks of (frames, channels) audio as they are recorded
+## and returns the finished Chunks, if any. flush() returns what is left.
+## Times are counted in samples, so they never drift from the audio.
+## resize(chunk_time) changes how long chunks get, between feeds.
+import collections
+import numpy as np
+from workers import Chunk
+
+# Cut blindly every chunk_time seconds, like we always did
+class FixedSegmenter:
+    def __init__(self, rate, chunk_time=2, **kwargs):
+        self.rate = rate
+        self.size = int(rate * chunk_time)
+        self.blocks = []
+        self.buffered = 0
+        self.position = 0 # samples already emitted
+
+    def feed(self, block):
+        self.blocks.append(block)
+        self.buffered += len(block)
+        chunks = []
+        while self.buffered >= self.size:
+            audio = np.concatenate(self.blocks)
+            chunks.append(self.emit(audio[:self.size]))
+            rest = audio[self.size:]
+            self.blocks = [rest] if len(rest) else []
+            self.buffered = len(rest)
+        return chunks
+
+    # Cut every chunk_time seconds from now on
+    def resize(self, chunk_time):
+        self.size = int(self.rate * chunk_time)
+
+    def flush(self):
+        if not self.buffered: return []
+        audio = np.concatenate(self.blocks)
+        self.blocks = []
+        self.buffered = 0
+        return [self.emit(audio)]
+
+    def emit(self, audio):
+        start = self.position
+        self.position += len(audio)
+        return Chunk(audio, start / self.rate, self.position / self.rate)
+
+# Energy / zero-crossing voice activity detector. Skips silence and
+# cuts at pauses, so words don't get split and silence isn't sent to
+# the model to hallucinate on.
+class VadSegmenter:
+    def __init__(self, rate, min_time=1.0, max_time=10.0, pause_time=0.4,
+            frame_time=0.03, threshold=3.0, min_level=0.002, **kwargs):
+        self.rate = rate
+        self.frame = int(rate * frame_time)
+        self.min_frames = int(min_time / frame_time)
+        self.max_frames = max(self.min_frames + 1, int(max_time / frame_time))
+        self.pause_frames = max(1, int(pause_time / frame_time))
+        # A segment shorter than min_time is still sent after a long pause
+        self.long_pause = self.pause_frames * 3
+        # Ignore blips shorter than this (clicks, keyboard)
+        self.min_speech = max(1, int(0.15 / frame_time))
+        self.threshold = threshold # speech is this many times the noise floor
+        self.min_level = min_level # RMS below this is always silence
+        self.floor = None          # running noise floor estimate
+        self.pending = None        # samples that don't fill a whole frame yet
+        self.position = 0          # sample index of the next frame
+        self.preroll = collections.deque(maxlen=max(1, int(0.2 / frame_time)))
+        self.reset_segment()
+
+    # Cut after chunk_time seconds of speech if nobody pauses
+    def resize(self, chunk_time):
+        self.max_frames = max(self.min_frames + 1, int(chunk_time * self.rate / self.frame))
+
+    def reset_segment(self):
+        self.frames = []    # audio frames in the current segment
+        self.levels = []    # their RMS levels
+        self.start = None   # sample index where the segment starts
+        self.speech = 0     # speech frames in segment
+        self.silence = 0    # trailing silence frames
+
+    # RMS level and zero-crossing rate of each frame
+    def analyze(self, frames):
+        mono = frames.mean(axis=2) if frames.ndim == 3 else frames
+        levels = np.sqrt(np.mean(np.square(mono, dtype=np.float64), axis=1))
+        signs = np.signbit(mono)
+        zcr = np.count_nonzero(signs[:, 1:] != signs[:, :-1], axis=1) / mono.shape[1]
+        return levels, zcr
+
+    def is_speech(self, level, zcr):
+        if self.floor is None: self.floor = max(level, self.min_level / self.threshold)
+        threshold = max(self.floor * self.threshold, self.min_level)
+        # Quiet, hissy frames are fricatives (s, f, th), not background hum
+        speech = level > threshold or (level > threshold / 2 and zcr > 0.25)
+        # Follow the noise floor down quickly and up slowly
+        if level < self.floor:
+            self.floor = level * 0.1 + self.floor * 0.9
+        elif not speech:
+            self.floor = level * 0.01 + self.floor * 0.99
+        return speech
+
+    def feed(self, block):
+        if self.pending is not None and len(self.pending):
+            block = np.concatenate((self.pending, block))
+        count = len(block) // self.frame
+        self.pending = block[count * self.frame:]
+        if not count: return []
+        frames = block[:count * self.frame].reshape(count, self.frame, *block.shape[1:])
+        levels, zcr = self.analyze(frames)
+        chunks = []
+        for frame, level, z in zip(frames, levels, zcr):
+            chunk = self.step(frame, level, self.is_speech(level, z))
+            if chunk is not None: chunks.append(chunk)
+        return chunks
+
+    # Advance the state machine by one frame
+    def step(self, frame, level, speech):
+        position = self.position
+        self.position += self.frame
+        if self.start is None:
+            if not speech:
+                self.preroll.append(frame)
+                return None
+            # Speech starts. Keep a little lead-in so the first word is whole.
+            self.start = position - len(self.preroll) * self.frame
+            self.frames = list(self.preroll)
+            self.levels = [0.0] * len(self.preroll)
+            self.preroll.clear()
+        self.frames.append(frame)
+        self.levels.append(level)
+        if speech:
+            self.speech += 1
+            self.silence = 0
+        else:
+            self.silence += 1
+        if self.silence >= self.pause_frames:
+            if len(self.frames) >= self.min_frames or self.silence >= self.long_pause:
+                return self.cut(len(self.frames))
+        elif len(self.frames) >= self.max_frames:
+            # No pause in sight. Cut at the quietest frame in the last quarter.
+            tail = len(self.frames) * 3 // 4
+            return self.cut(tail + int(np.argmin(self.levels[tail:])) + 1)
+        return None
+
+    # Emit the first n frames and keep the rest as the next segment
+    def cut(self, n):
+        frames, levels, start, speech = self.frames, self.levels, self.start, self.speech
+        rest, rest_levels = frames[n:], levels[n:]
+        self.reset_segment()
+        if rest:
+            self.start = start + n * self.frame
+            self.frames, self.levels = rest, rest_levels
+            self.speech = speech # a guess, but only used to drop blips
+        if speech < self.min_speech: return None
+        audio = np.concatenate(frames[:n])
+        return Chunk(audio, start / self.rate, (start + len(audio)) / self.rate)
+
+    def flush(self):
+        chunk = None
+        if self.start is not None and self.frames:
+            chunk = self.cut(len(self.frames))
+        self.reset_segment()
+        self.preroll.clear()
+        return [chunk] if chunk is not None else []
+
+SEGMENTERS = {
+    "fixed": FixedSegmenter,
+    "vad": VadSegmenter,
+}
+
+def make_segmenter(name, rate, **kwargs):
+    if name not in SEGMENTERS:
+        raise ValueError(f"Unknown segmenter: {name}")
+    return SEGMENTERS[name](rate, **kwargs)
@@ -0,0 +1,272 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+##
+## Copyright 2024 Henry Kroll <nospam@thenerdshow.com>
+##
+## This program is free software; you can redistribute it and/or modify
+## it under the terms of the GNU General Public License as published by
+## the Free Software Foundation; either version 2 of the License, or
+## (at your option) any later version.
+##
+## This program is distributed in the hope that it will be useful,
+## but WITHOUT ANY WARRANTY; without even the implied warranty of
+## MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+## GNU General Public License for more details.
+##
+## You should have received a copy of the GNU General Public License
+## along with this program; if not, write to the Free Software
+## Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston,
+## MA 02110-1301, USA.
+##
+## One captioning session, without Gtk or a sound card.
+##
+## feed() takes recorded blocks. They are segmented, queued and
+## transcribed on worker threads, and captions come out of emit(start,
+## end, text, tentative[, translation]) in recording order. The GUI
+## feeds it from the microphone; benchmarks feed it from files.
+##
+## Several sessions (one per audio source) can share one backend through
+## a SessionGroup. Its workers take chunks from each source in turn.
+import threading
+import time
+import numpy as np
+from workers import ChunkQueue, FairQueue, Reorder, Workers
+from segmenter import make_segmenter
+from streaming import StreamingDecoder
+from adaptive import ChunkController
+import metrics
+
+# One thread is enough to keep an asynchronous backend busy
+def workers_for(backend):
+    return 1 if backend.asynchronous else backend.concurrency
+
+class Session:
+    def __init__(self, backend, emit, rate=16000, segmenter="vad", chunk_time=2,
+            min_chunk_time=1, max_chunk_time=10, streaming=False, window_time=8,
+            hop_time=1, queue_size=4, backpressure="merge", max_batch_wait=0,
+            ready=None, show_tentative=None, adaptive=False, target_latency=3, group=None):
+        self.backend = backend
+        self.emit = emit
+        self.show_tentative = show_tentative # streaming: words that may still change
+        self.rate = rate
+        # Recorder -> queue -> transcription workers
+        self.queue = ChunkQueue(queue_size, backpressure, group.cond if group else None)
+        self.reorder = Reorder(emit)
+        # Streaming decodes hops in order, so it gets a single worker
+        self.stream = StreamingDecoder(backend.transcribe, rate, window_time) if streaming else None
+        if group:
+            # The group's workers do the transcribing
+            self.workers = group.add(self)
+        elif streaming:
+            self.workers = Workers(self.queue, self.transcribe_chunk, ready=ready)
+        elif backend.batch_size > 1:
+            self.workers = Workers(self.queue, self.transcribe_batch, backend.concurrency,
+                backend.batch_size, max_batch_wait, ready=ready)
+        else:
+            self.workers = Workers(self.queue, self.transcribe_chunk, workers_for(backend),
+                ready=ready)
+        self.group = group
+        self.submitted = 0 # asynchronous backends: chunks sent and not back yet
+        self.returned = threading.Condition()
+        if streaming:
+            self.segments = make_segmenter("fixed", rate, chunk_time=hop_time)
+        else:
+            self.segments = make_segmenter(segmenter, rate, chunk_time=chunk_time,
+                min_time=min_chunk_time, max_time=max_chunk_time)
+        # Streaming hops stay put. Anything else may be resized.
+        self.controller = None
+        if adaptive and not streaming:
+            self.controller = ChunkController(chunk_time, min_chunk_time, max_chunk_time,
+                target_latency, backend.batch_size)
+            self.segments.resize(self.controller.chunk_time)
+            if self.workers.batched: self.workers.batch = self.controller.batch
+        self.recorded = 0 # samples fed so far
+
+    def start(self):
+        if not self.group: self.workers.start()
+
+    # Hand finished segments off to the transcription workers
+    def feed(self, block):
+        self.recorded += len(block)
+        for chunk in self.segments.feed(block):
+            self.queue.put(chunk)
+            # Waiting behind a busy model. Get it ready meanwhile.
+            if chunk.queued_at is not None and chunk.seq is None and self.workers.busy \
+                    and not self.stream:
+                self.backend.prefetch(chunk.audio)
+
+    def duration(self):
+        return self.recorded / self.rate
+
+    # Feed audio from a capture.Reader until capture stops, or until
+    # max_time seconds (returns True then). on_audio(block) sees the same
+    # audio first, e.g. to save it. Lost audio is replaced with silence,
+    # so the recording and captions stay in sync.
+    def follow(self, reader, block, on_audio=None, max_time=None):
+        expected = reader.position
+        while True:
+            first, audio = reader.read(block, timeout=1)
+            if audio is None: return False
+            if first > expected:
+                gap = np.zeros((first - expected, audio.shape[1]), audio.dtype)
+                if on_audio: on_audio(gap)
+                self.feed(gap)
+            expected = first + len(audio)
+            if not len(audio): continue
+            if on_audio: on_audio(audio)
+            self.feed(audio)
+            if max_time and self.duration() > max_time: return True
+
+    # Transcribe what is left. Blocks until the last caption is out.
+    def close(self):
+        for chunk in self.segments.flush():
+            self.queue.put(chunk)
+        self.queue.close()
+        if self.group: return # SessionGroup.close() waits for the workers
+        self.workers.join()
+        self.wait_submitted()
+        if self.stream: self.commit(self.stream.flush())
+
+    # Runs on a worker thread. Backends get the recorder's float32
+    # buffer as-is.
+    def transcribe_chunk(self, chunk):
+        if self.stream:
+            self.commit(self.stream.feed(chunk))
+            return
+        start = time.monotonic()
+        if self.backend.asynchronous:
+            # Returns at once. The Future is done when the text is in.
+            with self.returned: self.submitted += 1
+            try:
+                future = self.backend.submit(chunk.audio, since=chunk.queued_at)
+            except Exception as e:
+                print("Exception:", e)
+                self.returned_one(chunk, "")
+                return
+            future.add_done_callback(lambda future: self.submission_done(chunk, future, start))
+            return
+        tracks = len(self.backend.tracks)
+        try:
+            if tracks > 1:
+                text = self.backend.transcribe_tracks(chunk.audio)
+            else:
+                text = self.backend.transcribe(chunk.audio)
+        except Exception as e:
+            print("Exception:", e)
+            text = [""] * tracks if tracks > 1 else ""
+        self.adapt([chunk], time.monotonic() - start)
+        self.finish([chunk], [text])
+
+    def submission_done(self, chunk, future, start):
+        try:
+            text = future.result()
+        except Exception as e:
+            print("Exception:", e)
+            text = ""
+        self.adapt([chunk], time.monotonic() - start)
+        self.returned_one(chunk, text)
+
+    # An asynchronous chunk is back, or never got sent
+    def returned_one(self, chunk, text):
+        self.finish([chunk], [text])
+        with self.returned:
+            self.submitted -= 1
+            self.returned.notify_all()
+
+    def wait_submitted(self):
+        with self.returned:
+            self.returned.wait_for(lambda: not self.submitted)
+
+    # Several chunks that piled up while the model was busy
+    def transcribe_batch(self, chunks):
+        start = time.monotonic()
+        try:
+            texts = self.backend.transcribe_batch([chunk.audio for chunk in chunks])
+        except Exception as e:
+            print("Exception:", e)
+            texts = [""] * len(chunks)
+        self.adapt(chunks, time.monotonic() - start)
+        self.finish(chunks, texts)
+
+    # Let the controller resize chunks to what the backend can keep up with
+    def adapt(self, chunks, elapsed):
+        if not self.controller: return
+        audio_time = sum(chunk.duration() for chunk in chunks)
+        if self.controller.observe(elapsed, audio_time, len(self.workers.queue)):
+            self.segments.resize(self.controller.chunk_time)
+            if self.workers.batched: self.workers.batch = self.controller.batch
+
+    # Captions go out in recording order, whichever worker finished first.
+    # With several tracks, text is a list and the other tracks (e.g. the
+    # translation) follow tentative in emit's arguments.
+    def finish(self, chunks, texts):
+        for chunk, text in zip(chunks, texts):
+            metrics.observe("chunk_latency", time.monotonic() - chunk.queued_at)
+            if isinstance(text, list):
+                first, *others = [t.strip() for t in text]
+                self.reorder.done(chunk.seq, chunk.start_time, chunk.end_time, first, "", *others)
+            else:
+                self.reorder.done(chunk.seq, chunk.start_time, chunk.end_time, text.strip())
+
+    # Streaming update: keep committed text, show the rest as tentative
+    def commit(self, update):
+        if update.committed:
+            self.emit(update.start_time, update.end_time, update.committed, update.tentative)
+        elif self.show_tentative:
+            self.show_tentative(update.tentative)
+
+## Sessions for several sources sharing one backend. Create the group,
+## then Sessions with group=group, then start().
+class SessionGroup:
+    def __init__(self, backend, max_batch_wait=0, ready=None, streaming=False):
+        self.backend = backend
+        self.cond = threading.Condition() # shared by every session's queue
+        self.queue = FairQueue([], self.cond)
+        self.sessions = []
+        if streaming:
+            self.workers = Workers(self.queue, self.transcribe_chunk, ready=ready)
+        elif backend.batch_size > 1:
+            self.workers = Workers(self.queue, self.transcribe_batch, backend.concurrency,
+                backend.batch_size, max_batch_wait, ready=ready)
+        else:
+            self.workers = Workers(self.queue, self.transcribe_chunk, workers_for(backend),
+                ready=ready)
+
+    # Called by Session. Returns the shared Workers.
+    def add(self, session):
+        self.sessions.append(session)
+        self.queue.queues.append(session.queue)
+        return self.workers
+
+    def start(self):
+        self.workers.start()
+
+    def transcribe_chunk(self, chunk):
+        self.sessions[chunk.source].transcribe_chunk(chunk)
+
+    # Chunks from different sources go through the model together
+    def transcribe_batch(self, chunks):
+        start = time.monotonic()
+        try:
+            texts = self.backend.transcribe_batch([chunk.audio for chunk in chunks])
+        except Exception as e:
+            print("Exception:", e)
+            texts = [""] * len(chunks)
+        elapsed = time.monotonic() - start
+        for index, session in enumerate(self.sessions):
+            mine = [i for i, chunk in enumerate(chunks) if chunk.source == index]
+            if not mine: continue
+            session.adapt([chunks[i] for i in mine], elapsed)
+            session.finish([chunks[i] for i in mine], [texts[i] for i in mine])
+
+    # Nothing queued, being transcribed, or still out at an asynchronous
+    # backend
+    def idle(self):
+        return self.workers.idle() and not any(session.submitted for session in self.sessions)
+
+    # Close every session first
+    def close(self):
+        self.workers.join()
+        for session in self.sessions:
+            session.wait_submitted()
+            if session.stream: session.commit(session.stream.flush())
@@ -0,0 +1,75 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+##
+## Copyright 2024 Henry Kroll <nospam@thenerdshow.com>
+##
+## This program is free software; you can redistribute it and/or modify
+## it under the terms of the GNU General Public License as published by
+## the Free Software Foundation; either version 2 of the License, or
+## (at your option) any later version.
+##
+## This program is distributed in the hope that it will be useful,
+## but WITHOUT ANY WARRANTY; without even the implied warranty of
+## MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+## GNU General Public License for more details.
+##
+## You should have received a copy of the GNU General Public License
+## along with this program; if not, write to the Free Software
+## Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston,
+## MA 02110-1301, USA.
+##
+## Where start-up time goes, for ./caption.py --profile-startup.
+##
+## mark(name) notes how long after start a milestone was reached (window
+## shown, devices listed, model ready). Imports are timed like
+## python -X importtime does: self time and cumulative time per module,
+## for modules imported with the import statement.
+import builtins
+import sys
+import threading
+import time
+
+class StartupProfile:
+    def __init__(self):
+        self.start = time.perf_counter()
+        self.marks = []
+        self.imports = {} # module -> (self seconds, cumulative seconds)
+        self.local = threading.local() # .stack: time spent in child imports
+        self.lock = threading.Lock()
+        self.original = builtins.__import__
+        builtins.__import__ = self.timed_import
+
+    def timed_import(self, name, globals=None, locals=None, fromlist=(), level=0):
+        # Only the first import of a module does any work
+        if level or name in sys.modules:
+            return self.original(name, globals, locals, fromlist, level)
+        if not hasattr(self.local, "stack"): self.local.stack = []
+        stack = self.local.stack
+        stack.append(0.0)
+        start = time.perf_counter()
+        try:
+            return self.original(name, globals, locals, fromlist, level)
+        finally:
+            elapsed = time.perf_counter() - start
+            children = stack.pop()
+            with self.lock:
+                self.imports[name] = (elapsed - children, elapsed)
+            if stack: stack[-1] += elapsed
+
+    def mark(self, name):
+        with self.lock:
+            self.marks.append((name, time.perf_counter() - self.start))
+
+    def stop(self):
+        builtins.__import__ = self.original
+
+    def report(self, top=15):
+        self.stop()
+        lines = ["Startup profile:"]
+        for name, seconds in self.marks:
+            lines.append(f"  {seconds:8.3f}s  {name}")
+        lines.append("Slowest imports (self, cumulative):")
+        slowest = sorted(self.imports.items(), key=lambda item: item[1][1], reverse=True)
+        for name, (own, total) in slowest[:top]:
+            lines.append(f"  {own:8.3f}s {total:8.3f}s  {name}")
+        return "\n".join(lines)
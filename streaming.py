@@ -0,0 +1,118 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+##
+## Copyright 2024 Henry Kroll <nospam@thenerdshow.com>
+##
+## This program is free software; you can redistribute it and/or modify
+## it under the terms of the GNU General Public License as published by
+## the Free Software Foundation; either version 2 of the License, or
+## (at your option) any later version.
+##
+## This program is distributed in the hope that it will be useful,
+## but WITHOUT ANY WARRANTY; without even the implied warranty of
+## MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+## GNU General Public License for more details.
+##
+## You should have received a copy of the GNU General Public License
+## along with this program; if not, write to the Free Software
+## Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston,
+## MA 02110-1301, USA.
+##
+## Sliding-window streaming decoder.
+##
+## Instead of transcribing each chunk on its own, keep the last few
+## seconds of audio and re-decode all of it every hop. Words that two
+## passes in a row agree on (local agreement) are committed and never
+## change again. The rest is a tentative tail that may still change.
+import re
+import numpy as np
+
+# Compare words without case or punctuation getting in the way
+def normalize(word):
+    return re.sub(r"[^\w']", "", word.lower())
+
+# Number of leading words two hypotheses agree on
+def common_prefix(a, b):
+    n = 0
+    for x, y in zip(a, b):
+        if normalize(x) != normalize(y): break
+        n += 1
+    return n
+
+class Update:
+    def __init__(self, committed, start_time, end_time, tentative):
+        self.committed = committed   # newly committed text, may be ""
+        self.start_time = start_time # time span of the committed text
+        self.end_time = end_time
+        self.tentative = tentative   # what might follow
+
+class StreamingDecoder:
+    def __init__(self, recognize, rate, window_time=8):
+        self.recognize = recognize # audio -> text
+        self.rate = rate
+        self.window = int(rate * window_time)
+        self.reset()
+
+    def reset(self):
+        self.audio = None         # rolling window
+        self.window_start = None  # time of the first sample in the window
+        self.previous = []        # last hypothesis for the window
+        self.committed = 0        # words of it already committed
+        self.commit_time = None   # where the last committed text ended
+
+    def duration(self):
+        return 0 if self.audio is None else len(self.audio) / self.rate
+
+    # Feed one hop of audio. Returns an Update.
+    def feed(self, chunk):
+        if self.audio is None:
+            self.audio = chunk.audio
+            self.window_start = self.commit_time = chunk.start_time
+        else:
+            self.audio = np.concatenate((self.audio, chunk.audio))
+        words = self.recognize(self.audio).split()
+        agreed = common_prefix(self.previous, words)
+        self.previous = words
+        new = []
+        if agreed > self.committed:
+            new = words[self.committed:agreed]
+            self.committed = agreed
+        update = self.commit(new, words)
+        if len(self.audio) > self.window:
+            self.slide(update)
+        return update
+
+    def commit(self, new, words):
+        start = self.commit_time
+        if new:
+            # Without word timestamps, assume words are spread evenly
+            self.commit_time = self.window_start + self.duration() * self.committed / len(words)
+        return Update(" ".join(new), start, self.commit_time,
+            " ".join(words[self.committed:]))
+
+    # Drop committed audio from the front of the window
+    def slide(self, update):
+        words = self.previous
+        if self.committed and self.committed < len(words):
+            cut = len(self.audio) * self.committed // len(words)
+            self.audio = self.audio[cut:]
+            self.window_start += cut / self.rate
+            self.previous = words[self.committed:]
+            self.committed = 0
+            if len(self.audio) <= self.window: return
+        # Nothing agrees, or all of it does. Commit everything and start over.
+        update.committed = " ".join(filter(None, (update.committed, update.tentative)))
+        self.window_start += self.duration()
+        update.end_time = self.commit_time = self.window_start
+        update.tentative = ""
+        self.audio = None
+        self.previous = []
+        self.committed = 0
+
+    # End of stream. Commit whatever is tentative.
+    def flush(self):
+        words = self.previous[self.committed:]
+        update = Update(" ".join(words), self.commit_time,
+            self.window_start + self.duration() if self.audio is not None else self.commit_time, "")
+        self.reset()
+        return update
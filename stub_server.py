@@ -0,0 +1,125 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+##
+## Copyright 2024 Henry Kroll <nospam@thenerdshow.com>
+##
+## This program is free software; you can redistribute it and/or modify
+## it under the terms of the GNU General Public License as published by
+## the Free Software Foundation; either version 2 of the License, or
+## (at your option) any later version.
+##
+## This program is distributed in the hope that it will be useful,
+## but WITHOUT ANY WARRANTY; without even the implied warranty of
+## MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+## GNU General Public License for more details.
+##
+## You should have received a copy of the GNU General Public License
+## along with this program; if not, write to the Free Software
+## Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston,
+## MA 02110-1301, USA.
+##
+## Stand-in for whisper-server. Answers POST /inference like whisper.cpp
+## does, after an artificial delay, without loading any model. The
+## "transcript" says how much audio was received, so it is easy to see
+## which chunk an answer belongs to.
+##
+## ./stub_server.py --port 7777 --delay 0.5
+##
+## StubGradioClient does the same for the gradio backend, in-process,
+## standing in for gradio_client.Client and a whisper-jax server that
+## works on `concurrency` requests at a time.
+import argparse
+import io
+import json
+import random
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import soundfile as sf
+from http_transport import form_file
+
+class Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1" # keep-alive
+    delay = 0.0
+    jitter = 0.0
+    fail_rate = 0.0
+
+    def do_GET(self):
+        self.reply(200, {"status": "ok"})
+
+    def do_POST(self):
+        if self.path != "/inference":
+            return self.reply(404, {"error": "not found"})
+        body = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+        wav = form_file(self.headers.get("Content-Type", ""), body)
+        if wav is None:
+            return self.reply(400, {"error": "no file"})
+        time.sleep(self.delay + random.uniform(0, self.jitter))
+        if random.random() < self.fail_rate:
+            return self.reply(500, {"error": "simulated failure"})
+        info = sf.info(io.BytesIO(wav))
+        self.reply(200, {"text": f" {info.duration:.2f} seconds of audio"})
+
+    def reply(self, code, result):
+        data = json.dumps(result).encode()
+        self.send_response(code)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, *args):
+        pass
+
+class StubGradioClient:
+    # One "server" per url, shared by every client of it
+    servers = {}
+    lock = threading.Lock()
+
+    def __init__(self, url, delay=0.2, concurrency=1):
+        self.delay = delay
+        with self.lock:
+            if url not in self.servers:
+                self.servers[url] = ThreadPoolExecutor(concurrency, thread_name_prefix="stub-gradio")
+            self.server = self.servers[url]
+
+    # Like a gradio Job, the Future can be cancelled until the server
+    # starts on it
+    def submit(self, path, task, return_timestamps, api_name=None):
+        return self.server.submit(self.run, path)
+
+    def predict(self, path, task, return_timestamps, api_name=None):
+        return self.submit(path, task, return_timestamps, api_name).result()
+
+    def run(self, path):
+        time.sleep(self.delay)
+        info = sf.info(path)
+        return f" {info.duration:.2f} seconds of audio", self.delay
+
+# Start a stub in the background. Returns the server; call shutdown() on it.
+def serve(port=0, delay=0.0, jitter=0.0, fail_rate=0.0):
+    handler = type("StubHandler", (Handler,),
+        {"delay": delay, "jitter": jitter, "fail_rate": fail_rate})
+    server = ThreadingHTTPServer(("127.0.0.1", port), handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Fake whisper-server for testing")
+    parser.add_argument("--port", type=int, default=7777)
+    parser.add_argument("--delay", type=float, default=0.2, help="seconds per request")
+    parser.add_argument("--jitter", type=float, default=0.0, help="extra random delay")
+    parser.add_argument("--fail-rate", type=float, default=0.0, help="fraction of requests that fail")
+    args = parser.parse_args(argv)
+    server = serve(args.port, args.delay, args.jitter, args.fail_rate)
+    print(f"Stub whisper-server on http://127.0.0.1:{server.server_port}/inference")
+    try:
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        server.shutdown()
+
+if __name__ == "__main__":
+    sys.exit(main())
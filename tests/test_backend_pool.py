@@ -0,0 +1,86 @@
+import io
+import time
+import numpy as np
+import soundfile as sf
+import stub_server
+from backend_pool import Endpoint, EndpointPool, LATENCY
+from http_transport import Transport
+
+def wav(seconds=1.0, rate=16000):
+    buf = io.BytesIO()
+    sf.write(buf, np.zeros(int(rate * seconds), np.float32), rate, format="WAV")
+    return buf.getvalue()
+
+def url(server):
+    return f"http://127.0.0.1:{server.server_port}/inference"
+
+# An Endpoint for a stub whisper-server, as WhisperCppBackend makes them
+def endpoint(address, transports):
+    transport = Transport(address, retries=0, connect_timeout=0.5, timeout=5)
+    transports.append(transport)
+    return Endpoint(address, lambda data: transport.post(data)['text'], transport.check)
+
+def stop(server):
+    server.shutdown()
+    server.server_close()
+
+def wait_for(condition, timeout=5):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        assert time.monotonic() < deadline
+        time.sleep(0.02)
+
+def test_failover_and_ejection():
+    servers = [stub_server.serve() for _ in range(3)]
+    transports = []
+    endpoints = [endpoint(url(server), transports) for server in servers]
+    pool = EndpointPool(endpoints, max_failures=3, check_interval=60)
+    try:
+        stop(servers[0]) # picked first while nothing is in flight
+        for _ in range(6):
+            assert pool.send(wav(0.5)).strip() == "0.50 seconds of audio"
+        # Three failures in a row, then it is left alone
+        assert endpoints[0].ejected
+        assert endpoints[0].requests == 3
+        assert endpoints[1].requests + endpoints[2].requests == 6
+        assert not endpoints[1].ejected and not endpoints[2].ejected
+    finally:
+        pool.close()
+        for transport in transports: transport.close()
+        for server in servers[1:]: stop(server)
+
+def test_health_check_restores_an_ejected_endpoint():
+    servers = [stub_server.serve() for _ in range(2)]
+    transports = []
+    endpoints = [endpoint(url(server), transports) for server in servers]
+    pool = EndpointPool(endpoints, check_interval=0.1)
+    try:
+        port = servers[0].server_port
+        stop(servers[0])
+        wait_for(lambda: endpoints[0].ejected)
+        assert pool.send(wav()).strip() == "1.00 seconds of audio"
+        assert endpoints[0].requests == 0
+        servers[0] = stub_server.serve(port)
+        wait_for(lambda: not endpoints[0].ejected)
+        pool.send(wav())
+        assert endpoints[0].requests == 1
+    finally:
+        pool.close()
+        for transport in transports: transport.close()
+        for server in servers: stop(server)
+
+# Once timed, the slow server only gets chunks when the fast one is busy
+def test_latency_strategy_prefers_the_faster_server():
+    servers = [stub_server.serve(delay=0.3), stub_server.serve()]
+    transports = []
+    slow, fast = [endpoint(url(server), transports) for server in servers]
+    pool = EndpointPool([slow, fast], LATENCY, check_interval=60)
+    try:
+        for _ in range(10): pool.send(wav(0.2))
+        assert slow.requests == 1
+        assert fast.requests == 9
+        assert slow.latency > fast.latency
+    finally:
+        pool.close()
+        for transport in transports: transport.close()
+        for server in servers: stop(server)
@@ -0,0 +1,17 @@
+import pytest
+from caption import parse_args, backend_options
+
+def options(*argv):
+    args, rest = parse_args(list(argv))
+    return backend_options(args)
+
+def test_given_options_reach_the_backend():
+    assert options("--backend", "gradio", "--server", "http://a/", "--task", "translate") == \
+        {"urls": ["http://a/"], "task": "translate"}
+    assert options("--backend", "jax", "--dual") == {"dual": True}
+
+def test_flags_the_backend_does_not_take_are_rejected():
+    with pytest.raises(ValueError, match="cpp backend doesn't take --task, --dual"):
+        options("--backend", "cpp", "--dual", "--task", "translate")
+    with pytest.raises(ValueError, match="--profile"):
+        options("--backend", "gradio", "--profile", "small.en-f32")
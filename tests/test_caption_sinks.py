@@ -0,0 +1,29 @@
+import os
+import time
+from caption_sinks import CaptionSinks
+
+def read(path):
+    with open(path, encoding='utf-8') as f:
+        return f.read()
+
+# A cue followed by a pause reaches the disk without another cue or close()
+def test_last_cue_is_flushed_after_a_pause(tmp_path):
+    base = str(tmp_path / "talk")
+    sinks = CaptionSinks(base, (".txt", ".srt"), flush_time=0.1)
+    sinks.write(0.0, 1.5, "Hello there.")
+    assert "Hello" not in read(base + ".txt.part")
+    time.sleep(0.3)
+    assert "Hello there." in read(base + ".txt.part")
+    assert "00:00:01,500" in read(base + ".srt.part")
+    sinks.discard()
+    assert not os.path.exists(base + ".txt.part")
+
+def test_save_renames_and_close_stops_the_timer(tmp_path):
+    base = str(tmp_path / "talk")
+    sinks = CaptionSinks(base, (".txt", ".tsv"), flush_time=0.1)
+    sinks.write(0.0, 1.0, "One.")
+    sinks.write(1.0, 2.0, "Two.")
+    names = sinks.save(base)
+    time.sleep(0.2) # the timer must not touch the closed files
+    assert names == [base + ".txt", base + ".tsv"]
+    assert read(base + ".tsv").splitlines() == ["start\tend\ttext", "0\t1000\tOne.", "1000\t2000\tTwo."]
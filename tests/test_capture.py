@@ -0,0 +1,68 @@
+import numpy as np
+from backends import FakeBackend
+from capture import RingBuffer
+from session import Session
+
+RATE = 16000
+
+def ramp(start, stop):
+    return np.arange(start, stop, dtype=np.float32).reshape(-1, 1)
+
+def write_blocks(ring, start, stop, block=30):
+    for first in range(start, stop, block):
+        ring.write(ramp(first, min(first + block, stop)))
+
+# Views are contiguous even where the ring wraps round
+def test_reader_sees_every_frame_across_the_wrap():
+    ring = RingBuffer(100)
+    reader = ring.reader()
+    got = []
+    for start in range(0, 400, 70):
+        write_blocks(ring, start, min(start + 70, 400))
+        first, view = reader.read(1000)
+        assert first == start
+        got.append(view.copy())
+    assert np.array_equal(np.concatenate(got), ramp(0, 400))
+    assert reader.overruns == 0 and reader.lost == 0
+
+def test_a_lapped_reader_skips_to_the_oldest_frame_left():
+    ring = RingBuffer(100)
+    reader = ring.reader()
+    write_blocks(ring, 0, 250)
+    first, view = reader.read(1000)
+    assert first == 150
+    assert np.array_equal(view, ramp(150, 250))
+    assert (reader.overruns, reader.lost) == (1, 150)
+    # Lapped again, later on
+    write_blocks(ring, 250, 420)
+    first, view = reader.read(40)
+    assert first == 320
+    assert np.array_equal(view, ramp(320, 360))
+    assert (reader.overruns, reader.lost) == (2, 220)
+    ring.close()
+    first, view = reader.read(1000)
+    assert np.array_equal(view, ramp(360, 420))
+    assert reader.read(1000) == (420, None)
+
+# Audio lost to an overrun comes out as silence, so what follows keeps
+# its place in the recording and in the captions
+def test_follow_pads_lost_audio_and_keeps_timestamps():
+    captions = []
+    backend = FakeBackend(rate=RATE, delay=0.01)
+    session = Session(backend, lambda start, end, text, *others: captions.append((start, end)),
+        RATE, "fixed", chunk_time=1, queue_size=16, backpressure="block")
+    session.start()
+    ring = RingBuffer(RATE)
+    reader = ring.reader()
+    ring.write(np.full((3 * RATE, 1), 0.5, np.float32))
+    ring.close()
+    saved = []
+    assert session.follow(reader, RATE // 10, lambda audio: saved.append(audio.copy())) is False
+    session.close()
+    audio = np.concatenate(saved)
+    assert (reader.overruns, reader.lost) == (1, 2 * RATE)
+    assert len(audio) == 3 * RATE
+    assert not audio[:2 * RATE].any()
+    assert np.all(audio[2 * RATE:] == 0.5)
+    assert session.duration() == 3
+    assert captions == [(0, 1), (1, 2), (2, 3)]
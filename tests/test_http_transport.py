@@ -0,0 +1,89 @@
+import io
+import threading
+from http.server import ThreadingHTTPServer
+import numpy as np
+import soundfile as sf
+import stub_server
+from http_transport import Transport, form_file
+
+def wav(seconds=1.0, rate=16000):
+    buf = io.BytesIO()
+    sf.write(buf, np.zeros(int(rate * seconds), np.float32), rate, format="WAV")
+    return buf.getvalue()
+
+def url(server):
+    return f"http://127.0.0.1:{server.server_port}/inference"
+
+# Counts the TCP connections it is given
+class CountingHandler(stub_server.Handler):
+    connections = 0
+
+    def setup(self):
+        type(self).connections += 1
+        super().setup()
+
+# Hangs up on the first upload without answering, like a server restart
+class DroppingHandler(CountingHandler):
+    dropped = 0
+
+    def do_POST(self):
+        if not DroppingHandler.dropped:
+            DroppingHandler.dropped += 1
+            self.rfile.read(int(self.headers.get("Content-Length", 0)))
+            self.close_connection = True
+            return
+        super().do_POST()
+
+def serve(handler):
+    handler.connections = 0
+    server = ThreadingHTTPServer(("127.0.0.1", 0), handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+def test_form_round_trip():
+    transport = Transport("http://127.0.0.1/inference", {"temperature": "0.2"})
+    data = wav(0.25)
+    body = b"".join((transport.head, data, transport.tail))
+    assert form_file(transport.headers["Content-Type"], body) == data
+    assert form_file(transport.headers["Content-Type"], body, "temperature") == b"0.2"
+    transport.close()
+
+def test_requests_reuse_one_connection():
+    server = serve(CountingHandler)
+    transport = Transport(url(server))
+    try:
+        for seconds in (0.5, 1.0, 1.5, 2.0):
+            assert transport.post(wav(seconds))["text"].strip() == f"{seconds:.2f} seconds of audio"
+        assert transport.check()
+        assert CountingHandler.connections == 1
+    finally:
+        transport.close()
+        server.shutdown()
+        server.server_close()
+
+def test_close_drops_pooled_connections():
+    server = stub_server.serve()
+    transport = Transport(url(server))
+    try:
+        transport.post(wav())
+        adapter = transport.session.get_adapter(transport.url)
+        assert len(adapter.poolmanager.pools)
+        transport.close()
+        assert not len(adapter.poolmanager.pools)
+    finally:
+        server.shutdown()
+        server.server_close()
+
+def test_dropped_connection_is_retried():
+    DroppingHandler.dropped = 0
+    server = serve(DroppingHandler)
+    transport = Transport(url(server), retries=2, backoff=0)
+    try:
+        assert transport.post(wav())["text"].strip() == "1.00 seconds of audio"
+        assert DroppingHandler.dropped == 1
+        assert DroppingHandler.connections == 2
+    finally:
+        transport.close()
+        server.shutdown()
+        server.server_close()
@@ -0,0 +1,43 @@
+import threading
+import time
+import numpy as np
+from backends import FakeBackend
+from inference_server import SharedModel
+from session import Session
+
+RATE = 16000
+
+# Speech faster than the model, so chunks queue behind a busy worker
+# and Session asks the backend to prefetch them
+def test_session_over_shared_model():
+    backend = FakeBackend(rate=RATE, delay=0.2, prepare_time=0.01)
+    model = SharedModel(backend, max_batch_wait=0)
+    captions = []
+    session = Session(model, lambda start, end, text, tentative="": captions.append((start, text)),
+        RATE, "fixed", chunk_time=0.5, queue_size=16, backpressure="block")
+    session.start()
+    block = np.zeros((RATE // 10, 1), np.float32)
+    for _ in range(30):
+        session.feed(block)
+        time.sleep(0.02) # five times real time
+    closing = threading.Thread(target=session.close, daemon=True)
+    closing.start()
+    closing.join(10)
+    model.close()
+    assert not closing.is_alive()
+    assert [start for start, text in captions] == [0.5 * i for i in range(6)]
+    assert all(text.startswith("chunk ") for start, text in captions)
+    assert backend.stats()["calls"] == 6
+
+def test_callers_share_batches():
+    backend = FakeBackend(rate=RATE, delay=0.1, batch_size=8)
+    model = SharedModel(backend, max_batch_wait=0.05)
+    audio = np.zeros((RATE, 1), np.float32)
+    texts = []
+    callers = [threading.Thread(target=lambda: texts.append(model.transcribe(audio)))
+        for _ in range(4)]
+    for caller in callers: caller.start()
+    for caller in callers: caller.join(5)
+    model.close()
+    assert len(texts) == 4
+    assert backend.calls < 4
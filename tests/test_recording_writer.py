@@ -0,0 +1,40 @@
+import numpy as np
+import soundfile as sf
+from recording_writer import RecordingWriter, MultiTrackWriter
+
+RATE = 16000
+
+def block(value, seconds=1):
+    return np.full((RATE * seconds, 1), value, np.float32)
+
+# One source goes quiet for good: the other is padded, not held in memory
+def test_a_stalled_track_does_not_hold_back_the_others(tmp_path):
+    path = str(tmp_path / "all.wav")
+    writer = MultiTrackWriter(RecordingWriter(path, RATE, 2), [1, 1], max_lag=2)
+    writer.write(1, block(0.5))
+    for _ in range(50):
+        writer.write(0, block(0.25))
+        assert max(writer.buffered) <= 2 * RATE
+    writer.close()
+    audio, rate = sf.read(path)
+    assert len(audio) == 50 * RATE
+    assert np.allclose(audio[:, 0], 0.25, atol=1e-3)
+    assert np.allclose(audio[:RATE, 1], 0.5, atol=1e-3)
+    assert not audio[RATE:, 1].any()
+
+# A lagging track that catches up stays in step; an ended one is dropped
+def test_ended_track_is_padded_and_late_writes_ignored(tmp_path):
+    path = str(tmp_path / "all.wav")
+    writer = MultiTrackWriter(RecordingWriter(path, RATE, 2), [1, 1], max_lag=5)
+    writer.write(0, block(0.25, 3))
+    writer.write(1, block(0.5, 2))
+    assert writer.buffered == [RATE, 0]
+    writer.track(1).end()
+    assert writer.buffered == [0, 0]
+    writer.write(1, block(0.5))
+    writer.write(0, block(0.25))
+    writer.close()
+    audio, rate = sf.read(path)
+    assert len(audio) == 4 * RATE
+    assert np.allclose(audio[:2 * RATE, 1], 0.5, atol=1e-3)
+    assert not audio[2 * RATE:, 1].any()
@@ -0,0 +1,27 @@
+import os
+import time
+import numpy as np
+import soundfile as sf
+from backends import FakeBackend
+from refine import Refiner
+
+RATE = 16000
+
+def test_same_device_refines_only_after_save(tmp_path):
+    recording = str(tmp_path / "talk.wav")
+    sf.write(recording, np.zeros(RATE * 3, np.float32), RATE)
+    backend = FakeBackend(rate=RATE)
+    refiner = Refiner(backend, idle=lambda: True, idle_time=0, log=None, after_save=True)
+    refiner.follow(recording)
+    refiner.add(0.0, 1.0, "one")
+    refiner.add(1.0, 2.0, "two")
+    refiner.start()
+    time.sleep(0.3)
+    assert backend.count == 0 # still recording, as far as it knows
+    base = str(tmp_path / "talk")
+    refiner.save_to(recording, base, (".txt", ".tsv"))
+    refiner.join()
+    assert backend.count == 2
+    with open(base + ".txt", encoding='utf-8') as f:
+        assert f.read().splitlines() == ["chunk 0 (1.00 seconds)", "chunk 1 (1.00 seconds)"]
+    assert not os.path.exists(base + ".refine.json")
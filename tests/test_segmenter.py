@@ -0,0 +1,63 @@
+import numpy as np
+import pytest
+from segmenter import FixedSegmenter, VadSegmenter, make_segmenter
+
+RATE = 16000
+
+def tone(seconds, level=0.3, pitch=150):
+    t = np.arange(int(RATE * seconds)) / RATE
+    return (level * np.sin(2 * np.pi * pitch * t)).astype(np.float32).reshape(-1, 1)
+
+def silence(seconds, seed=0):
+    noise = 0.0005 * np.random.default_rng(seed).standard_normal(int(RATE * seconds))
+    return noise.astype(np.float32).reshape(-1, 1)
+
+# Feed audio in recorder-sized blocks, then flush
+def segment(segmenter, audio, block_time=0.1):
+    block = int(RATE * block_time)
+    chunks = []
+    for offset in range(0, len(audio), block):
+        chunks += segmenter.feed(audio[offset:offset + block])
+    return chunks + segmenter.flush()
+
+def test_fixed_cuts_every_chunk_time():
+    chunks = segment(FixedSegmenter(RATE, chunk_time=2), silence(5))
+    assert [(c.start_time, c.end_time) for c in chunks] == [(0, 2), (2, 4), (4, 5)]
+    assert sum(len(c.audio) for c in chunks) == RATE * 5
+
+def test_vad_skips_silence():
+    assert segment(VadSegmenter(RATE), silence(5)) == []
+
+def test_vad_cuts_at_pauses():
+    audio = np.concatenate((silence(1), tone(2), silence(1), tone(1.5), silence(1)))
+    chunks = segment(VadSegmenter(RATE), audio)
+    assert len(chunks) == 2
+    # Each chunk covers its burst of speech, with a little lead-in
+    assert chunks[0].start_time == pytest.approx(1, abs=0.25)
+    assert chunks[0].end_time == pytest.approx(3, abs=0.5)
+    assert chunks[1].start_time == pytest.approx(4, abs=0.25)
+    assert chunks[1].end_time == pytest.approx(5.5, abs=0.5)
+    for chunk in chunks:
+        assert len(chunk.audio) == round((chunk.end_time - chunk.start_time) * RATE)
+
+def test_vad_cuts_long_speech_at_max_time():
+    chunks = segment(VadSegmenter(RATE, max_time=3), np.concatenate((silence(1), tone(10), silence(1))))
+    assert len(chunks) >= 4
+    assert all(chunk.duration() <= 3.01 for chunk in chunks)
+    # Nothing lost between cuts
+    for first, second in zip(chunks, chunks[1:]):
+        assert second.start_time == pytest.approx(first.end_time)
+
+def test_vad_ignores_clicks():
+    audio = np.concatenate((silence(1), tone(0.06), silence(2)))
+    assert segment(VadSegmenter(RATE), audio) == []
+
+def test_vad_times_do_not_depend_on_block_size():
+    audio = np.concatenate((silence(0.7), tone(1.3), silence(1), tone(2), silence(1)))
+    times = lambda block_time: [(c.start_time, c.end_time)
+        for c in segment(VadSegmenter(RATE), audio, block_time)]
+    assert times(0.1) == times(0.037) == times(1)
+
+def test_unknown_segmenter():
+    with pytest.raises(ValueError):
+        make_segmenter("nope", RATE)
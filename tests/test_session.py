@@ -0,0 +1,133 @@
+import threading
+from concurrent.futures import Future
+import numpy as np
+from backends import FakeBackend
+from session import Session, SessionGroup
+
+RATE = 16000
+
+# Run fn on a thread and fail instead of hanging
+def finishes(fn, timeout=5):
+    thread = threading.Thread(target=fn, daemon=True)
+    thread.start()
+    thread.join(timeout)
+    return not thread.is_alive()
+
+def feed_seconds(session, seconds, block_time=0.1):
+    block = np.zeros((int(RATE * block_time), 1), np.float32)
+    for _ in range(round(seconds / block_time)):
+        session.feed(block)
+
+def collect():
+    captions = []
+    def emit(start, end, text, tentative="", *others):
+        captions.append((start, end, text))
+    return captions, emit
+
+def test_drain_emits_every_chunk_in_order():
+    captions, emit = collect()
+    backend = FakeBackend(rate=RATE, delay=0.01, concurrency=3)
+    session = Session(backend, emit, RATE, "fixed", chunk_time=1, queue_size=16,
+        backpressure="block")
+    session.start()
+    feed_seconds(session, 5.5)
+    assert finishes(session.close)
+    assert [(start, end) for start, end, text in captions] == \
+        [(0, 1), (1, 2), (2, 3), (3, 4), (4, 5), (5, 5.5)]
+
+def test_batched_drain():
+    captions, emit = collect()
+    backend = FakeBackend(rate=RATE, delay=0.05, batch_size=4)
+    session = Session(backend, emit, RATE, "fixed", chunk_time=1, queue_size=16,
+        backpressure="block")
+    session.start()
+    feed_seconds(session, 6)
+    assert finishes(session.close)
+    assert [start for start, end, text in captions] == [0, 1, 2, 3, 4, 5]
+    assert backend.calls < 6 # some went through together
+
+def test_group_drains_every_source():
+    backend = FakeBackend(rate=RATE, delay=0.01)
+    group = SessionGroup(backend)
+    outputs = [collect() for _ in range(2)]
+    sessions = [Session(backend, emit, RATE, "fixed", chunk_time=1, queue_size=16,
+        backpressure="block", group=group) for captions, emit in outputs]
+    group.start()
+    for session in sessions: feed_seconds(session, 3)
+    for session in sessions: session.close()
+    assert finishes(group.close)
+    for captions, emit in outputs:
+        assert [start for start, end, text in captions] == [0, 1, 2]
+
+## Asynchronous backend whose jobs finish when the test says so
+class AsyncBackend(FakeBackend):
+    asynchronous = True
+
+    def __init__(self, fail=(), **options):
+        super().__init__(**options)
+        self.fail = fail # which calls to submit() raise
+        self.futures = []
+
+    def submit(self, audio, since=None):
+        index = len(self.futures)
+        self.futures.append(None)
+        if index in self.fail: raise ConnectionError("no server")
+        future = Future()
+        self.futures[index] = future
+        return future
+
+def async_session(backend):
+    captions, emit = collect()
+    session = Session(backend, emit, RATE, "fixed", chunk_time=1, queue_size=16,
+        backpressure="block")
+    session.start()
+    return session, captions
+
+def test_async_results_come_back_in_order():
+    backend = AsyncBackend(rate=RATE)
+    session, captions = async_session(backend)
+    feed_seconds(session, 3)
+    closing = threading.Thread(target=session.close, daemon=True)
+    closing.start()
+    while len(backend.futures) < 3: closing.join(0.01)
+    # Out of order, and close() waits for all of them
+    backend.futures[2].set_result("c")
+    backend.futures[1].set_result("b")
+    assert captions == []
+    assert closing.is_alive()
+    backend.futures[0].set_exception(RuntimeError("server error"))
+    closing.join(5)
+    assert not closing.is_alive()
+    assert [text for start, end, text in captions] == ["", "b", "c"]
+    assert session.submitted == 0
+
+def test_async_submit_failure_does_not_hang_drain():
+    backend = AsyncBackend(fail={1}, rate=RATE)
+    session, captions = async_session(backend)
+    feed_seconds(session, 3)
+    closing = threading.Thread(target=session.close, daemon=True)
+    closing.start()
+    while len(backend.futures) < 3: closing.join(0.01)
+    backend.futures[0].set_result("a")
+    backend.futures[2].set_result("c")
+    closing.join(5)
+    assert not closing.is_alive()
+    # The failed chunk is captioned as nothing, and doesn't hold back the next one
+    assert [text for start, end, text in captions] == ["a", "", "c"]
+    assert session.submitted == 0
+
+def test_group_idle_counts_jobs_in_flight():
+    backend = AsyncBackend(rate=RATE)
+    group = SessionGroup(backend)
+    captions, emit = collect()
+    session = Session(backend, emit, RATE, "fixed", chunk_time=1, group=group)
+    group.start()
+    assert group.idle()
+    feed_seconds(session, 1)
+    while not backend.futures: threading.Event().wait(0.01)
+    threading.Event().wait(0.05)
+    assert not group.idle() # nothing queued or running, but one job is out
+    backend.futures[0].set_result("a")
+    assert group.idle()
+    session.close()
+    assert finishes(group.close)
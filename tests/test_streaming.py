@@ -0,0 +1,72 @@
+import numpy as np
+from pytest import approx
+from streaming import StreamingDecoder, common_prefix
+from workers import Chunk
+
+RATE = 16000
+
+# Answers each pass with the next line of a script, and remembers how
+# much audio it was given
+class Script:
+    def __init__(self, *lines):
+        self.lines = list(lines)
+        self.seen = []
+
+    def __call__(self, audio):
+        self.seen.append(len(audio) / RATE)
+        return self.lines.pop(0)
+
+def hops(decoder, count, start=0):
+    updates = []
+    for second in range(start, start + count):
+        audio = np.zeros((RATE, 1), np.float32)
+        updates.append(decoder.feed(Chunk(audio, second, second + 1)))
+    return updates
+
+def test_common_prefix_ignores_case_and_punctuation():
+    assert common_prefix("The quick, brown".split(), "the quick brown fox".split()) == 3
+    assert common_prefix("a b".split(), "a c".split()) == 1
+
+def test_words_two_passes_agree_on_are_committed():
+    script = Script("the quick", "The quick brown", "the quick brown fox.")
+    decoder = StreamingDecoder(script, RATE)
+    first, second, third = hops(decoder, 3)
+    assert (first.committed, first.tentative) == ("", "the quick")
+    assert (second.committed, second.tentative) == ("The quick", "brown")
+    assert (second.start_time, second.end_time) == (0, approx(4 / 3))
+    assert (third.committed, third.tentative) == ("brown", "fox.")
+    assert (third.start_time, third.end_time) == (approx(4 / 3), approx(2.25))
+    last = decoder.flush()
+    assert (last.committed, last.start_time, last.end_time) == ("fox.", approx(2.25), 3)
+    assert script.seen == [1, 2, 3]
+
+# A tentative word the next pass changes is never committed
+def test_revised_words_stay_tentative():
+    decoder = StreamingDecoder(Script("a b c", "a x y", "a x y z"), RATE)
+    updates = hops(decoder, 3)
+    assert [(u.committed, u.tentative) for u in updates] == \
+        [("", "a b c"), ("a", "x y"), ("x y", "z")]
+
+# Committed audio leaves the front of a full window
+def test_window_slides_past_committed_words():
+    script = Script("one two", "one two three four", "one two three four five six",
+        "five six seven")
+    decoder = StreamingDecoder(script, RATE, window_time=2)
+    updates = hops(decoder, 4)
+    assert [u.committed for u in updates] == ["", "one two", "three four", "five six"]
+    assert script.seen == [1, 2, 3, 2]
+    assert decoder.window_start == 2
+    assert updates[2].end_time == approx(2)
+    assert updates[3].end_time == approx(2 + 2 * 2 / 3)
+
+# With nothing agreed and the window full, everything is committed and
+# decoding starts over with the next hop
+def test_full_window_without_agreement_starts_over():
+    script = Script("a", "b", "c", "d")
+    decoder = StreamingDecoder(script, RATE, window_time=2)
+    updates = hops(decoder, 3)
+    assert [(u.committed, u.tentative) for u in updates] == [("", "a"), ("", "b"), ("c", "")]
+    assert updates[2].end_time == 3
+    update, = hops(decoder, 1, start=3)
+    assert (update.committed, update.tentative, update.start_time) == ("", "d", 3)
+    assert script.seen == [1, 2, 3, 1]
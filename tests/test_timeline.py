@@ -0,0 +1,69 @@
+import numpy as np
+import soundfile as sf
+from timeline import Timeline, RecordingView, wav_layout
+
+RATE = 16000
+
+def timeline(*texts):
+    result = Timeline()
+    for index, text in enumerate(texts):
+        result.add(index, index + 1, text, track=index % 2)
+    return result
+
+def test_search_needs_every_word():
+    t = timeline("The cat sat.", "A dog barked.", "The dog and the cat.", "Thank you.")
+    assert t.search("cat") == [0, 2]
+    assert t.search("DOG cat") == [2]
+    assert t.search("the") == [0, 2]
+    assert t.search("cat giraffe") == [] # no caption has both
+
+# A word never said falls back to a substring of the captions
+def test_search_falls_back_to_substrings():
+    t = timeline("Thank you.", "Photosynthesis is slow.", "Thank you.", "thankyou")
+    assert t.search("synth") == [1]
+    assert t.search("k you") == [0, 2]
+    assert t.search("ankyou") == [3]
+    assert t.search("you. photo") == [] # across two captions
+    assert t.search("") == []
+
+def test_repeated_text_is_stored_once():
+    t = timeline("Thank you.", "Hello.", "Thank you.")
+    assert len(t) == 3 and len(t.offsets) == 3
+    assert t.cue(2) == (2, 3, "Thank you.", 0)
+    assert t.cue(1) == (1, 2, "Hello.", 1)
+    assert [t.at(time) for time in (-1, 0, 1.5, 99)] == [0, 0, 1, 2]
+
+def test_recording_view_slices_the_file(tmp_path):
+    audio = np.linspace(-0.5, 0.5, 3 * RATE, dtype=np.float32).reshape(-1, 1)
+    for subtype in ("PCM_16", "FLOAT"):
+        path = str(tmp_path / f"{subtype}.wav")
+        sf.write(path, audio, RATE, subtype=subtype)
+        view = RecordingView(path)
+        assert view.layout is not None # memory-mapped
+        part, rate = view.read(1.0, 1.5)
+        assert rate == RATE and part.dtype == np.float32
+        assert np.allclose(part, audio[RATE:RATE + RATE // 2], atol=1e-4)
+        assert len(view.read(2.5, 10)[0]) == RATE // 2
+        assert len(view.read(5, 6)[0]) == 0
+
+# While recording, frames written since the last flush are read too
+def test_recording_view_reads_a_growing_file(tmp_path):
+    path = str(tmp_path / "growing.wav")
+    block = np.full((RATE, 1), 0.25, np.float32)
+    with sf.SoundFile(path, "w", RATE, 1, subtype="FLOAT") as f:
+        f.write(block)
+        f.flush()
+        view = RecordingView(path)
+        f.write(block * 2)
+        part, rate = view.read(0.5, 2)
+        assert len(part) == RATE + RATE // 2
+        assert np.allclose(part[-RATE:], 0.5)
+
+def test_other_formats_are_read_with_soundfile(tmp_path):
+    path = str(tmp_path / "take.flac")
+    audio = np.linspace(-0.5, 0.5, 2 * RATE, dtype=np.float32).reshape(-1, 1)
+    sf.write(path, audio, RATE)
+    assert wav_layout(path) is None
+    part, rate = RecordingView(path).read(0.5, 1)
+    assert rate == RATE
+    assert np.allclose(part, audio[RATE // 2:RATE], atol=1e-4)
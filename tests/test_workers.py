@@ -0,0 +1,92 @@
+import threading
+import time
+import numpy as np
+import pytest
+from workers import BLOCK, DROP_OLDEST, MERGE, Chunk, ChunkQueue, FairQueue, Reorder
+
+def chunk(start, seconds=1, rate=10):
+    return Chunk(np.full((seconds * rate, 1), start, np.float32), start, start + seconds)
+
+def test_unknown_policy():
+    with pytest.raises(ValueError):
+        ChunkQueue(2, "nope")
+
+def test_drop_oldest():
+    queue = ChunkQueue(2, DROP_OLDEST)
+    for start in range(4): assert queue.put(chunk(start))
+    assert queue.dropped == 2
+    assert [queue.get().start_time for _ in range(2)] == [2, 3]
+
+def test_merge_joins_the_newest_waiting_chunk():
+    queue = ChunkQueue(2, MERGE)
+    for start in range(4): queue.put(chunk(start))
+    assert queue.merged == 2 and queue.dropped == 0
+    first, second = queue.get(), queue.get()
+    assert (first.start_time, first.end_time) == (0, 1)
+    assert (second.start_time, second.end_time) == (1, 4)
+    assert len(second.audio) == 30
+
+def test_merge_drops_once_chunks_are_as_long_as_they_get(monkeypatch):
+    monkeypatch.setattr("workers.max_merge_time", 2)
+    queue = ChunkQueue(1, MERGE)
+    for start in range(3): queue.put(chunk(start))
+    assert queue.merged == 1 and queue.dropped == 1
+    assert queue.get().start_time == 2
+
+def test_block_waits_for_room():
+    queue = ChunkQueue(1, BLOCK)
+    queue.put(chunk(0))
+    done = threading.Event()
+    putter = threading.Thread(target=lambda: (queue.put(chunk(1)), done.set()))
+    putter.start()
+    assert not done.wait(0.1)
+    assert queue.get().start_time == 0
+    assert done.wait(1)
+    assert queue.get().start_time == 1
+    assert queue.dropped == queue.merged == 0
+
+def test_block_gives_up_when_closed():
+    queue = ChunkQueue(1, BLOCK)
+    queue.put(chunk(0))
+    result = []
+    putter = threading.Thread(target=lambda: result.append(queue.put(chunk(1))))
+    putter.start()
+    time.sleep(0.05)
+    queue.close()
+    putter.join(1)
+    assert result == [False]
+
+def test_close_drains_then_ends():
+    queue = ChunkQueue(4)
+    queue.put(chunk(0))
+    queue.close()
+    assert not queue.put(chunk(1))
+    assert queue.get().seq == 0
+    assert queue.get() is None
+
+def test_get_batch():
+    queue = ChunkQueue(8)
+    for start in range(5): queue.put(chunk(start))
+    assert [c.seq for c in queue.get_batch(3)] == [0, 1, 2]
+    assert [c.seq for c in queue.get_batch(3)] == [3, 4]
+
+def test_fair_queue_takes_turns():
+    cond = threading.Condition()
+    busy, quiet = ChunkQueue(8, cond=cond), ChunkQueue(8, cond=cond)
+    fair = FairQueue([busy, quiet])
+    for start in range(4): busy.put(chunk(start))
+    quiet.put(chunk(10))
+    taken = [fair.get() for _ in range(5)]
+    assert [c.source for c in taken] == [0, 1, 0, 0, 0]
+    assert taken[1].start_time == 10
+
+def test_reorder_emits_in_queue_order():
+    emitted = []
+    reorder = Reorder(lambda *result: emitted.append(result))
+    reorder.done(2, "c")
+    reorder.done(1, "b")
+    assert emitted == []
+    reorder.done(0, "a")
+    assert emitted == [("a",), ("b",), ("c",)]
+    reorder.done(3, "d")
+    assert emitted[-1] == ("d",)
@@ -0,0 +1,169 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+##
+## Copyright 2024 Henry Kroll <nospam@thenerdshow.com>
+##
+## This program is free software; you can redistribute it and/or modify
+## it under the terms of the GNU General Public License as published by
+## the Free Software Foundation; either version 2 of the License, or
+## (at your option) any later version.
+##
+## This program is distributed in the hope that it will be useful,
+## but WITHOUT ANY WARRANTY; without even the implied warranty of
+## MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+## GNU General Public License for more details.
+##
+## You should have received a copy of the GNU General Public License
+## along with this program; if not, write to the Free Software
+## Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston,
+## MA 02110-1301, USA.
+##
+## Every caption of a session, for "Run that by me again?"
+##
+## Timeline keeps times in flat arrays and text in one UTF-8 blob. A
+## caption that comes up again (Whisper likes "Thank you.") is stored
+## once. An inverted index maps each word to the captions containing
+## it, so search stays instant on sessions hours long.
+##
+## RecordingView reads the audio of any caption straight out of the
+## recording. WAV files are memory-mapped, so nothing else is read, and
+## the file may still be growing.
+import os
+import re
+import struct
+import threading
+from array import array
+from bisect import bisect_right
+import numpy as np
+import soundfile as sf
+
+def words_of(text):
+    return re.findall(r"\w+", text.lower())
+
+class Timeline:
+    def __init__(self):
+        self.starts = array("d")
+        self.ends = array("d")
+        self.tracks = array("h")   # which source
+        self.text_ids = array("l") # into the text table
+        # Text id i is blob[offsets[i]:offsets[i + 1]]. folded is the
+        # same text in lower case, for substring search.
+        self.blob = bytearray()
+        self.offsets = array("q", [0])
+        self.folded = bytearray()
+        self.folded_offsets = array("q", [0])
+        self.interned = {} # text -> text id
+        self.words = {}    # word -> array of caption indexes
+        self.lock = threading.Lock()
+
+    def __len__(self):
+        return len(self.starts)
+
+    def add(self, start, end, text, track=0):
+        with self.lock:
+            text_id = self.interned.get(text)
+            if text_id is None:
+                text_id = self.interned[text] = len(self.offsets) - 1
+                self.blob += text.encode()
+                self.offsets.append(len(self.blob))
+                self.folded += text.lower().encode()
+                self.folded_offsets.append(len(self.folded))
+            index = len(self.starts)
+            self.starts.append(start)
+            self.ends.append(end)
+            self.tracks.append(track)
+            self.text_ids.append(text_id)
+            for word in set(words_of(text)):
+                self.words.setdefault(word, array("l")).append(index)
+            return index
+
+    def text(self, index):
+        text_id = self.text_ids[index]
+        return self.blob[self.offsets[text_id]:self.offsets[text_id + 1]].decode()
+
+    # (start, end, text, track)
+    def cue(self, index):
+        with self.lock:
+            return self.starts[index], self.ends[index], self.text(index), self.tracks[index]
+
+    # The caption on screen at time, i.e. the last one that started by then
+    def at(self, time):
+        with self.lock:
+            return max(0, bisect_right(self.starts, time) - 1) if len(self) else None
+
+    # Captions with every word of query in them, in order. If some word
+    # was never said, captions containing query as a substring instead
+    # (part of a word, or words run together).
+    def search(self, query):
+        words = words_of(query)
+        with self.lock:
+            if words and all(word in self.words for word in words):
+                postings = sorted((self.words[word] for word in set(words)), key=len)
+                return sorted(set(postings[0]).intersection(*postings[1:]))
+            return self.find(query.lower().encode())
+
+    def find(self, needle):
+        if not needle: return []
+        found = set()
+        pos = self.folded.find(needle)
+        while pos != -1:
+            text_id = bisect_right(self.folded_offsets, pos) - 1
+            end = self.folded_offsets[text_id + 1]
+            if pos + len(needle) <= end:
+                # One hit per text is enough
+                found.add(text_id)
+                pos = self.folded.find(needle, end)
+            else:
+                pos = self.folded.find(needle, pos + 1) # ran into the next text
+        return [index for index, text_id in enumerate(self.text_ids) if text_id in found]
+
+# Where the samples are in a WAV file: (offset, dtype, channels, rate),
+# or None if it isn't a WAV numpy can read as it is
+def wav_layout(path):
+    dtypes = {(1, 16): "<i2", (1, 32): "<i4", (3, 32): "<f4", (3, 64): "<f8"}
+    with open(path, "rb") as f:
+        riff = f.read(12)
+        if len(riff) < 12 or riff[:4] != b"RIFF" or riff[8:] != b"WAVE": return None
+        layout = None
+        while True:
+            header = f.read(8)
+            if len(header) < 8: return None
+            chunk, size = struct.unpack("<4sI", header)
+            if chunk == b"fmt ":
+                fmt = f.read(size)
+                tag, channels, rate = struct.unpack("<HHI", fmt[:8])
+                bits = struct.unpack("<H", fmt[14:16])[0]
+                if tag == 0xFFFE: tag = struct.unpack("<H", fmt[24:26])[0] # extensible
+                layout = (tag, bits, channels, rate)
+                if size % 2: f.read(1)
+            elif chunk == b"data":
+                if layout is None or (layout[0], layout[1]) not in dtypes: return None
+                tag, bits, channels, rate = layout
+                return f.tell(), np.dtype(dtypes[tag, bits]), channels, rate
+            else:
+                f.seek(size + size % 2, 1)
+
+class RecordingView:
+    def __init__(self, path):
+        self.path = path
+        self.layout = wav_layout(path)
+
+    # (float32 frames from start to end seconds, sample rate). Only
+    # whatever is on disk so far.
+    def read(self, start, end):
+        if self.layout is None:
+            with sf.SoundFile(self.path) as f:
+                first = int(start * f.samplerate)
+                f.seek(min(first, f.frames))
+                return f.read(int(end * f.samplerate) - first, dtype='float32', always_2d=True), f.samplerate
+        offset, dtype, channels, rate = self.layout
+        frame_bytes = dtype.itemsize * channels
+        # The header isn't up to date while recording. The file size is.
+        frames = (os.path.getsize(self.path) - offset) // frame_bytes
+        first = min(max(0, int(start * rate)), frames)
+        last = min(max(first, int(end * rate)), frames)
+        if last == first: return np.zeros((0, channels), np.float32), rate
+        samples = np.memmap(self.path, dtype, "r", offset + first * frame_bytes, (last - first, channels))
+        audio = np.asarray(samples, np.float32)
+        if dtype.kind == "i": audio /= 2 ** (8 * dtype.itemsize - 1)
+        return audio, rate
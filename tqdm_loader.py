@@ -5,23 +5,28 @@
 ##
 ## from https://github.com/sanchit-gandhi/whisper-jax/tree/main/app
 ## If you want a server, use the above.
-## This is a stripped-down, importable version, without multiprocessing
-## And without batching, which only slows it down when run as an app.
+## This is a stripped-down, importable version, without multiprocessing.
+## Batching is only used to catch up on a backlog (tqdm_generate_batch),
+## since it only slows down live captions otherwise.
+import gc
+import importlib
 import logging
 import math
-from whisper_jax import FlaxWhisperPipline
-import jax.numpy as jnp
+import os
 import numpy as np
 import time
-from transformers.pipelines.audio_utils import ffmpeg_read
-# from multiprocessing import Pool
+import metrics
+from profiles import PROFILES, default_profile
 
 task = "transcribe"
 return_timestamps = False
-checkpoint = "openai/whisper-small.en"
 BATCH_SIZE = 1
-CHUNK_LENGTH_S = 30
-# NUM_PROC = 8
+# The checkpoint, dtype, chunk length and the batch sizes
+# tqdm_generate_batch pads to (so each shape compiles only once) come
+# from a profiles.Profile, kept as pipeline.profile.
+# Compiled forward calls are kept here, so the next launch skips compiling
+CACHE_DIR = os.environ.get("CAPTION_ANYTHING_CACHE",
+    os.path.expanduser("~/.cache/caption_anything/jax"))
 
 logger = logging.getLogger("jax_trans2")
 logger.setLevel(logging.INFO)
@@ -29,9 +34,24 @@ logger.setLevel(logging.INFO)
 def identity(batch):
     return batch
 
-# Instantiate the pipeline
+# Instantiate the pipeline. switch_profile() replaces it.
 pipeline = None
 step = 0
+# Encoder and decoder as separate pmapped calls, for dual_generate
+p_encode = p_decode = None
+dual_model = None # the pipeline they were made from
+
+def format_timestamp(seconds: float, always_include_hours: bool = False, decimal_marker: str = "."):
+    if seconds is None: return seconds
+    milliseconds = round(seconds * 1000.0)
+    hours = milliseconds // 3_600_000
+    milliseconds -= hours * 3_600_000
+    minutes = milliseconds // 60_000
+    milliseconds -= minutes * 60_000
+    seconds = milliseconds // 1_000
+    milliseconds -= seconds * 1_000
+    hours_marker = f"{hours:02d}:" if always_include_hours or hours > 0 else ""
+    return f"{hours_marker}{minutes:02d}:{seconds:02d}{decimal_marker}{milliseconds:03d}"
 
 def tqdm_generate(inputs: dict, task: str, return_timestamps: bool):
     inputs_len = inputs["array"].shape[0]
@@ -45,7 +65,7 @@ def tqdm_generate(inputs: dict, task: str, return_timestamps: bool):
         range(num_batches)
     )
 
-    dataloader = pipeline.preprocess_batch(inputs, chunk_length_s=CHUNK_LENGTH_S, batch_size=BATCH_SIZE)
+    dataloader = pipeline.preprocess_batch(inputs, chunk_length_s=pipeline.profile.chunk_length, batch_size=BATCH_SIZE)
     logger.info("pre-processing audio file...")
     # dataloader = pool.map(identity, dataloader)
     dataloader = list(map(identity, dataloader))  # Use list() to convert map object to a list
@@ -73,31 +93,268 @@ def tqdm_generate(inputs: dict, task: str, return_timestamps: bool):
     logger.info("done post-processing")
     return text, runtime
 
-def init_pipeline():
-    global step
-    global pipeline
-    pipeline = FlaxWhisperPipline(checkpoint, dtype=jnp.bfloat16, batch_size=BATCH_SIZE)
-    stride_length_s = CHUNK_LENGTH_S / 6
-    chunk_len = round(CHUNK_LENGTH_S * pipeline.feature_extractor.sampling_rate)
-    stride_left = stride_right = round(stride_length_s * pipeline.feature_extractor.sampling_rate)
+# Features for every chunk of inputs, ready for stream_generate(batches=...).
+# Lets a caller extract them for the next queued chunk while the model
+# works on this one (see JaxBackend.prefetch).
+def prepare(inputs: dict, model=None):
+    model = model or pipeline
+    return list(model.preprocess_batch(inputs, chunk_length_s=model.profile.chunk_length, batch_size=BATCH_SIZE))
+
+# Lean version of tqdm_generate for live captions. Chunks are
+# pre-processed lazily, unless batches from prepare() are given, and
+# nothing is logged or allocated per call beyond what the pipeline
+# itself needs. model is another pipeline from load_pipeline(), or None
+# for this module's.
+def stream_generate(inputs: dict, task: str, return_timestamps: bool, model=None, batches=None):
+    model = model or pipeline
+    if batches is None:
+        batches = model.preprocess_batch(inputs, chunk_length_s=model.profile.chunk_length, batch_size=BATCH_SIZE)
+    batches = iter(batches)
+    model_outputs = []
+    runtime = 0
+    while True:
+        with metrics.timer("preprocess"):
+            batch = next(batches, None)
+        if batch is None: break
+        start_time = time.time()
+        model_outputs.append(model.forward(batch, batch_size=BATCH_SIZE, task=task, return_timestamps=return_timestamps))
+        elapsed = time.time() - start_time
+        metrics.observe("forward", elapsed)
+        runtime += elapsed
+    with metrics.timer("postprocess"):
+        post_processed = model.postprocess(model_outputs, return_timestamps=return_timestamps)
+    if return_timestamps:
+        return "\n".join(f"[{format_timestamp(chunk['timestamp'][0])} -> {format_timestamp(chunk['timestamp'][1])}] {chunk['text']}"
+            for chunk in post_processed.get("chunks")), runtime
+    return post_processed["text"], runtime
+
+# Smallest bucket that holds n items
+def bucket_for(n, buckets):
+    for size in buckets:
+        if size >= n: return size
+    return buckets[-1]
+
+# Transcribe several inputs at once. Their chunks are padded into
+# bucket-sized batches, so a backlog costs one forward per batch
+# instead of one per chunk. Returns a list of texts and the runtime.
+# prepared, if given, has each input's batches from prepare(inputs,
+# model) in its place (or None to pre-process that one here).
+def tqdm_generate_batch(inputs_list: list, task: str, return_timestamps: bool, model=None,
+        prepared=None):
+    if not inputs_list: return [], 0
+    # The same model all the way through, even if the profile is switched
+    model = model or pipeline
+    buckets = model.profile.buckets
+    prepared = prepared or [None] * len(inputs_list)
+    # Pre-process every input, remembering which input each chunk came from
+    features, strides, owners = [], [], []
+    with metrics.timer("preprocess"):
+        for owner, (inputs, batches) in enumerate(zip(inputs_list, prepared)):
+            if batches is None:
+                batches = model.preprocess_batch(inputs, chunk_length_s=model.profile.chunk_length, batch_size=BATCH_SIZE)
+            for batch in batches:
+                features.append(batch["input_features"])
+                strides.extend(batch["stride"])
+                owners.extend([owner] * len(batch["input_features"]))
+        features = np.concatenate(features)
+
+    outputs = [[] for _ in inputs_list]
+    start_time = time.time()
+    max_batch = buckets[-1]
+    for first in range(0, len(features), max_batch):
+        batch = features[first:first + max_batch]
+        # forward() pads the batch up to batch_size
+        with metrics.timer("forward"):
+            tokens = model.forward({"input_features": batch}, batch_size=bucket_for(len(batch), buckets),
+                task=task, return_timestamps=return_timestamps)["tokens"]
+        # Split the outputs back to the inputs they came from
+        for i in range(len(batch)):
+            n = first + i
+            outputs[owners[n]].append({"tokens": tokens[i:i + 1], "stride": [strides[n]]})
+    runtime = time.time() - start_time
+
+    texts = []
+    with metrics.timer("postprocess"):
+        for model_outputs in outputs:
+            post_processed = model.postprocess(model_outputs, return_timestamps=return_timestamps)
+            texts.append(post_processed["text"])
+    return texts, runtime
+
+# Persistent on-disk compilation cache. Returns True if it already had
+# entries, meaning this will be a warm start.
+def enable_compilation_cache(path=CACHE_DIR):
+    import jax
+    os.makedirs(path, exist_ok=True)
+    warm = any(os.scandir(path))
+    jax.config.update("jax_compilation_cache_dir", path)
+    # Cache everything. Even "fast" compiles take seconds on a CPU.
+    jax.config.update("jax_persistent_cache_min_compile_time_secs", 0)
+    jax.config.update("jax_persistent_cache_min_entry_size_bytes", 0)
+    return warm
+
+# Compile (or load from the cache) the forward call for each batch
+# size, by default every bucket of the model's profile
+def warm_up(buckets=None, model=None):
+    model = model or pipeline
+    # Large checkpoints since v3 have 128 mel bins, not 80
+    bins = model.feature_extractor.feature_size
+    timings = {}
+    for size in buckets or model.profile.buckets:
+        start = time.time()
+        random_inputs = {"input_features": np.ones((size, bins, 3000))}
+        model.forward(random_inputs, batch_size=size, return_timestamps=return_timestamps)
+        timings[size] = time.time() - start
+        logger.info(f"batch size {size} ready in {timings[size]:.2f}s")
+    return timings
+
+# How long audio is cut into chunks for the model, and how much each
+# chunk overlaps its neighbors on either side, in samples. The chunk
+# length is the current profile's unless given.
+def chunk_plan(sampling_rate=16000, chunk_length_s=None):
+    if chunk_length_s is None:
+        profile = pipeline.profile if pipeline else PROFILES[default_profile()]
+        chunk_length_s = profile.chunk_length
+    stride_length_s = chunk_length_s / 6
+    chunk_len = round(chunk_length_s * sampling_rate)
+    stride_left = stride_right = round(stride_length_s * sampling_rate)
+    return chunk_len, stride_left, stride_right
+
+# Split the model into its encoder and a decoder-only generate, the same
+# way the pipeline pmaps the whole thing
+def init_dual(model):
+    global p_encode, p_decode, dual_model
+    import jax
+    def encode(params, input_features):
+        return model.model.encode(input_features=input_features, params=params)
+    # generate() skips the encoder when it is handed encoder_outputs
+    def decode(params, input_features, encoder_outputs, forced_decoder_ids, return_timestamps):
+        return model.model.pipeline_generate(input_features, params=params,
+            encoder_outputs=encoder_outputs, forced_decoder_ids=forced_decoder_ids,
+            return_timestamps=return_timestamps, max_length=model.max_length).sequences
+    p_encode = jax.pmap(encode, "input_features")
+    p_decode = jax.pmap(decode, "input_features", in_axes=(0, 0, 0, None), static_broadcasted_argnums=(4,))
+    dual_model = model
+
+# Several tasks ("transcribe", "translate") from one encoder pass per
+# chunk. The encoder is the expensive half of Whisper, so both cost
+# much less than running the pipeline twice. Returns ({task: text},
+# runtime). Needs a multilingual checkpoint (not *.en) to translate.
+def dual_generate(inputs: dict, tasks=("transcribe", "translate")):
+    import jax
+    from flax.core.frozen_dict import freeze
+    from flax.training.common_utils import shard
+    model = pipeline
+    if dual_model is not model: init_dual(model)
+    encode, decode = p_encode, p_decode
+    params = freeze(model.params)
+    outputs = {task: [] for task in tasks}
+    runtime = 0
+    for batch in model.preprocess_batch(inputs, chunk_length_s=model.profile.chunk_length, batch_size=BATCH_SIZE):
+        features = batch["input_features"]
+        count = len(features)
+        if count < BATCH_SIZE:
+            padding = np.zeros((BATCH_SIZE - count, *features.shape[1:]), features.dtype)
+            features = np.concatenate([features, padding])
+        features = shard(features)
+        start_time = time.time()
+        with metrics.timer("encoder"):
+            encoder_outputs = encode(params, features)
+        for task in tasks:
+            ids = model.get_forced_decoder_ids(task=task, return_timestamps=False)
+            with metrics.timer("decoder"):
+                tokens = decode(params, features, encoder_outputs, ids, False)
+                tokens = jax.device_get(tokens.reshape(-1, model.max_length))[:count]
+            outputs[task].append({"tokens": tokens[:, None, :], "stride": batch["stride"]})
+        runtime += time.time() - start_time
+    texts = {}
+    with metrics.timer("postprocess"):
+        for task in tasks:
+            texts[task] = model.postprocess(outputs[task], return_timestamps=False)["text"]
+    return texts, runtime
+
+# Transcribe one chunk of up to the profile's chunk length with Whisper's
+# own timestamps. Returns a list of (start, end, text) in seconds.
+def generate_segments(inputs: dict, task: str, model=None):
+    model = model or pipeline
+    duration = len(inputs["array"]) / inputs["sampling_rate"]
+    with metrics.timer("preprocess"):
+        batch = next(model.preprocess_batch(inputs, chunk_length_s=0, batch_size=BATCH_SIZE))
+    with metrics.timer("forward"):
+        model_outputs = [model.forward(batch, batch_size=BATCH_SIZE, task=task, return_timestamps=True)]
+    with metrics.timer("postprocess"):
+        post_processed = model.postprocess(model_outputs, return_timestamps=True)
+    segments = []
+    for chunk in post_processed.get("chunks", []):
+        start, end = chunk["timestamp"]
+        segments.append((start or 0.0, duration if end is None else end, chunk["text"]))
+    return segments
+
+# A profiles.Profile's pipeline, loaded but not compiled yet
+def new_pipeline(profile):
+    import jax.numpy as jnp
+    from whisper_jax import FlaxWhisperPipline
+    model = FlaxWhisperPipline(profile.checkpoint, dtype=getattr(jnp, profile.dtype), batch_size=BATCH_SIZE)
+    model.profile = profile
+    return model
+
+def set_pipeline(model):
+    global pipeline, step
+    chunk_len, stride_left, stride_right = chunk_plan(model.feature_extractor.sampling_rate,
+        model.profile.chunk_length)
     step = chunk_len - stride_left - stride_right
-    # pool = Pool(NUM_PROC)
-    logger.info("compiling forward call...")
+    pipeline = model
+
+# Load the model and compile the batch-size-1 forward call, which is all
+# live captions need. Call warm_up() later for the bigger buckets.
+# jax and whisper-jax are imported only now, so importing this module is
+# cheap. progress(message) hears about each step. profile is a
+# profiles.Profile, by default the one profiles.py calibrate chose.
+def init_pipeline(progress=None, profile=None):
+    profile = profile or PROFILES[default_profile()]
+    progress = progress or logger.info
+    progress("Importing whisper-jax...")
+    start = time.time()
+    # Imported here only to time it. new_pipeline() uses them later.
+    importlib.import_module("jax.numpy")
+    importlib.import_module("whisper_jax")
+    import_time = time.time() - start
+    warm = enable_compilation_cache()
+    progress(f"Loading {profile.checkpoint} ({profile.dtype})...")
     start = time.time()
-    random_inputs = {"input_features": np.ones((BATCH_SIZE, 80, 3000))}
-    random_timestamps = pipeline.forward(random_inputs, batch_size=BATCH_SIZE, return_timestamps=return_timestamps)
-    compile_time = time.time() - start
-    logger.info(f"compiled in {compile_time}s")
+    set_pipeline(new_pipeline(profile))
+    load_time = time.time() - start
+    progress("Compiling..." if not warm else "Loading compiled model...")
+    compile_time = warm_up((BATCH_SIZE,))[BATCH_SIZE]
+    kind = "warm" if warm else "cold"
+    logger.info(f"{kind} start: loaded in {load_time:.2f}s, compiled in {compile_time:.2f}s")
+    return {"start": kind, "import_time": import_time, "load_time": load_time,
+        "compile_time": compile_time}
+
+# Load another profile next to the current one, e.g. a larger model for
+# refine.py, and compile it for the given batch sizes (default: all of
+# the profile's). Returns the pipeline, to pass to stream_generate(model=...).
+def load_pipeline(profile, progress=None, buckets=None):
+    progress = progress or logger.info
+    enable_compilation_cache()
+    progress(f"Loading {profile.checkpoint} ({profile.dtype})...")
+    model = new_pipeline(profile)
+    progress(f"Compiling {profile.name}...")
+    warm_up(buckets, model)
+    return model
+
+# Load and compile profile while the current model carries on, then
+# switch over in one assignment. Calls already running finish on the
+# old model, whose memory is freed once they let go of it.
+def switch_profile(profile, progress=None):
+    global p_encode, p_decode, dual_model
+    model = load_pipeline(profile, progress)
+    set_pipeline(model)
+    p_encode = p_decode = dual_model = None
+    gc.collect()
+    (progress or logger.info)(f"Switched to {profile.name}.")
 
 if __name__ == "__main__":
-    # Example usage
-    init_pipeline()
-    # Load the audio file
-    with open("out.wav", "rb") as f:
-        inputs = f.read()
-    # ffmpeg_read also converts inputs to the required type numpy.ndarray
-    inputs = ffmpeg_read(inputs, pipeline.feature_extractor.sampling_rate)
-    inputs = {"array": inputs, "sampling_rate": pipeline.feature_extractor.sampling_rate}
-    logger.info("done loading")
-    text, runtime = tqdm_generate(inputs, task=task, return_timestamps=return_timestamps)
-    print(text, runtime)
+    # Transcribe saved recordings. See ./batch_transcribe.py --help
+    import sys
+    from batch_transcribe import main
+    sys.exit(main(["--backend", "jax"] + (sys.argv[1:] or ["out.wav"])))
@@ -0,0 +1,257 @@
+#!/usr/bin/env python
+# -*- coding: utf-8 -*-
+##
+## Copyright 2024 Henry Kroll <nospam@thenerdshow.com>
+##
+## This program is free software; you can redistribute it and/or modify
+## it under the terms of the GNU General Public License as published by
+## the Free Software Foundation; either version 2 of the License, or
+## (at your option) any later version.
+##
+## This program is distributed in the hope that it will be useful,
+## but WITHOUT ANY WARRANTY; without even the implied warranty of
+## MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+## GNU General Public License for more details.
+##
+## You should have received a copy of the GNU General Public License
+## along with this program; if not, write to the Free Software
+## Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston,
+## MA 02110-1301, USA.
+##
+## Capture -> inference hand-off.
+##
+## The recorder puts audio chunks into a bounded ChunkQueue. Worker
+## threads take them out and run the (slow) transcription, so the
+## Gtk main loop only ever has to display the result.
+import collections
+import threading
+import time
+import numpy as np
+import metrics
+
+# What to do when the queue is full because transcription fell behind
+DROP_OLDEST = "drop_oldest" # Throw away the oldest waiting chunk
+MERGE = "merge"             # Glue the new chunk onto the newest waiting one
+BLOCK = "block"             # Make the recorder wait (may cause dropouts)
+POLICIES = (DROP_OLDEST, MERGE, BLOCK)
+
+# Whisper sees at most 30 seconds at once. Don't merge beyond that.
+max_merge_time = 30
+
+class Chunk:
+    def __init__(self, audio, start_time, end_time):
+        self.audio = audio
+        self.start_time = start_time
+        self.end_time = end_time
+        self.seq = None # order in which workers took it from the queue
+        self.source = None # which queue of a FairQueue it came from
+        self.queued_at = None # time.monotonic() when it was queued
+
+    def duration(self):
+        return self.end_time - self.start_time
+
+    def merge(self, other):
+        self.audio = np.concatenate((self.audio, other.audio))
+        self.end_time = other.end_time
+
+# Queues that share a FairQueue must share its Condition, too
+class ChunkQueue:
+    def __init__(self, maxsize=4, policy=MERGE, cond=None):
+        if policy not in POLICIES:
+            raise ValueError(f"Unknown backpressure policy: {policy}")
+        self.maxsize = max(1, maxsize)
+        self.policy = policy
+        self.items = collections.deque()
+        self.cond = cond or threading.Condition()
+        self.closed = False
+        self.dropped = 0
+        self.merged = 0
+        self.taken = 0 # chunks handed to workers so far
+
+    def __len__(self):
+        with self.cond:
+            return len(self.items)
+
+    def put(self, chunk):
+        with self.cond:
+            if self.closed: return False
+            if len(self.items) >= self.maxsize:
+                if self.policy == BLOCK:
+                    while len(self.items) >= self.maxsize and not self.closed:
+                        self.cond.wait()
+                    if self.closed: return False
+                elif self.policy == MERGE and \
+                        self.items[-1].duration() + chunk.duration() <= max_merge_time:
+                    self.items[-1].merge(chunk)
+                    self.merged += 1
+                    metrics.count("merged_chunks")
+                    return True
+                else:
+                    # DROP_OLDEST, or the newest chunk is as long as it gets
+                    self.items.popleft()
+                    self.dropped += 1
+                    metrics.count("dropped_chunks")
+            chunk.queued_at = time.monotonic()
+            self.items.append(chunk)
+            metrics.set_gauge("queue_depth", len(self.items))
+            self.cond.notify_all()
+            return True
+
+    # Returns the next chunk, or None once the queue is closed and empty.
+    def get(self):
+        with self.cond:
+            while not self.items and not self.closed:
+                self.cond.wait()
+            if not self.items: return None
+            chunk = self.take()
+            self.cond.notify_all()
+            return chunk
+
+    # Number chunks as they leave, so Reorder can put results back in order
+    def take(self):
+        chunk = self.items.popleft()
+        chunk.seq = self.taken
+        self.taken += 1
+        metrics.set_gauge("queue_depth", len(self.items))
+        if chunk.queued_at is not None:
+            metrics.observe("queue_wait", time.monotonic() - chunk.queued_at)
+        return chunk
+
+    # Returns up to max_items chunks, waiting at most max_wait seconds for
+    # more to arrive after the first one. An empty list means closed.
+    def get_batch(self, max_items, max_wait=0):
+        first = self.get()
+        if first is None: return []
+        batch = [first]
+        deadline = time.monotonic() + max_wait
+        with self.cond:
+            while len(batch) < max_items:
+                if not self.items:
+                    timeout = deadline - time.monotonic()
+                    if timeout <= 0 or self.closed: break
+                    self.cond.wait(timeout)
+                    continue
+                batch.append(self.take())
+            self.cond.notify_all()
+        return batch
+
+    # Stop accepting chunks. Workers finish what is already queued.
+    def close(self):
+        with self.cond:
+            self.closed = True
+            self.cond.notify_all()
+
+# Several sources, one set of workers. Takes chunks from each queue in
+# turn, so a busy source can't starve a quiet one. Each chunk's source
+# is set to the index of its queue. Same get/get_batch as ChunkQueue.
+class FairQueue:
+    def __init__(self, queues, cond=None):
+        self.queues = queues
+        self.cond = cond or queues[0].cond
+        self.turn = 0 # queue to try first
+
+    def __len__(self):
+        with self.cond:
+            return sum(len(q.items) for q in self.queues)
+
+    # Next chunk, round robin, or None if every queue is empty
+    def take(self):
+        for i in range(len(self.queues)):
+            index = (self.turn + i) % len(self.queues)
+            if self.queues[index].items:
+                self.turn = index + 1
+                chunk = self.queues[index].take()
+                chunk.source = index
+                return chunk
+        return None
+
+    def closed(self):
+        return all(q.closed for q in self.queues)
+
+    # Returns the next chunk, or None once every queue is closed and empty
+    def get(self):
+        with self.cond:
+            while True:
+                chunk = self.take()
+                if chunk is not None or self.closed(): break
+                self.cond.wait()
+            self.cond.notify_all()
+            return chunk
+
+    def get_batch(self, max_items, max_wait=0):
+        first = self.get()
+        if first is None: return []
+        batch = [first]
+        deadline = time.monotonic() + max_wait
+        with self.cond:
+            while len(batch) < max_items:
+                chunk = self.take()
+                if chunk is None:
+                    timeout = deadline - time.monotonic()
+                    if timeout <= 0 or self.closed(): break
+                    self.cond.wait(timeout)
+                    continue
+                batch.append(chunk)
+            self.cond.notify_all()
+        return batch
+
+# Several workers finish out of order. Reorder holds results back until
+# everything taken from the queue before them is done.
+class Reorder:
+    def __init__(self, emit):
+        self.emit = emit
+        self.lock = threading.Lock()
+        self.pending = {}
+        self.next = 0
+
+    # Every chunk taken from the queue must be reported exactly once
+    def done(self, seq, *result):
+        with self.lock:
+            self.pending[seq] = result
+            while self.next in self.pending:
+                self.emit(*self.pending.pop(self.next))
+                self.next += 1
+
+# With batch > 1, handler gets a list of chunks instead of one chunk.
+# batch may be changed later, but stays above 1 if it started there.
+# If a ready Event is given, chunks stay queued until it is set.
+class Workers:
+    def __init__(self, queue, handler, count=1, batch=1, max_wait=0, ready=None):
+        self.queue = queue
+        self.handler = handler
+        self.ready = ready
+        self.batch = batch
+        self.batched = batch > 1
+        self.max_wait = max_wait
+        self.busy = 0 # handlers running right now
+        self.lock = threading.Lock()
+        self.threads = [threading.Thread(target=self.run, daemon=True)
+            for _ in range(max(1, count))]
+
+    def start(self):
+        for t in self.threads: t.start()
+
+    def next(self):
+        if self.batched:
+            return self.queue.get_batch(self.batch, self.max_wait) or None
+        return self.queue.get()
+
+    def run(self):
+        if self.ready: self.ready.wait()
+        while True:
+            chunk = self.next()
+            if chunk is None: break
+            with self.lock: self.busy += 1
+            try:
+                self.handler(chunk)
+            except Exception as e:
+                print("Exception:", e)
+            finally:
+                with self.lock: self.busy -= 1
+
+    # Nothing queued and nothing being handled
+    def idle(self):
+        return not self.busy and not len(self.queue)
+
+    def join(self):
+        for t in self.threads: t.join()